@@ -1,20 +1,41 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, make_response
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, make_response, Response, stream_with_context, g
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.dialects import postgresql, sqlite
 from flask_wtf import FlaskForm
 from wtforms import StringField, PasswordField, TextAreaField, FloatField, SelectField, IntegerField
-from wtforms.validators import DataRequired, Email, Length, EqualTo, NumberRange
+from wtforms.validators import DataRequired, Email, Length, EqualTo, NumberRange, Optional
 from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
+from sqlalchemy.exc import IntegrityError
 import os
+import csv
+import math
+import base64
+import json
+import time
+import hashlib
+import zlib
+import atexit
+import click
 from functools import wraps
+import search_index
+from page_cache import page_cache, cached_page, add_cache_tags
+from events import event_bus, StreamLimiter
+from driver_locations import LocationStore, validate_points, validate_coordinates, haversine_km, KM_PER_DEGREE
+from dispatch import Dispatcher, plan_assignments
+from routing import RoutePlanner, Stop, PICKUP, DROPOFF
 
 # Import email notifications
 try:
-    from notifications import send_notification, email_service
+    from notifications import send_notification, deliver_email_batch, email_service, email_outbox, DIGEST_TYPES
     EMAIL_ENABLED = True
     print("✅ Email notifications enabled")
 except ImportError:
     EMAIL_ENABLED = False
+    email_outbox = None
+    DIGEST_TYPES = {}
     print("⚠️ Email notifications disabled - create notifications.py")
     def send_notification(user_id, message, notification_type="info", email_data=None):
         print(f"📱 NOTIFICATION [{notification_type.upper()}] to User {user_id}: {message}")
@@ -22,8 +43,9 @@ except ImportError:
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'msosihub-secret-key-2025'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///msosihub.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///msosihub.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['IDEMPOTENCY_KEY_TTL_HOURS'] = float(os.environ.get('IDEMPOTENCY_KEY_TTL_HOURS', 24))
 
 db = SQLAlchemy(app)
 
@@ -40,19 +62,30 @@ class User(db.Model):
     user_type = db.Column(db.String(20), default="customer")  # customer, restaurant, driver, admin
     wallet_balance = db.Column(db.Float, default=0.0)  # Monthly prepaid wallet
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index("ix_user_created_id", "created_at", "id"),  # admin user listing, keyset order
+    )
 
 class Restaurant(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False, index=True)
     name = db.Column(db.String(100), nullable=False)
     description = db.Column(db.Text)
     address = db.Column(db.Text, nullable=False)
     phone = db.Column(db.String(20), nullable=False)
+    latitude = db.Column(db.Float)  # pickup point; null until the restaurant sets it
+    longitude = db.Column(db.Float)
     is_active = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     user = db.relationship('User', backref='restaurants')
     dishes = db.relationship('Dish', backref='restaurant', lazy=True)
+    
+    __table_args__ = (
+        db.Index("ix_restaurant_created_id", "created_at", "id"),  # admin restaurant listing, keyset order
+        db.Index("ix_restaurant_lat_lng", "latitude", "longitude"),  # bounding-box searches
+    )
 
 class Dish(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -64,6 +97,11 @@ class Dish(db.Model):
     is_available = db.Column(db.Boolean, default=True)
     inventory = db.Column(db.Integer, default=100)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index("ix_dish_restaurant_available", "restaurant_id", "is_available"),  # menus
+        db.Index("ix_dish_category_price", "category", "price"),  # search filters
+    )
 
 class Order(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -77,22 +115,517 @@ class Order(db.Model):
     phone = db.Column(db.String(20), nullable=False)
     driver_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=True)
     special_instructions = db.Column(db.Text)
+    delivery_latitude = db.Column(db.Float)  # pin dropped at checkout, used to route drivers
+    delivery_longitude = db.Column(db.Float)
+    picked_up_at = db.Column(db.DateTime)  # when the driver collected it from the restaurant
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     user = db.relationship('User', foreign_keys=[user_id], backref='orders')
     restaurant = db.relationship('Restaurant', backref='orders')
     driver = db.relationship('User', foreign_keys=[driver_id], backref='deliveries')
     items = db.relationship('OrderItem', backref='order', lazy=True)
+    
+    # One index per dashboard access path; equality columns first, then the range/sort column
+    __table_args__ = (
+        db.Index("ix_order_restaurant_created", "restaurant_id", "created_at"),  # restaurant dashboards
+        db.Index("ix_order_user_created", "user_id", "created_at"),  # my_orders, user details
+        db.Index("ix_order_driver_created", "driver_id", "created_at"),  # driver history
+        db.Index("ix_order_status_driver", "status", "driver_id"),  # ready/unassigned feed, deliveries
+        db.Index("ix_order_payment_created", "payment_status", "created_at", "total_amount"),  # revenue over a range, index-only
+        db.Index("ix_order_created_id", "created_at", "id"),  # admin listings and reports, keyset order
+        db.Index("ix_order_status_created_id", "status", "created_at", "id"),  # admin listing filtered by status
+    )
 
 class OrderItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    order_id = db.Column(db.Integer, db.ForeignKey("order.id"), nullable=False)
+    order_id = db.Column(db.Integer, db.ForeignKey("order.id"), nullable=False, index=True)
     dish_id = db.Column(db.Integer, db.ForeignKey("dish.id"), nullable=False)
     quantity = db.Column(db.Integer, nullable=False)
     price = db.Column(db.Float, nullable=False)
     
     dish = db.relationship('Dish', backref='order_items')
 
+class Cart(db.Model):
+    """Server-side shopping cart; the session cookie only carries its id
+    
+    restaurant_id, item_count and total are adjusted on every change by the cart
+    helpers, so reading them never means summing the items. A user has at most one.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    restaurant_id = db.Column(db.Integer, db.ForeignKey("restaurant.id"), nullable=True)
+    item_count = db.Column(db.Integer, default=0, nullable=False)
+    total = db.Column(db.Float, default=0.0, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    items = db.relationship('CartItem', backref='cart', lazy=True, cascade="all, delete-orphan")
+    
+    __table_args__ = (
+        db.Index("uq_cart_user", "user_id", unique=True),
+    )
+
+class CartItem(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    cart_id = db.Column(db.Integer, db.ForeignKey("cart.id"), nullable=False)
+    dish_id = db.Column(db.Integer, db.ForeignKey("dish.id"), nullable=False)
+    title = db.Column(db.String(100), nullable=False)
+    price = db.Column(db.Float, nullable=False)  # price when added
+    quantity = db.Column(db.Integer, nullable=False)
+    
+    __table_args__ = (
+        db.UniqueConstraint("cart_id", "dish_id", name="uq_cart_item_dish"),
+    )
+
+class DriverLocation(db.Model):
+    """Append-only history of driver pings, written in batches by the LocationStore"""
+    id = db.Column(db.Integer, primary_key=True)
+    driver_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    latitude = db.Column(db.Float, nullable=False)
+    longitude = db.Column(db.Float, nullable=False)
+    accuracy = db.Column(db.Float)  # metres, as reported by the device
+    recorded_at = db.Column(db.DateTime, nullable=False)
+    
+    __table_args__ = (
+        db.Index("ix_driver_location_driver_recorded", "driver_id", "recorded_at"),  # a driver's route
+    )
+
+class Outbox(db.Model):
+    """Notification emails written in the same transaction as the data they describe"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=True)
+    email_type = db.Column(db.String(40), nullable=False)
+    payload = db.Column(db.Text, nullable=False)  # JSON email_data for notifications.deliver_email
+    status = db.Column(db.String(20), default="pending")  # pending, leased, sent, failed
+    attempts = db.Column(db.Integer, default=0)
+    available_at = db.Column(db.DateTime, default=datetime.utcnow)  # next attempt, or lease expiry while leased
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+    
+    __table_args__ = (
+        db.Index("ix_outbox_status_available_at", "status", "available_at"),
+    )
+
+class IdempotencyKey(db.Model):
+    """A client-chosen key for one POST and the response it got, so a retry replays it
+    
+    status_code is null while the first request is still running. Rows older than
+    IDEMPOTENCY_KEY_TTL_HOURS are removed by `flask purge-idempotency-keys`.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    key = db.Column(db.String(100), nullable=False)
+    endpoint = db.Column(db.String(50), nullable=False)
+    request_hash = db.Column(db.String(64), nullable=False)  # sha256 of endpoint + form, to catch reused keys
+    status_code = db.Column(db.Integer)
+    response_headers = db.Column(db.Text)  # JSON
+    response_body = db.Column(db.Text)
+    flashes = db.Column(db.Text)  # JSON [[category, message], ...] flashed by the first request
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    
+    __table_args__ = (
+        # Lookups are one probe of this index however many keys are stored
+        db.UniqueConstraint("user_id", "key", name="uq_idempotency_user_key"),
+    )
+
+ORDER_STATUSES = ["pending", "confirmed", "preparing", "ready", "out_for_delivery", "delivered", "cancelled"]
+
+class DailyStats(db.Model):
+    """Per-day, per-restaurant rollup behind the admin reports
+    
+    Order columns are keyed by the day the order was created. restaurant_id 0 is the
+    platform-wide row that carries user and restaurant signups.
+    Maintained incrementally by track_daily_stats(); rebuild with `flask rebuild-daily-stats`.
+    """
+    day = db.Column(db.Date, primary_key=True)
+    restaurant_id = db.Column(db.Integer, primary_key=True)
+    order_count = db.Column(db.Integer, default=0, nullable=False)
+    gross_revenue = db.Column(db.Float, default=0.0, nullable=False)  # all orders, any payment status
+    paid_revenue = db.Column(db.Float, default=0.0, nullable=False)
+    new_users = db.Column(db.Integer, default=0, nullable=False)
+    new_restaurants = db.Column(db.Integer, default=0, nullable=False)
+    
+    # Status histogram of the day's orders (by current status)
+    pending_count = db.Column(db.Integer, default=0, nullable=False)
+    confirmed_count = db.Column(db.Integer, default=0, nullable=False)
+    preparing_count = db.Column(db.Integer, default=0, nullable=False)
+    ready_count = db.Column(db.Integer, default=0, nullable=False)
+    out_for_delivery_count = db.Column(db.Integer, default=0, nullable=False)
+    delivered_count = db.Column(db.Integer, default=0, nullable=False)
+    cancelled_count = db.Column(db.Integer, default=0, nullable=False)
+    other_status_count = db.Column(db.Integer, default=0, nullable=False)
+
+def status_count_column(status):
+    return f"{status}_count" if status in ORDER_STATUSES else "other_status_count"
+
+def add_order_stats(deltas, restaurant_id, created_at, status, payment_status, total_amount, sign=1):
+    """Accumulate one order's contribution to DailyStats (sign=-1 removes it)"""
+    row = deltas.setdefault((created_at.date(), restaurant_id), {})
+    amount = total_amount or 0.0
+    row["order_count"] = row.get("order_count", 0) + sign
+    row["gross_revenue"] = row.get("gross_revenue", 0.0) + sign * amount
+    if payment_status == "paid":
+        row["paid_revenue"] = row.get("paid_revenue", 0.0) + sign * amount
+    column = status_count_column(status)
+    row[column] = row.get(column, 0) + sign
+
+def dialect_insert(session):
+    """The session database's insert(), which supports ON CONFLICT clauses"""
+    return postgresql.insert if session.get_bind().dialect.name == "postgresql" else sqlite.insert
+
+def apply_stats_deltas(session, model, key_columns, deltas):
+    """Upsert accumulated counter deltas: INSERT ... ON CONFLICT DO UPDATE SET col = col + delta
+    
+    Rows changing the same columns share one statement, executed once for all of them.
+    """
+    insert = dialect_insert(session)
+    
+    groups = {}
+    for key, changes in deltas.items():
+        changes = {column: delta for column, delta in changes.items() if delta}
+        if changes:
+            groups.setdefault(tuple(sorted(changes)), []).append({**dict(zip(key_columns, key)), **changes})
+    
+    for columns, rows in groups.items():
+        statement = insert(model.__table__)
+        statement = statement.on_conflict_do_update(
+            index_elements=key_columns,
+            set_={column: getattr(model, column) + statement.excluded[column] for column in columns}
+        )
+        session.connection().execute(statement, rows)
+
+def old_value(state, attribute):
+    """Value an attribute had when loaded, before changes pending in this flush"""
+    history = state.attrs[attribute].history
+    if history.deleted:
+        return history.deleted[0]
+    return getattr(state.object, attribute)
+
+@db.event.listens_for(db.session, "before_flush")
+def track_daily_stats(session, flush_context, instances):
+    """Keep DailyStats in step with ORM inserts, updates and deletes in the same transaction"""
+    deltas = {}
+    now = datetime.utcnow()
+    
+    for obj in session.new:
+        if isinstance(obj, Order):
+            obj.created_at = obj.created_at or now
+            add_order_stats(deltas, obj.restaurant_id, obj.created_at, obj.status or "pending",
+                            obj.payment_status or "pending", obj.total_amount)
+        elif isinstance(obj, (User, Restaurant)):
+            obj.created_at = obj.created_at or now
+            column = "new_users" if isinstance(obj, User) else "new_restaurants"
+            row = deltas.setdefault((obj.created_at.date(), 0), {})
+            row[column] = row.get(column, 0) + 1
+    
+    for obj in session.dirty:
+        if not isinstance(obj, Order):
+            continue
+        state = sa_inspect(obj)
+        if not any(state.attrs[attr].history.has_changes()
+                   for attr in ("status", "payment_status", "total_amount", "restaurant_id")):
+            continue
+        add_order_stats(deltas, old_value(state, "restaurant_id"), obj.created_at, old_value(state, "status"),
+                        old_value(state, "payment_status"), old_value(state, "total_amount"), sign=-1)
+        add_order_stats(deltas, obj.restaurant_id, obj.created_at, obj.status,
+                        obj.payment_status, obj.total_amount)
+    
+    for obj in session.deleted:
+        if isinstance(obj, Order):
+            state = sa_inspect(obj)
+            add_order_stats(deltas, old_value(state, "restaurant_id"), obj.created_at, old_value(state, "status"),
+                            old_value(state, "payment_status"), old_value(state, "total_amount"), sign=-1)
+        elif isinstance(obj, (User, Restaurant)) and obj.created_at:
+            column = "new_users" if isinstance(obj, User) else "new_restaurants"
+            row = deltas.setdefault((obj.created_at.date(), 0), {})
+            row[column] = row.get(column, 0) - 1
+    
+    if deltas:
+        apply_stats_deltas(session, DailyStats, ["day", "restaurant_id"], deltas)
+
+def rebuild_daily_stats():
+    """Recompute DailyStats from scratch (backfills, or after bulk edits that bypass the ORM)"""
+    day = db.func.date(Order.created_at)
+    status_columns = {
+        status_count_column(status): db.func.sum(db.case((Order.status == status, 1), else_=0))
+        for status in ORDER_STATUSES
+    }
+    status_columns["other_status_count"] = db.func.sum(db.case((Order.status.in_(ORDER_STATUSES), 0), else_=1))
+    
+    order_rows = db.session.query(
+        day.label("day"),
+        Order.restaurant_id,
+        db.func.count(Order.id).label("order_count"),
+        db.func.coalesce(db.func.sum(Order.total_amount), 0).label("gross_revenue"),
+        db.func.coalesce(db.func.sum(db.case((Order.payment_status == "paid", Order.total_amount), else_=0)), 0).label("paid_revenue"),
+        *[expression.label(column) for column, expression in status_columns.items()]
+    ).group_by(day, Order.restaurant_id).all()
+    
+    signups = {}
+    for model, column in ((User, "new_users"), (Restaurant, "new_restaurants")):
+        signup_day = db.func.date(model.created_at)
+        for row_day, count in db.session.query(signup_day, db.func.count(model.id)).group_by(signup_day).all():
+            signups.setdefault(row_day, {})[column] = count
+    
+    def to_date(value):
+        # SQLite's date() comes back as a string
+        return datetime.strptime(value, '%Y-%m-%d').date() if isinstance(value, str) else value
+    
+    db.session.query(DailyStats).delete()
+    order_stats = [dict(row._mapping, day=to_date(row.day)) for row in order_rows]
+    signup_stats = [
+        dict(day=to_date(row_day), restaurant_id=0,
+             new_users=counts.get("new_users", 0), new_restaurants=counts.get("new_restaurants", 0))
+        for row_day, counts in signups.items()
+    ]
+    for rows in (order_stats, signup_stats):
+        if rows:
+            db.session.execute(db.insert(DailyStats), rows)
+    db.session.commit()
+    return len(order_stats) + len(signup_stats)
+
+class RestaurantCounters(db.Model):
+    """Running totals per restaurant so dashboards are a single primary-key lookup
+    
+    Maintained by track_restaurant_counters(); verify with `flask check-restaurant-counters`.
+    """
+    restaurant_id = db.Column(db.Integer, primary_key=True)
+    total_orders = db.Column(db.Integer, default=0, nullable=False)
+    pending_orders = db.Column(db.Integer, default=0, nullable=False)
+    paid_revenue = db.Column(db.Float, default=0.0, nullable=False)
+    total_dishes = db.Column(db.Integer, default=0, nullable=False)
+    active_dishes = db.Column(db.Integer, default=0, nullable=False)
+
+def add_order_counters(deltas, restaurant_id, status, payment_status, total_amount, sign=1):
+    row = deltas.setdefault((restaurant_id,), {})
+    row["total_orders"] = row.get("total_orders", 0) + sign
+    if status == "pending":
+        row["pending_orders"] = row.get("pending_orders", 0) + sign
+    if payment_status == "paid":
+        row["paid_revenue"] = row.get("paid_revenue", 0.0) + sign * (total_amount or 0.0)
+
+def add_dish_counters(deltas, restaurant_id, is_available, sign=1):
+    row = deltas.setdefault((restaurant_id,), {})
+    row["total_dishes"] = row.get("total_dishes", 0) + sign
+    if is_available is not False:  # NULL before insert means the column default (available)
+        row["active_dishes"] = row.get("active_dishes", 0) + sign
+
+@db.event.listens_for(db.session, "before_flush")
+def track_restaurant_counters(session, flush_context, instances):
+    """Keep RestaurantCounters in step with ORM changes to orders and dishes"""
+    deltas = {}
+    
+    for obj in session.new:
+        if isinstance(obj, Order):
+            add_order_counters(deltas, obj.restaurant_id, obj.status or "pending",
+                               obj.payment_status or "pending", obj.total_amount)
+        elif isinstance(obj, Dish):
+            add_dish_counters(deltas, obj.restaurant_id, obj.is_available)
+    
+    for obj in session.dirty:
+        if isinstance(obj, Order):
+            state = sa_inspect(obj)
+            if any(state.attrs[attr].history.has_changes()
+                   for attr in ("status", "payment_status", "total_amount", "restaurant_id")):
+                add_order_counters(deltas, old_value(state, "restaurant_id"), old_value(state, "status"),
+                                   old_value(state, "payment_status"), old_value(state, "total_amount"), sign=-1)
+                add_order_counters(deltas, obj.restaurant_id, obj.status, obj.payment_status, obj.total_amount)
+        elif isinstance(obj, Dish):
+            state = sa_inspect(obj)
+            if any(state.attrs[attr].history.has_changes() for attr in ("is_available", "restaurant_id")):
+                add_dish_counters(deltas, old_value(state, "restaurant_id"), old_value(state, "is_available"), sign=-1)
+                add_dish_counters(deltas, obj.restaurant_id, obj.is_available)
+    
+    for obj in session.deleted:
+        if isinstance(obj, Order):
+            state = sa_inspect(obj)
+            add_order_counters(deltas, old_value(state, "restaurant_id"), old_value(state, "status"),
+                               old_value(state, "payment_status"), old_value(state, "total_amount"), sign=-1)
+        elif isinstance(obj, Dish):
+            state = sa_inspect(obj)
+            add_dish_counters(deltas, old_value(state, "restaurant_id"), old_value(state, "is_available"), sign=-1)
+        elif isinstance(obj, Restaurant):
+            session.execute(db.delete(RestaurantCounters).where(RestaurantCounters.restaurant_id == obj.id))
+    
+    if deltas:
+        apply_stats_deltas(session, RestaurantCounters, ["restaurant_id"], deltas)
+
+@db.event.listens_for(db.session, "before_flush")
+def collect_page_cache_tags(session, flush_context, instances):
+    """Note which cached pages the pending Dish and Restaurant changes make stale"""
+    tags = session.info.setdefault("page_cache_tags", set())
+    
+    for obj in list(session.new) + list(session.deleted):
+        if isinstance(obj, Dish):
+            # A dish coming or going can change the featured list on the home page
+            tags.update({f"restaurant:{obj.restaurant_id}", "index"})
+        elif isinstance(obj, Restaurant):
+            tags.add("restaurants")
+            if obj.id is not None:
+                tags.add(f"restaurant:{obj.id}")
+    
+    for obj in session.dirty:
+        if not isinstance(obj, (Dish, Restaurant)) or not session.is_modified(obj):
+            continue
+        if isinstance(obj, Dish):
+            state = sa_inspect(obj)
+            tags.update({f"restaurant:{obj.restaurant_id}", f"restaurant:{old_value(state, 'restaurant_id')}"})
+            if state.attrs.is_available.history.has_changes():
+                tags.add("index")
+        else:
+            tags.update({f"restaurant:{obj.id}", "restaurants"})
+
+@db.event.listens_for(db.session, "after_commit")
+def purge_page_cache(session):
+    """Purge pages only once the change is committed, so no request re-caches old data"""
+    tags = session.info.pop("page_cache_tags", None)
+    if tags:
+        page_cache.purge(*tags)
+
+@db.event.listens_for(db.session, "after_rollback")
+def discard_page_cache_tags(session):
+    session.info.pop("page_cache_tags", None)
+
+def order_event(order, event_type, previous_status=None, previous_driver_id=None):
+    """(channels, type, data) for an order change: the customer, the restaurant and any driver
+    
+    Changes into or out of "ready" also go to the shared drivers channel, whose
+    listeners keep the available-orders feed current.
+    """
+    channels = {f"customer:{order.user_id}", f"restaurant:{order.restaurant_id}"}
+    for driver_id in (order.driver_id, previous_driver_id):
+        if driver_id is not None:
+            channels.add(f"driver:{driver_id}")
+    if "ready" in (order.status, previous_status):
+        channels.add("drivers")
+    return channels, event_type, {
+        "order_id": order.id,
+        "status": order.status,
+        "previous_status": previous_status,
+        "restaurant_id": order.restaurant_id,
+        "driver_id": order.driver_id,
+        "total_amount": order.total_amount
+    }
+
+@db.event.listens_for(db.session, "after_flush")
+def collect_order_events(session, flush_context):
+    """Note an event for each order created or re-assigned in this flush (ids are known by now)"""
+    events = session.info.setdefault("order_events", [])
+    for obj in session.new:
+        if isinstance(obj, Order):
+            events.append(order_event(obj, "order_created"))
+    for obj in session.dirty:
+        if not isinstance(obj, Order):
+            continue
+        state = sa_inspect(obj)
+        if state.attrs.status.history.has_changes() or state.attrs.driver_id.history.has_changes():
+            events.append(order_event(obj, "order_updated", old_value(state, "status"), old_value(state, "driver_id")))
+
+def record_status_change(session, rows, previous_status):
+    """Do for orders changed by a Core UPDATE ... RETURNING what the ORM hooks do for the ORM
+    
+    rows carry the updated orders' columns. Their DailyStats and RestaurantCounters
+    deltas are applied in the current transaction and their events are published on commit.
+    """
+    stats, counters = {}, {}
+    events = session.info.setdefault("order_events", [])
+    for row in rows:
+        add_order_stats(stats, row.restaurant_id, row.created_at, previous_status, row.payment_status,
+                        row.total_amount, sign=-1)
+        add_order_stats(stats, row.restaurant_id, row.created_at, row.status, row.payment_status, row.total_amount)
+        add_order_counters(counters, row.restaurant_id, previous_status, row.payment_status, row.total_amount, sign=-1)
+        add_order_counters(counters, row.restaurant_id, row.status, row.payment_status, row.total_amount)
+        events.append(order_event(row, "order_updated", previous_status))
+    apply_stats_deltas(session, DailyStats, ["day", "restaurant_id"], stats)
+    apply_stats_deltas(session, RestaurantCounters, ["restaurant_id"], counters)
+
+@db.event.listens_for(db.session, "after_commit")
+def publish_order_events(session):
+    """Publish only once committed, so a client refetching on the event sees the change"""
+    for channels, event_type, data in session.info.pop("order_events", ()):
+        event_bus.publish(channels, event_type, data)
+
+@db.event.listens_for(db.session, "after_rollback")
+def discard_order_events(session):
+    session.info.pop("order_events", None)
+
+def get_restaurant_counters(restaurant_id):
+    """Counters row for a restaurant (all zeros if it has no orders or dishes yet)"""
+    counters = RestaurantCounters.query.get(restaurant_id)
+    if counters is None:
+        counters = RestaurantCounters(restaurant_id=restaurant_id, total_orders=0, pending_orders=0,
+                                      paid_revenue=0.0, total_dishes=0, active_dishes=0)
+    return counters
+
+def compute_restaurant_counters():
+    """Recompute every restaurant's counters from the Order and Dish tables"""
+    computed = {}
+    
+    order_rows = db.session.query(
+        Order.restaurant_id,
+        db.func.count(Order.id),
+        db.func.sum(db.case((Order.status == "pending", 1), else_=0)),
+        db.func.sum(db.case((Order.payment_status == "paid", Order.total_amount), else_=0))
+    ).group_by(Order.restaurant_id).all()
+    for restaurant_id, total, pending, paid in order_rows:
+        computed.setdefault(restaurant_id, {}).update(
+            total_orders=total, pending_orders=pending or 0, paid_revenue=float(paid or 0))
+    
+    dish_rows = db.session.query(
+        Dish.restaurant_id,
+        db.func.count(Dish.id),
+        db.func.sum(db.case((Dish.is_available == False, 0), else_=1))
+    ).group_by(Dish.restaurant_id).all()
+    for restaurant_id, total, active in dish_rows:
+        computed.setdefault(restaurant_id, {}).update(total_dishes=total, active_dishes=active or 0)
+    
+    defaults = {"total_orders": 0, "pending_orders": 0, "paid_revenue": 0.0, "total_dishes": 0, "active_dishes": 0}
+    return {restaurant_id: dict(defaults, **values) for restaurant_id, values in computed.items()}
+
+def check_restaurant_counters(fix=False):
+    """Compare stored counters with a from-scratch recount; returns the mismatches found"""
+    expected = compute_restaurant_counters()
+    stored = {row.restaurant_id: row for row in RestaurantCounters.query.all()}
+    mismatches = []
+    
+    for restaurant_id in set(expected) | set(stored):
+        want = expected.get(restaurant_id)
+        row = stored.get(restaurant_id)
+        have = {column: getattr(row, column) for column in want} if row and want else None
+        
+        if want is None:
+            mismatches.append((restaurant_id, "orphaned counters row", None))
+            if fix:
+                db.session.delete(row)
+        elif have is None:
+            mismatches.append((restaurant_id, "missing counters row", want))
+            if fix:
+                db.session.add(RestaurantCounters(restaurant_id=restaurant_id, **want))
+        elif any(abs((have[column] or 0) - want[column]) > 0.005 for column in want):
+            mismatches.append((restaurant_id, have, want))
+            if fix:
+                for column, value in want.items():
+                    setattr(row, column, value)
+    
+    if fix:
+        db.session.commit()
+    return mismatches
+
+def daily_stats_range(start_dt, end_dt):
+    """DailyStats filter for the days touched by [start_dt, end_dt)"""
+    last_day = (end_dt - timedelta(microseconds=1)).date()
+    return (DailyStats.day >= start_dt.date(), DailyStats.day <= last_day)
+
+def daily_stats_totals(*criteria):
+    """Sum every DailyStats counter over the rows matching criteria"""
+    columns = ["order_count", "gross_revenue", "paid_revenue", "new_users", "new_restaurants", "other_status_count"]
+    columns += [status_count_column(status) for status in ORDER_STATUSES]
+    row = db.session.query(
+        *[db.func.coalesce(db.func.sum(getattr(DailyStats, column)), 0) for column in columns]
+    ).filter(*criteria).one()
+    return dict(zip(columns, row))
+
 # Forms
 class LoginForm(FlaskForm):
     username = StringField("Username", validators=[DataRequired()])
@@ -118,6 +651,8 @@ class RestaurantForm(FlaskForm):
     description = TextAreaField("Description")
     address = TextAreaField("Address", validators=[DataRequired()])
     phone = StringField("Phone", validators=[DataRequired()])
+    latitude = FloatField("Latitude", validators=[Optional(), NumberRange(min=-90, max=90)])
+    longitude = FloatField("Longitude", validators=[Optional(), NumberRange(min=-180, max=180)])
 
 class DishForm(FlaskForm):
     title = StringField("Dish Name", validators=[DataRequired()])
@@ -127,20 +662,698 @@ class DishForm(FlaskForm):
     inventory = IntegerField("Inventory", validators=[NumberRange(min=0)], default=100)
 
 # Helper Functions
+def add_missing_columns():
+    """db.create_all() never alters existing tables; add newer nullable columns to them"""
+    inspector = sa_inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing or not column.nullable:
+                continue
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            with db.engine.begin() as connection:
+                connection.execute(db.text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'))
+            print(f"🔧 Added column {table.name}.{column.name}")
+
+def remove_duplicate_carts():
+    """Keep each user's newest cart, so the one-cart-per-user index can be created"""
+    newest = db.select(db.func.max(Cart.id)).group_by(Cart.user_id)
+    stale = db.select(Cart.id).where(Cart.id.not_in(newest))
+    with db.engine.begin() as connection:
+        connection.execute(db.delete(CartItem).where(CartItem.cart_id.in_(stale)))
+        removed = connection.execute(db.delete(Cart).where(Cart.id.not_in(newest))).rowcount
+    if removed:
+        print(f"🔧 Removed {removed} duplicate carts")
+
+def create_missing_indexes():
+    """db.create_all() only indexes tables it creates; add newer indexes to existing tables"""
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+
+class CSVLineBuffer:
+    """File-like sink for csv.writer that hands each formatted line straight back"""
+    def write(self, value):
+        return value
+
+def stream_csv(filename, header, rows, compress=False, chunk_rows=500):
+    """Stream rows as a CSV download without holding the file in memory
+    
+    The header goes out before the query even runs; rows are flushed every chunk_rows.
+    With compress=True the download is a gzip file.
+    """
+    writer = csv.writer(CSVLineBuffer(), lineterminator="\n")
+    
+    def generate():
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+        
+        def encode(lines, flush_mode=None):
+            data = "".join(lines).encode("utf-8")
+            if compressor is None:
+                return data
+            data = compressor.compress(data)
+            return data + compressor.flush(flush_mode) if flush_mode is not None else data
+        
+        yield encode([writer.writerow(header)], zlib.Z_SYNC_FLUSH)
+        
+        chunk = []
+        for row in rows:
+            chunk.append(writer.writerow(row))
+            if len(chunk) >= chunk_rows:
+                yield encode(chunk)
+                chunk = []
+        
+        yield encode(chunk, zlib.Z_FINISH)
+    
+    response = Response(stream_with_context(generate()), mimetype="application/gzip" if compress else "text/csv")
+    response.headers["Content-Disposition"] = f"attachment; filename={filename}" + (".gz" if compress else "")
+    return response
+
+class KeysetPage:
+    """One page of a listing paginated on (created_at, id) instead of OFFSET"""
+    def __init__(self, items, per_page, has_next, has_prev, total=None, total_is_estimate=False):
+        self.items = items
+        self.per_page = per_page
+        self.has_next = has_next
+        self.has_prev = has_prev
+        self.total = total
+        self.total_is_estimate = total_is_estimate
+        self.next_cursor = encode_cursor(items[-1]) if items and has_next else None
+        self.prev_cursor = encode_cursor(items[0]) if items and has_prev else None
+    
+    def __iter__(self):
+        return iter(self.items)
+    
+    def __len__(self):
+        return len(self.items)
+    
+    def to_dict(self):
+        return {
+            "per_page": self.per_page,
+            "has_next": self.has_next,
+            "has_prev": self.has_prev,
+            "next_cursor": self.next_cursor,
+            "prev_cursor": self.prev_cursor,
+            "total": self.total,
+            "total_is_estimate": self.total_is_estimate
+        }
+
+def encode_cursor(obj):
+    """Opaque cursor pointing just past obj in (created_at, id) order"""
+    raw = f"{obj.created_at.isoformat()}|{obj.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor; raises ValueError on anything malformed"""
+    raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+    created_at, row_id = raw.split("|")
+    return datetime.fromisoformat(created_at), int(row_id)
+
+def count_rows(query, mode, cap=1000):
+    """Total for a listing: None by default, exact on request, or an approximation capped at cap rows"""
+    if mode == "exact":
+        return query.order_by(None).count(), False
+    if mode == "approx":
+        # Count at most cap + 1 rows so the cost is bounded however big the table is
+        limited = query.order_by(None).limit(cap + 1).subquery()
+        total = db.session.query(db.func.count()).select_from(limited).scalar()
+        return min(total, cap), total > cap
+    return None, False
+
+def keyset_paginate(query, model, per_page=20, after=None, before=None, count=None):
+    """Newest-first page of query keyed on (created_at, id)
+    
+    after/before are cursors from a previous page; every page is an index range scan
+    of per_page + 1 rows, so deep pages cost the same as the first one.
+    """
+    total, total_is_estimate = count_rows(query, count)
+    sort_key = db.tuple_(model.created_at, model.id)
+    
+    if before:
+        # Walk backwards from the cursor, then restore newest-first order
+        rows = query.filter(sort_key > decode_cursor(before)).order_by(
+            model.created_at.asc(), model.id.asc()
+        ).limit(per_page + 1).all()
+        items = rows[:per_page][::-1]
+        return KeysetPage(items, per_page, has_next=True, has_prev=len(rows) > per_page,
+                          total=total, total_is_estimate=total_is_estimate)
+    
+    if after:
+        query = query.filter(sort_key < decode_cursor(after))
+    rows = query.order_by(model.created_at.desc(), model.id.desc()).limit(per_page + 1).all()
+    return KeysetPage(rows[:per_page], per_page, has_next=len(rows) > per_page, has_prev=bool(after),
+                      total=total, total_is_estimate=total_is_estimate)
+
+def paginate_from_request(query, model, per_page=20, max_per_page=100):
+    """keyset_paginate driven by the after/before/count/per_page query parameters"""
+    per_page = max(1, min(request.args.get('per_page', per_page, type=int), max_per_page))
+    try:
+        return keyset_paginate(
+            query, model, per_page=per_page,
+            after=request.args.get('after'),
+            before=request.args.get('before'),
+            count=request.args.get('count')
+        )
+    except ValueError:
+        # Stale or tampered cursor: start again from the first page
+        return keyset_paginate(query, model, per_page=per_page, count=request.args.get('count'))
+
+def search_filter(model, fts_table, term, columns):
+    """WHERE clause for an admin search box
+    
+    Uses the FTS5 index (prefix match on every word) when it is installed, and falls
+    back to the ilike scan over columns on databases without FTS5.
+    """
+    if search_index.is_installed(db.engine):
+        if search_index.match_expression(term) is None:
+            return db.false()
+        # A selective term becomes a short id list; a broad one stays a subquery
+        ids = search_index.selective_ids(db.session.connection(), fts_table, term)
+        if ids is not None:
+            return model.id.in_(ids)
+        return model.id.in_(search_index.matching_ids(fts_table, term))
+    return db.or_(*[column.ilike(f'%{term}%') for column in columns])
+
+def ranked_search(model, fts_table, term, columns, limit=10):
+    """Best matches for term, best first: bm25 rank with FTS5, newest first otherwise"""
+    if search_index.is_installed(db.engine):
+        ids = search_index.ranked_ids(db.session.connection(), fts_table, term, limit)
+        rows = {row.id: row for row in model.query.filter(model.id.in_(ids))} if ids else {}
+        return [rows[row_id] for row_id in ids if row_id in rows]
+    return model.query.filter(search_filter(model, fts_table, term, columns)).order_by(
+        model.created_at.desc()
+    ).limit(limit).all()
+
+USER_SEARCH_COLUMNS = [User.username, User.email, User.first_name, User.last_name, User.phone]
+RESTAURANT_SEARCH_COLUMNS = [Restaurant.name, Restaurant.address, Restaurant.phone]
+ORDER_SEARCH_COLUMNS = [Order.phone, Order.delivery_address]
+DISH_SEARCH_COLUMNS = [Dish.title, Dish.description, Dish.category]
+DISH_RANK_CAP = 5000
+
+def search_dishes(term, category='', min_price=None, max_price=None, limit=24, offset=0):
+    """Available dishes of active restaurants matching term, best match first
+    
+    Returns up to limit + 1 dishes so callers can tell whether there is a next page.
+    """
+    query = Dish.query.join(Dish.restaurant).options(db.contains_eager(Dish.restaurant)).filter(
+        Dish.is_available == True,
+        Restaurant.is_active == True
+    )
+    
+    if category:
+        query = query.filter(Dish.category == category)
+    if min_price is not None:
+        query = query.filter(Dish.price >= min_price)
+    if max_price is not None:
+        query = query.filter(Dish.price <= max_price)
+    
+    if term and search_index.is_installed(db.engine):
+        expression = search_index.match_expression(term)
+        if expression is None:
+            return []
+        # Drive the query from the FTS match and sort on its weighted bm25 rank. Ranking
+        # costs time per match, so a term found in more than DISH_RANK_CAP dishes is
+        # listed newest first, which the index returns without sorting
+        fts = search_index.fts_table_clause('dish_fts')
+        selective = search_index.selective_ids(db.session.connection(), 'dish_fts', term, cap=DISH_RANK_CAP)
+        query = query.join(fts, fts.c.rowid == Dish.id).filter(
+            fts.c.dish_fts.match(expression)
+        ).order_by(fts.c.rank if selective is not None else fts.c.rowid.desc())
+    elif term:
+        query = query.filter(db.or_(*[column.ilike(f'%{term}%') for column in DISH_SEARCH_COLUMNS])).order_by(Dish.title)
+    else:
+        query = query.order_by(Dish.created_at.desc())
+    
+    return query.offset(offset).limit(limit + 1).all()
+
+def dish_search_params():
+    """Search term, filters and page number from the query string"""
+    return {
+        "term": request.args.get('q', '').strip(),
+        "category": request.args.get('category', '').strip(),
+        "min_price": request.args.get('min_price', type=float),
+        "max_price": request.args.get('max_price', type=float),
+        "page": max(request.args.get('page', 1, type=int), 1)
+    }
+
+@app.before_request
+def load_current_user():
+    """Load the logged-in user, and a restaurant owner's restaurant, once per request into g
+    
+    The restaurant is kept by the stored user_type, the one role_required checks, since
+    an admin can change a logged-in user's type after their session recorded it.
+    """
+    g.user = None
+    g.restaurant = None
+    if "user_id" not in session or request.endpoint == "static":
+        return
+    
+    row = db.session.query(User, Restaurant).outerjoin(
+        Restaurant, Restaurant.user_id == User.id
+    ).filter(User.id == session["user_id"]).first()
+    if row:
+        g.user, restaurant = row
+        if g.user.user_type == "restaurant":
+            g.restaurant = restaurant
+
+def persist_driver_locations(pings):
+    """Write a batch of pings with one executemany INSERT (called from the flusher thread)"""
+    rows = [{
+        "driver_id": ping.driver_id,
+        "latitude": ping.latitude,
+        "longitude": ping.longitude,
+        "accuracy": ping.accuracy,
+        "recorded_at": datetime.utcfromtimestamp(ping.recorded_at)
+    } for ping in pings]
+    with app.app_context():
+        with db.engine.begin() as connection:
+            connection.execute(DriverLocation.__table__.insert(), rows)
+
+driver_locations = LocationStore(
+    persist_driver_locations,
+    history=int(os.environ.get('DRIVER_LOCATION_HISTORY', '50')),
+    flush_interval=float(os.environ.get('DRIVER_LOCATION_FLUSH_INTERVAL', '2')),
+    stale_after=float(os.environ.get('DRIVER_LOCATION_STALE_AFTER', '300'))
+)
+atexit.register(driver_locations.flush)
+
+EVENT_STREAM_HEARTBEAT = 15  # seconds between keepalive comments on a quiet stream
+EVENT_STREAM_MAX_AGE = 600  # seconds before the server ends a stream and the client reconnects
+EVENT_STREAM_RETRY_AFTER = 30  # seconds a client turned away by the stream limit should wait
+
+# Each open stream holds a server thread; keep this well under gunicorn's --threads
+event_streams = StreamLimiter(int(os.environ.get('EVENT_STREAM_MAX_OPEN', '32')))
+
+def event_stream(channels):
+    """Server-Sent Events response for channels, resuming after the client's Last-Event-ID
+    
+    Browsers send Last-Event-ID by themselves when they reconnect; other clients can
+    pass ?last_event_id=. Without either, the stream starts with the next event.
+    Once the worker holds EVENT_STREAM_MAX_OPEN streams, further ones get a 503 with
+    Retry-After instead of a thread.
+    """
+    if not event_streams.acquire():
+        response = jsonify({"success": False, "message": "Too many open event streams. Please retry later."})
+        response.status_code = 503
+        response.headers["Retry-After"] = str(EVENT_STREAM_RETRY_AFTER)
+        return response
+    
+    last_event_id = request.headers.get("Last-Event-ID") or request.args.get("last_event_id")
+    try:
+        after_id = int(last_event_id) if last_event_id else event_bus.last_id
+    except ValueError:
+        after_id = event_bus.last_id
+    
+    # The stream outlives the request's use of the database; give the connection back now
+    db.session.close()
+    
+    def generate():
+        subscription = event_bus.subscribe(channels)
+        cursor = after_id
+        deadline = time.monotonic() + EVENT_STREAM_MAX_AGE
+        try:
+            yield "retry: 3000\n\n"
+            while time.monotonic() < deadline:
+                events = subscription.wait(cursor, EVENT_STREAM_HEARTBEAT)
+                if not events:
+                    yield ": keepalive\n\n"
+                for event in events:
+                    yield event.to_sse()
+                    cursor = event.id
+        finally:
+            subscription.close()
+    
+    response = Response(generate(), mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"  # stop nginx from buffering the stream
+    })
+    # Runs when the server closes the response, even if the generator never started
+    response.call_on_close(event_streams.release)
+    return response
+
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if "user_id" not in session:
+        if g.user is None:
             flash("Please login to access this page.", "error")
             return redirect(url_for("login"))
         return f(*args, **kwargs)
     return decorated_function
 
+def role_required(role, api=False):
+    """login_required plus a check of the user's account type
+    
+    With api=True a wrong account type gets a JSON 403 instead of a flash and redirect.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if g.user is None:
+                flash("Please login to access this page.", "error")
+                return redirect(url_for("login"))
+            if g.user.user_type != role:
+                if api:
+                    return jsonify({"success": False, "message": "Access denied"}), 403
+                flash(f"Access denied. {role.title()} account required.", "error")
+                return redirect(url_for("index"))
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+def request_fingerprint():
+    """Hash of the endpoint and form fields, so a key reused for a different request is refused"""
+    fields = sorted(
+        (name, value) for name, value in request.form.items(multi=True)
+        if name not in ("idempotency_key", "csrf_token")
+    )
+    return hashlib.sha256(json.dumps([request.endpoint, fields]).encode()).hexdigest()
+
+def reserve_idempotency_key(user_id, key, request_hash):
+    """Claim key for this request; returns (row, True) if claimed, or (existing row, False)
+    
+    The claim is committed before the view runs, so of two concurrent requests with
+    the same key exactly one gets to run. An expired row that has not been purged
+    yet is deleted and the key claimed afresh.
+    """
+    for _ in range(2):
+        record = IdempotencyKey(user_id=user_id, key=key, endpoint=request.endpoint, request_hash=request_hash)
+        db.session.add(record)
+        try:
+            db.session.commit()
+            return record, True
+        except IntegrityError:
+            db.session.rollback()
+        
+        existing = IdempotencyKey.query.filter_by(user_id=user_id, key=key).first()
+        expires = timedelta(hours=app.config['IDEMPOTENCY_KEY_TTL_HOURS'])
+        if existing is None or existing.created_at >= datetime.utcnow() - expires:
+            return existing, False
+        db.session.delete(existing)
+        db.session.commit()
+    return existing, False
+
+def replay_response(record):
+    """Rebuild the stored response of a completed request, re-flashing its messages"""
+    for category, message in json.loads(record.flashes or "[]"):
+        flash(message, category)
+    response = Response(record.response_body, status=record.status_code, headers=json.loads(record.response_headers))
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+def idempotent(f):
+    """Run a POST at most once per Idempotency-Key, replaying the stored response on retries
+    
+    The key comes from the Idempotency-Key header or an idempotency_key form field;
+    requests without one run as before. A retry that arrives while the first request
+    is still running gets a 409. Responses with a 5xx status, and requests that raise,
+    release the key so the client can retry. Apply under login_required.
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if request.method != "POST":
+            return f(*args, **kwargs)
+        key = request.headers.get("Idempotency-Key") or request.form.get("idempotency_key")
+        if not key:
+            return f(*args, **kwargs)
+        if len(key) > 100:
+            return jsonify({"success": False, "message": "Idempotency key is too long"}), 400
+        
+        request_hash = request_fingerprint()
+        record, claimed = reserve_idempotency_key(g.user.id, key, request_hash)
+        if not claimed:
+            if record is None or record.request_hash != request_hash:
+                return jsonify({"success": False, "message": "Idempotency key was already used for a different request"}), 422
+            if record.status_code is None:
+                response = jsonify({"success": False, "message": "A request with this idempotency key is still being processed"})
+                response.headers['Retry-After'] = '1'
+                return response, 409
+            return replay_response(record)
+        
+        record_id = record.id
+        flashed_before = len(session.get("_flashes", []))
+        try:
+            response = make_response(f(*args, **kwargs))
+        except Exception:
+            db.session.rollback()
+            db.session.execute(db.delete(IdempotencyKey).where(IdempotencyKey.id == record_id))
+            db.session.commit()
+            raise
+        
+        if response.status_code >= 500:
+            db.session.execute(db.delete(IdempotencyKey).where(IdempotencyKey.id == record_id))
+        else:
+            headers = {name: response.headers[name] for name in ("Content-Type", "Location") if name in response.headers}
+            db.session.execute(db.update(IdempotencyKey).where(IdempotencyKey.id == record_id).values(
+                status_code=response.status_code,
+                response_headers=json.dumps(headers),
+                response_body=response.get_data(as_text=True),
+                flashes=json.dumps(session.get("_flashes", [])[flashed_before:])
+            ))
+        db.session.commit()
+        return response
+    return decorated_function
+
+def purge_idempotency_keys(batch_size=10000):
+    """Delete idempotency keys older than the TTL in batches; returns how many were removed"""
+    cutoff = datetime.utcnow() - timedelta(hours=app.config['IDEMPOTENCY_KEY_TTL_HOURS'])
+    removed = 0
+    while True:
+        batch = db.session.query(IdempotencyKey.id).filter(IdempotencyKey.created_at < cutoff).limit(batch_size)
+        deleted = db.session.execute(
+            db.delete(IdempotencyKey).where(IdempotencyKey.id.in_(batch.scalar_subquery()))
+        ).rowcount
+        db.session.commit()
+        removed += deleted
+        if deleted < batch_size:
+            return removed
+
+def current_cart(create=False):
+    """The logged-in user's cart, loaded at most once per request
+    
+    The session's cart_id is the fast path. Without it, or when that cart is gone, the
+    cart is looked up by user, since another session of the same user (or a fresh
+    login) may have created it. With create=True a missing cart is inserted; of two
+    sessions racing to do that, both end up with the one row.
+    """
+    if g.get("user") is None:
+        return None
+    
+    if "cart" not in g:
+        cart = None
+        cart_id = session.get("cart_id")
+        if cart_id:
+            cart = db.session.get(Cart, cart_id)
+            if cart and cart.user_id != g.user.id:
+                cart = None
+        if cart is None:
+            cart = Cart.query.filter_by(user_id=g.user.id).first()
+        g.cart = cart
+    
+    if g.cart is None and create:
+        db.session.execute(
+            dialect_insert(db.session)(Cart)
+            .values(user_id=g.user.id, item_count=0, total=0.0)
+            .on_conflict_do_nothing(index_elements=["user_id"])
+        )
+        g.cart = Cart.query.filter_by(user_id=g.user.id).one()
+    
+    cart_id = g.cart.id if g.cart is not None else 0
+    if session.get("cart_id") != cart_id:
+        session["cart_id"] = cart_id
+    return g.cart
+
 def get_cart_total():
-    cart = session.get("cart", {})
-    total_items = sum(item["quantity"] for item in cart.values())
-    total_amount = sum(item["price"] * item["quantity"] for item in cart.values())
-    return total_items, total_amount
+    cart = current_cart()
+    if cart is None:
+        return 0, 0.0
+    return cart.item_count, cart.total
+
+def cart_items_dict(cart):
+    """Cart contents in the {dish_id: {title, price, quantity, restaurant_id}} shape the templates use"""
+    if cart is None:
+        return {}
+    return {
+        str(item.dish_id): {
+            'title': item.title,
+            'price': item.price,
+            'quantity': item.quantity,
+            'restaurant_id': cart.restaurant_id
+        }
+        for item in cart.items
+    }
+
+def adjust_cart_totals(cart, count_delta, total_delta, restaurant_id=None):
+    """Add to the cart's running totals in SQL, so concurrent changes cannot lose one
+    
+    With restaurant_id the cart is also claimed for that restaurant, unless it already
+    holds another restaurant's dishes. Returns False when nothing was updated: the cart
+    was deleted (checked out or cleared elsewhere) or belongs to another restaurant.
+    The cart object gets the new totals without a reload. Caller commits, or rolls
+    back on False.
+    """
+    item_count = Cart.item_count + count_delta
+    emptied = item_count <= 0
+    statement = db.update(Cart).where(Cart.id == cart.id).values(
+        # An emptied cart is reset exactly, so float rounding cannot accumulate across cart lifetimes
+        item_count=db.case((emptied, 0), else_=item_count),
+        total=db.case((emptied, 0.0), else_=Cart.total + total_delta),
+        restaurant_id=db.case((emptied, None), else_=Cart.restaurant_id if restaurant_id is None else restaurant_id),
+        updated_at=datetime.utcnow()
+    ).execution_options(synchronize_session=False)
+    if restaurant_id is not None:
+        statement = statement.where(db.or_(Cart.restaurant_id.is_(None), Cart.restaurant_id == restaurant_id))
+    row = db.session.execute(statement.returning(Cart.item_count, Cart.total, Cart.restaurant_id, Cart.updated_at)).first()
+    db.session.expire(cart, ["items"])
+    if row is None:
+        return False
+    for name, value in row._mapping.items():
+        set_committed_value(cart, name, value)
+    return True
+
+def add_cart_line(cart, dish, quantity):
+    """Add quantity of dish to the cart, creating its line if needed; see adjust_cart_totals for the result
+    
+    The line is upserted, so two first adds of the same dish both count. A line
+    already in the cart keeps the price it was added at.
+    """
+    insert = dialect_insert(db.session)(CartItem).values(
+        cart_id=cart.id, dish_id=dish.id, title=dish.title, price=float(dish.price), quantity=quantity
+    )
+    price = db.session.execute(
+        insert.on_conflict_do_update(
+            index_elements=["cart_id", "dish_id"],
+            set_={"quantity": CartItem.quantity + insert.excluded.quantity}
+        ).returning(CartItem.price)
+    ).scalar_one()
+    return adjust_cart_totals(cart, quantity, quantity * price, restaurant_id=dish.restaurant_id)
+
+def set_cart_line_quantity(cart, dish_id, quantity):
+    """Set one line's quantity; returns None when the line does not exist, else as adjust_cart_totals
+    
+    The update only applies if the line still holds what was read, so the totals move
+    by exactly the change that was made. A concurrent change makes it read again.
+    """
+    while True:
+        line = db.session.execute(
+            db.select(CartItem.quantity, CartItem.price).where(CartItem.cart_id == cart.id, CartItem.dish_id == dish_id)
+        ).first()
+        if line is None:
+            return None
+        updated = db.session.execute(
+            db.update(CartItem)
+            .where(CartItem.cart_id == cart.id, CartItem.dish_id == dish_id,
+                   CartItem.quantity == line.quantity, CartItem.price == line.price)
+            .values(quantity=quantity)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if updated:
+            delta = quantity - line.quantity
+            return adjust_cart_totals(cart, delta, delta * line.price)
+
+def remove_cart_line(cart, dish_id):
+    """Delete one line; returns its title, or None when it was not in the cart
+    
+    DELETE ... RETURNING hands the line to exactly one of two concurrent removals,
+    so the totals are only reduced once.
+    """
+    line = db.session.execute(
+        db.delete(CartItem)
+        .where(CartItem.cart_id == cart.id, CartItem.dish_id == dish_id)
+        .returning(CartItem.title, CartItem.quantity, CartItem.price)
+        .execution_options(synchronize_session=False)
+    ).first()
+    if line is None:
+        return None
+    adjust_cart_totals(cart, -line.quantity, -line.quantity * line.price)
+    return line.title
+
+def delete_cart(cart):
+    """Delete the cart and its lines, including lines added since it was loaded; caller commits
+    
+    Returns False when the cart was already deleted, e.g. checked out by another session.
+    """
+    db.session.execute(db.delete(CartItem).where(CartItem.cart_id == cart.id).execution_options(synchronize_session=False))
+    deleted = db.session.execute(db.delete(Cart).where(Cart.id == cart.id).execution_options(synchronize_session=False)).rowcount
+    db.session.expunge(cart)
+    g.cart = None
+    session["cart_id"] = 0
+    return bool(deleted)
+
+def json_int(data, name, default=None):
+    """Integer field of a JSON body; None when it is missing (and has no default) or not a number"""
+    value = data.get(name, default) if isinstance(data, dict) else None
+    try:
+        return int(value)
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+def revalidate_cart(cart):
+    """Bring the cart in line with current dish prices and availability, in one query
+    
+    Lines whose dish was deleted, switched off or belongs to a deactivated restaurant
+    are removed; lines whose price changed are repriced. Returns the changes as a list
+    of dicts for the client (empty when the cart was current). Caller commits.
+    """
+    if cart is None or not cart.items:
+        return []
+    
+    items = {item.dish_id: item for item in cart.items}
+    dishes = {
+        row.id: row for row in db.session.query(
+            Dish.id, Dish.title, Dish.price, Dish.is_available, Restaurant.is_active
+        ).join(Restaurant, Restaurant.id == Dish.restaurant_id).filter(Dish.id.in_(items))
+    }
+    
+    changes = []
+    for dish_id, item in items.items():
+        dish = dishes.get(dish_id)
+        if dish is None or not dish.is_available or not dish.is_active:
+            if dish is None:
+                reason = "deleted"
+            elif not dish.is_available:
+                reason = "unavailable"
+            else:
+                reason = "restaurant_inactive"
+            changes.append({
+                "dish_id": dish_id,
+                "title": item.title,
+                "change": "removed",
+                "reason": reason,
+                "quantity": item.quantity,
+                "old_price": item.price,
+                "new_price": None
+            })
+            remove_cart_line(cart, dish_id)
+        elif float(dish.price) != item.price:
+            changes.append({
+                "dish_id": dish_id,
+                "title": dish.title,
+                "change": "repriced",
+                "reason": "price_changed",
+                "quantity": item.quantity,
+                "old_price": item.price,
+                "new_price": float(dish.price)
+            })
+            # Only reprice the line as it was read; a concurrent change is caught next time
+            quantity = db.session.execute(
+                db.update(CartItem)
+                .where(CartItem.id == item.id, CartItem.price == item.price)
+                .values(price=float(dish.price), title=dish.title)
+                .returning(CartItem.quantity)
+                .execution_options(synchronize_session=False)
+            ).scalar()
+            if quantity is not None:
+                adjust_cart_totals(cart, 0, quantity * (float(dish.price) - item.price))
+    return changes
+
+def flash_cart_changes(changes):
+    for change in changes:
+        if change["change"] == "removed":
+            flash(f"{change['title']} is no longer available and was removed from your cart.", "error")
+        else:
+            flash(f"The price of {change['title']} changed from TZS {change['old_price']:.2f} to TZS {change['new_price']:.2f}.", "info")
 
 def send_email_notification(user, notification_type, **kwargs):
     """Helper function to send email notifications"""
@@ -152,30 +1365,125 @@ def send_email_notification(user, notification_type, **kwargs):
     
     return send_notification(user.id, f"Email: {notification_type}", "email", email_data)
 
+EMAIL_DIGEST_WINDOW = float(os.environ.get('EMAIL_DIGEST_WINDOW', '30'))  # seconds a digestible email waits for company; 0 disables digests
+EMAIL_DIGEST_MAX_EVENTS = int(os.environ.get('EMAIL_DIGEST_MAX_EVENTS', '50'))  # waiting emails one drain round folds in early
+
+def queue_email_notification(user, notification_type, **kwargs):
+    """Add an email to the Outbox table as part of the caller's transaction (caller commits)
+    
+    Digestible types (notifications.DIGEST_TYPES) become due only after
+    EMAIL_DIGEST_WINDOW; the drain folds the recipient's later ones into the same email.
+    """
+    if not EMAIL_ENABLED:
+        return None
+    
+    email_data = {'email': user.email, 'type': notification_type, 'event_time': datetime.now().strftime('%I:%M %p')}
+    email_data.update(kwargs)
+    
+    outbox_row = Outbox(user_id=user.id, email_type=notification_type, payload=json.dumps(email_data))
+    if notification_type in DIGEST_TYPES and EMAIL_DIGEST_WINDOW > 0:
+        outbox_row.available_at = datetime.utcnow() + timedelta(seconds=EMAIL_DIGEST_WINDOW)
+    db.session.add(outbox_row)
+    return outbox_row
+
+def drain_outbox(batch_size=50, lease_seconds=60, max_attempts=5, retry_backoff=30):
+    """Lease a batch of due Outbox rows, deliver them and record the outcome
+    
+    Rows are claimed with a single UPDATE ... RETURNING so several drain processes can
+    run side by side without sending the same email twice: on Postgres the candidate
+    rows are locked with SKIP LOCKED, so concurrent drains pick disjoint batches, and
+    the UPDATE re-checks that a row is still due, so a row another drain leased in the
+    meantime is not claimed again. A drain that dies mid-batch simply lets its lease
+    expire and the rows become claimable again.
+    
+    A digestible email due in this batch opens a digest: the recipient's other pending
+    emails of that type are claimed with it, before their own window ends, and
+    deliver_email_batch() sends them all as one email.
+    Returns the number of rows processed.
+    """
+    now = datetime.utcnow()
+    lock_rows = db.session.get_bind().dialect.name == "postgresql"
+    
+    def claim(candidates, *still_claimable):
+        if lock_rows:
+            candidates = candidates.with_for_update(skip_locked=True)
+        return db.session.execute(
+            db.update(Outbox)
+            .where(Outbox.id.in_(candidates.scalar_subquery()), *still_claimable)
+            .values(status="leased", available_at=now + timedelta(seconds=lease_seconds), attempts=Outbox.attempts + 1)
+            .returning(Outbox.id, Outbox.payload, Outbox.attempts, Outbox.user_id, Outbox.email_type)
+            .execution_options(synchronize_session=False)
+        ).all()
+    
+    is_due = (Outbox.status.in_(["pending", "leased"]), Outbox.available_at <= now)
+    claimed = claim(db.select(Outbox.id).where(*is_due).order_by(Outbox.id).limit(batch_size), *is_due)
+    
+    digests = {(row.user_id, row.email_type) for row in claimed if row.email_type in DIGEST_TYPES}
+    if digests:
+        waiting = db.select(Outbox.id).where(
+            Outbox.status == "pending",
+            db.tuple_(Outbox.user_id, Outbox.email_type).in_(sorted(digests))
+        ).order_by(Outbox.id).limit(EMAIL_DIGEST_MAX_EVENTS)
+        claimed += claim(waiting, Outbox.status == "pending")
+    db.session.commit()
+    
+    if not claimed:
+        return 0
+    
+    results = deliver_email_batch([json.loads(row.payload) for row in claimed])
+    
+    sent_ids = []
+    finished_at = datetime.utcnow()
+    for row, result in zip(claimed, results):
+        if result.get('success'):
+            sent_ids.append(row.id)
+        elif row.attempts >= max_attempts:
+            db.session.execute(
+                db.update(Outbox).where(Outbox.id == row.id)
+                .values(status="failed", last_error=result.get('error'))
+                .execution_options(synchronize_session=False)
+            )
+        else:
+            db.session.execute(
+                db.update(Outbox).where(Outbox.id == row.id)
+                .values(
+                    status="pending",
+                    available_at=finished_at + timedelta(seconds=retry_backoff * (2 ** (row.attempts - 1))),
+                    last_error=result.get('error')
+                )
+                .execution_options(synchronize_session=False)
+            )
+    
+    if sent_ids:
+        db.session.execute(
+            db.update(Outbox).where(Outbox.id.in_(sent_ids))
+            .values(status="sent", sent_at=finished_at)
+            .execution_options(synchronize_session=False)
+        )
+    db.session.commit()
+    
+    return len(claimed)
+
 # Context Processor
 @app.context_processor
 def cart_context():
     context = {}
-    if 'cart' in session:
-        cart_count = sum(item['quantity'] for item in session['cart'].values())
-        cart_total = sum(item['price'] * item['quantity'] for item in session['cart'].values())
-        context.update({'cart_count': cart_count, 'cart_total': cart_total})
-    else:
-        context.update({'cart_count': 0, 'cart_total': 0})
+    cart_count, cart_total = get_cart_total()
+    context.update({'cart_count': cart_count, 'cart_total': cart_total})
     
     # Add wallet balance to context if user is logged in
-    if 'user_id' in session:
-        user = User.query.get(session['user_id'])
-        if user:
-            context['wallet_balance'] = user.wallet_balance
+    if g.get('user') is not None:
+        context['wallet_balance'] = g.user.wallet_balance
     
     return context
 
 # Main Routes
 @app.route("/")
+@cached_page("index")
 def index():
     # Get featured dishes from all restaurants
     dishes = Dish.query.filter_by(is_available=True).limit(6).all()
+    add_cache_tags(*{f"restaurant:{dish.restaurant_id}" for dish in dishes})
     return render_template("index.html", dishes=dishes)
 
 @app.route("/register", methods=["GET", "POST"])
@@ -218,9 +1526,9 @@ def register():
                     # Send driver welcome email
                     send_email_notification(user, 'driver_welcome', name=f"{user.first_name} {user.last_name}")
                 
-                print(f"✅ Welcome email sent to {user.email} ({user.user_type})")
+                print(f"✅ Welcome email queued for {user.email} ({user.user_type})")
             except Exception as e:
-                print(f"⚠️ Failed to send welcome email to {user.email}: {str(e)}")
+                print(f"⚠️ Failed to queue welcome email to {user.email}: {str(e)}")
                 # Don't fail registration if email fails
         else:
             print(f"📧 Email disabled - welcome email not sent to {user.email}")
@@ -272,11 +1580,13 @@ def logout():
     return redirect(url_for("index"))
 
 @app.route("/restaurants")
+@cached_page("restaurants")
 def restaurants():
     restaurants_list = Restaurant.query.filter_by(is_active=True).all()
     return render_template("restaurants.html", restaurants=restaurants_list)
 
 @app.route("/menu/<int:restaurant_id>")
+@cached_page("restaurant:{restaurant_id}")
 def menu(restaurant_id):
     restaurant = Restaurant.query.get_or_404(restaurant_id)
     dishes = Dish.query.filter_by(restaurant_id=restaurant_id, is_available=True).all()
@@ -291,12 +1601,64 @@ def menu(restaurant_id):
     
     return render_template("menu.html", restaurant=restaurant, categories=categories)
 
+@app.route("/search")
+def search():
+    params = dish_search_params()
+    per_page = 24
+    dishes = []
+    if params["term"] or params["category"]:
+        dishes = search_dishes(params["term"], params["category"], params["min_price"], params["max_price"],
+                               limit=per_page, offset=(params["page"] - 1) * per_page)
+    
+    return render_template("search.html",
+                         dishes=dishes[:per_page],
+                         has_next=len(dishes) > per_page,
+                         search_query=params["term"],
+                         category_filter=params["category"],
+                         min_price=params["min_price"],
+                         max_price=params["max_price"],
+                         page=params["page"])
+
+@app.route("/api/search")
+def api_search():
+    params = dish_search_params()
+    per_page = max(1, min(request.args.get('per_page', 24, type=int), 100))
+    if not (params["term"] or params["category"]):
+        return jsonify({"success": False, "message": "Enter a search term or category"}), 400
+    
+    dishes = search_dishes(params["term"], params["category"], params["min_price"], params["max_price"],
+                           limit=per_page, offset=(params["page"] - 1) * per_page)
+    
+    dishes_data = [{
+        "id": dish.id,
+        "title": dish.title,
+        "description": dish.description,
+        "price": dish.price,
+        "category": dish.category,
+        "restaurant": {
+            "id": dish.restaurant.id,
+            "name": dish.restaurant.name
+        }
+    } for dish in dishes[:per_page]]
+    
+    return jsonify({
+        "success": True,
+        "dishes": dishes_data,
+        "page": params["page"],
+        "has_next": len(dishes) > per_page
+    })
+
 # Cart Routes
 @app.route("/cart")
 @login_required
 def cart():
-    cart_items = session.get("cart", {})
-    total = sum(item['price'] * item['quantity'] for item in cart_items.values())
+    cart = current_cart()
+    changes = revalidate_cart(cart)
+    if changes:
+        db.session.commit()
+        flash_cart_changes(changes)
+    cart_items = cart_items_dict(cart)
+    cart_count, total = get_cart_total()
     delivery_fee = 2000
     
     return render_template("cart.html", 
@@ -308,173 +1670,216 @@ def cart():
 @app.route("/update_cart_quantity", methods=["POST"])
 @login_required
 def update_cart_quantity():
-    data = request.get_json()
-    dish_id = str(data.get('dish_id'))
-    new_quantity = int(data.get('quantity', 1))
-    
-    print(f"DEBUG: Updating cart quantity for dish {dish_id} to {new_quantity}")
-    
-    if 'cart' not in session or dish_id not in session['cart']:
-        return jsonify({'success': False, 'message': 'Item not found in cart'}), 404
+    data = request.get_json(silent=True)
+    dish_id = json_int(data, 'dish_id')
+    new_quantity = json_int(data, 'quantity', 1)
+    if dish_id is None or new_quantity is None:
+        return jsonify({'success': False, 'message': 'dish_id and quantity must be numbers'}), 400
     
     # Validate quantity
     if new_quantity < 1:
         return jsonify({'success': False, 'message': 'Quantity must be at least 1'}), 400
     
-    # Get current item details for debugging
-    current_item = session['cart'][dish_id]
-    print(f"DEBUG: Current item - Price: {current_item['price']}, Old Qty: {current_item['quantity']}, New Qty: {new_quantity}")
-    
-    # Update the quantity
-    session['cart'][dish_id]['quantity'] = new_quantity
-    session.modified = True
-    
-    # Recalculate cart totals
-    cart_count = sum(item['quantity'] for item in session['cart'].values())
-    cart_total = sum(item['price'] * item['quantity'] for item in session['cart'].values())
-    
-    print(f"DEBUG: Cart totals - Count: {cart_count}, Total: {cart_total}")
-    print(f"DEBUG: Cart items: {session['cart']}")
+    cart = current_cart()
+    updated = set_cart_line_quantity(cart, dish_id, new_quantity) if cart else None
+    if updated is None:
+        return jsonify({'success': False, 'message': 'Item not found in cart'}), 404
+    if not updated:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': 'Your cart was changed elsewhere. Please reload it.'}), 409
     
-    return jsonify({
+    response = jsonify({
         'success': True,
         'message': f'Quantity updated to {new_quantity}',
-        'cart_count': cart_count,
-        'cart_total': cart_total
+        'cart_count': cart.item_count,
+        'cart_total': cart.total
     })
+    db.session.commit()
+    return response
 
 @app.route("/add_to_cart", methods=["POST"])
 @login_required
 def add_to_cart():
-    data = request.get_json()
-    dish_id = str(data.get('dish_id'))
-    quantity = int(data.get('quantity', 1))
+    data = request.get_json(silent=True)
+    dish_id = json_int(data, 'dish_id')
+    quantity = json_int(data, 'quantity', 1)
+    if dish_id is None or quantity is None:
+        return jsonify({'success': False, 'message': 'dish_id and quantity must be numbers'}), 400
     
     dish = Dish.query.get_or_404(dish_id)
     
-    if 'cart' not in session:
-        session['cart'] = {}
-    
-    # Check if cart has items from different restaurant
-    current_cart = session['cart']
-    if current_cart:
-        first_item_id = next(iter(current_cart))
-        first_dish = Dish.query.get(first_item_id)
-        if first_dish and first_dish.restaurant_id != dish.restaurant_id:
+    # A second try covers a cart checked out or cleared by another session meanwhile
+    for attempt in range(2):
+        cart = current_cart(create=True)
+        
+        # Check if cart has items from different restaurant
+        if cart.restaurant_id is not None and cart.restaurant_id != dish.restaurant_id:
             return jsonify({
                 'success': False, 
                 'message': 'You can only order from one restaurant at a time. Clear cart first.'
             }), 400
-    
-    # Add/update item
-    if dish_id in current_cart:
-        current_cart[dish_id]['quantity'] += quantity
+        
+        try:
+            added = add_cart_line(cart, dish, quantity)
+        except IntegrityError:
+            added = False  # the cart row was deleted under the new line
+        if added:
+            break
+        db.session.rollback()
+        g.pop("cart", None)
     else:
-        current_cart[dish_id] = {
-            'title': dish.title,
-            'price': float(dish.price),
-            'quantity': quantity,
-            'restaurant_id': dish.restaurant_id
-        }
-    
-    session['cart'] = current_cart
-    session.modified = True
+        return jsonify({'success': False, 'message': 'Your cart was changed elsewhere. Please try again.'}), 409
     
-    cart_count = sum(item['quantity'] for item in current_cart.values())
-    cart_total = sum(item['price'] * item['quantity'] for item in current_cart.values())
-    
-    return jsonify({
+    response = jsonify({
         'success': True,
         'message': f'{dish.title} added to cart',
-        'cart_count': cart_count,
-        'cart_total': cart_total
+        'cart_count': cart.item_count,
+        'cart_total': cart.total
     })
+    db.session.commit()
+    return response
 
 @app.route("/remove_from_cart", methods=["POST"])
 @login_required
 def remove_from_cart():
-    data = request.get_json()
-    dish_id = str(data.get('dish_id'))
-    
-    if 'cart' in session and dish_id in session['cart']:
-        removed_item = session['cart'].pop(dish_id)
-        session.modified = True
-        
-        cart_count = sum(item['quantity'] for item in session['cart'].values())
-        cart_total = sum(item['price'] * item['quantity'] for item in session['cart'].values())
-        
-        return jsonify({
+    dish_id = json_int(request.get_json(silent=True), 'dish_id')
+    if dish_id is None:
+        return jsonify({'success': False, 'message': 'dish_id must be a number'}), 400
+    
+    cart = current_cart()
+    title = remove_cart_line(cart, dish_id) if cart else None
+    if title is not None:
+        response = jsonify({
             'success': True,
-            'message': f'{removed_item["title"]} removed from cart',
-            'cart_count': cart_count,
-            'cart_total': cart_total
+            'message': f'{title} removed from cart',
+            'cart_count': cart.item_count,
+            'cart_total': cart.total
         })
+        db.session.commit()
+        return response
     
     return jsonify({'success': False, 'message': 'Item not found in cart'}), 404
 
 @app.route("/clear_cart", methods=["POST"])
 @login_required
 def clear_cart():
-    session['cart'] = {}
-    session.modified = True
+    cart = current_cart()
+    if cart is not None:
+        delete_cart(cart)
+        db.session.commit()
+    session["cart_id"] = 0
     return jsonify({'success': True, 'message': 'Cart cleared', 'cart_count': 0, 'cart_total': 0})
 
 # Order Routes
 @app.route("/checkout", methods=["GET", "POST"])
 @login_required
+@idempotent
 def checkout():
-    cart_items = session.get("cart", {})
+    cart = current_cart()
+    
+    # Prices and availability may have changed since the items were added
+    changes = revalidate_cart(cart)
+    if changes:
+        db.session.commit()
+        if request.method == "POST" and (request.is_json or request.accept_mimetypes.best == "application/json"):
+            return jsonify({
+                "success": False,
+                "message": "Your cart has changed. Please review it before placing the order.",
+                "changes": changes,
+                "cart_count": cart.item_count,
+                "cart_total": cart.total
+            }), 409
+        flash_cart_changes(changes)
+    
+    cart_items = cart_items_dict(cart)
     if not cart_items:
         flash("Your cart is empty!", "error")
         return redirect(url_for("restaurants"))
     
+    if request.method == "POST" and changes:
+        # Let the customer confirm the new total before any money moves
+        return redirect(url_for("checkout"))
+    
     if request.method == "POST":
-        user = User.query.get(session["user_id"])
+        user = g.user
         cart_count, subtotal = get_cart_total()
+        
+        # Optional map pin for the delivery address; drivers' routes need it
+        delivery_latitude = delivery_longitude = None
+        if request.form.get("delivery_latitude") or request.form.get("delivery_longitude"):
+            try:
+                delivery_latitude, delivery_longitude = validate_coordinates(
+                    request.form.get("delivery_latitude"), request.form.get("delivery_longitude")
+                )
+            except (TypeError, ValueError):
+                flash("Invalid delivery location. Please set it on the map again.", "error")
+                return redirect(url_for("checkout"))
         delivery_fee = 2000
         total_amount = subtotal + delivery_fee
         
-        # Check wallet balance
-        if user.wallet_balance < total_amount:
+        # Get restaurant_id from cart
+        restaurant_id = cart.restaurant_id
+        
+        # Debit the wallet only if the balance covers the order. The check and the write
+        # are one statement, so concurrent checkouts cannot both spend the same money
+        debited = db.session.execute(
+            db.update(User)
+            .where(User.id == user.id, User.wallet_balance >= total_amount)
+            .values(wallet_balance=User.wallet_balance - total_amount)
+        ).rowcount
+        if not debited:
+            db.session.rollback()
             flash(f"Insufficient wallet balance. You have TZS {user.wallet_balance:.2f}, need TZS {total_amount:.2f}", "error")
             return redirect(url_for("wallet"))
         
-        # Get restaurant_id from cart
-        restaurant_id = list(cart_items.values())[0]["restaurant_id"]
+        # Reserve inventory the same way, one conditional decrement per dish. Dish id
+        # order keeps lock acquisition consistent between concurrent checkouts
+        for dish_id in sorted(cart_items, key=int):
+            item = cart_items[dish_id]
+            reserved = db.session.execute(
+                db.update(Dish)
+                .where(Dish.id == int(dish_id), Dish.inventory >= item["quantity"])
+                .values(inventory=Dish.inventory - item["quantity"])
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            if not reserved:
+                # Undoes the wallet debit and any earlier reservations
+                db.session.rollback()
+                flash(f"Sorry, there is not enough {item['title']} left for your order. Please update your cart.", "error")
+                return redirect(url_for("cart"))
         
-        # Create order
+        # Create order, already paid from the wallet
         order = Order(
             user_id=user.id,
             restaurant_id=restaurant_id,
             total_amount=total_amount,
             delivery_address=request.form.get("delivery_address", user.address),
+            delivery_latitude=delivery_latitude,
+            delivery_longitude=delivery_longitude,
             phone=request.form.get("phone", user.phone),
             payment_method="wallet",
+            payment_status="paid",
+            status="confirmed",
             special_instructions=request.form.get("special_instructions", "")
         )
         
         db.session.add(order)
         db.session.flush()
         
-        # Create order items
-        for dish_id, item in cart_items.items():
-            order_item = OrderItem(
-                order_id=order.id,
-                dish_id=int(dish_id),
-                quantity=item["quantity"],
-                price=item["price"]
-            )
-            db.session.add(order_item)
-        
-        # Deduct from wallet and confirm payment
-        user.wallet_balance -= total_amount
+        # Create order items in one bulk INSERT
+        db.session.execute(db.insert(OrderItem), [
+            {
+                "order_id": order.id,
+                "dish_id": int(dish_id),
+                "quantity": item["quantity"],
+                "price": item["price"]
+            }
+            for dish_id, item in cart_items.items()
+        ])
         session["wallet_balance"] = user.wallet_balance
-        order.payment_status = "paid"
-        order.status = "confirmed"
-        
-        db.session.commit()
         
-        # Prepare email data for order confirmation
+        # Queue notification emails in the same transaction as the order, so a crash
+        # after commit cannot lose them and SMTP never holds up the request
         if EMAIL_ENABLED:
             # Prepare order data for email
             order_data = {
@@ -495,40 +1900,41 @@ def checkout():
                     'total': item['price'] * item['quantity']
                 })
             
-            # Prepare restaurant data for email
-            restaurant_data = {
-                'name': Restaurant.query.get(restaurant_id).name
-            }
+            restaurant = Restaurant.query.get(restaurant_id)
             
-            # Send order confirmation email to customer
-            send_email_notification(
+            # Order confirmation email to customer
+            queue_email_notification(
                 user, 'order_confirmation',
                 customer_name=f"{user.first_name} {user.last_name}",
                 order=order_data,
                 items=items_data,
-                restaurant=restaurant_data
+                restaurant={'name': restaurant.name}
             )
             
-            # Send new order notification to restaurant
-            restaurant = Restaurant.query.get(restaurant_id)
+            # New order notification to restaurant
             restaurant_owner = User.query.get(restaurant.user_id)
-            send_email_notification(
+            queue_email_notification(
                 restaurant_owner, 'new_order_restaurant',
                 customer_name=f"{user.first_name} {user.last_name}",
                 order=order_data,
                 items=items_data
             )
         
+        # Clear cart in the same transaction as the order. If another session of this
+        # customer checked the same cart out first, this order would repeat it
+        if not delete_cart(cart):
+            db.session.rollback()
+            flash("This cart has already been checked out.", "error")
+            return redirect(url_for("restaurants"))
+        db.session.commit()
+        
         # Send notifications
         send_notification(user.id, f"Order #{order.id} confirmed! Total: TZS {total_amount:.2f}", "success")
         
-        # Clear cart
-        session.pop("cart", None)
-        
         flash("Order placed successfully!", "success")
         return redirect(url_for("order_success", order_id=order.id))
     
-    user = User.query.get(session["user_id"])
+    user = g.user
     cart_count, subtotal = get_cart_total()
     delivery_fee = 2000
     total = subtotal + delivery_fee
@@ -553,22 +1959,41 @@ def order_success(order_id):
 @app.route("/my_orders")
 @login_required
 def my_orders():
-    orders = Order.query.filter_by(user_id=session["user_id"]).order_by(Order.created_at.desc()).all()
+    orders = paginate_from_request(Order.query.filter_by(user_id=session["user_id"]), Order)
     return render_template("my_orders.html", orders=orders)
 
+@app.route("/api/my_orders")
+@login_required
+def api_my_orders():
+    orders = paginate_from_request(
+        Order.query.filter_by(user_id=session["user_id"]).options(db.joinedload(Order.restaurant)),
+        Order
+    )
+    
+    orders_data = [{
+        "id": order.id,
+        "restaurant_name": order.restaurant.name,
+        "total_amount": order.total_amount,
+        "status": order.status,
+        "payment_status": order.payment_status,
+        "created_at": order.created_at.strftime('%Y-%m-%d %H:%M:%S')
+    } for order in orders]
+    
+    return jsonify({"success": True, "orders": orders_data, "pagination": orders.to_dict()})
+
 # Wallet Routes
 @app.route("/wallet")
 @login_required
 def wallet():
-    user = User.query.get(session["user_id"])
-    return render_template("wallet.html", user=user)
+    return render_template("wallet.html", user=g.user)
 
 @app.route("/recharge_wallet", methods=["POST"])
 @login_required
+@idempotent
 def recharge_wallet():
     amount = float(request.form.get("amount", 0))
     if amount > 0:
-        user = User.query.get(session["user_id"])
+        user = g.user
         user.wallet_balance += amount
         session["wallet_balance"] = user.wallet_balance
         db.session.commit()
@@ -590,14 +2015,9 @@ def recharge_wallet():
 
 # Restaurant Dashboard
 @app.route("/restaurant_dashboard")
-@login_required
+@role_required("restaurant")
 def restaurant_dashboard():
-    if session.get("user_type") != "restaurant":
-        flash("Access denied. Restaurant account required.", "error")
-        return redirect(url_for("index"))
-    
-    user = User.query.get(session["user_id"])
-    restaurant = Restaurant.query.filter_by(user_id=user.id).first()
+    restaurant = g.restaurant
     
     if not restaurant:
         return redirect(url_for("setup_restaurant"))
@@ -606,31 +2026,30 @@ def restaurant_dashboard():
     recent_orders = Order.query.filter_by(restaurant_id=restaurant.id).order_by(Order.created_at.desc()).limit(10).all()
     
     # Get statistics
+    counters = get_restaurant_counters(restaurant.id)
     stats = {
-        "total_orders": Order.query.filter_by(restaurant_id=restaurant.id).count(),
-        "pending_orders": Order.query.filter_by(restaurant_id=restaurant.id, status="pending").count(),
-        "total_revenue": db.session.query(db.func.sum(Order.total_amount)).filter_by(restaurant_id=restaurant.id, payment_status="paid").scalar() or 0,
-        "menu_items": Dish.query.filter_by(restaurant_id=restaurant.id).count()
+        "total_orders": counters.total_orders,
+        "pending_orders": counters.pending_orders,
+        "total_revenue": counters.paid_revenue,
+        "menu_items": counters.total_dishes
     }
     
     return render_template("restaurant_dashboard.html", restaurant=restaurant, orders=recent_orders, stats=stats)
 
 @app.route("/setup_restaurant", methods=["GET", "POST"])
-@login_required
+@role_required("restaurant")
 def setup_restaurant():
-    if session.get("user_type") != "restaurant":
-        flash("Access denied. Restaurant account required.", "error")
-        return redirect(url_for("index"))
-    
     form = RestaurantForm()
     if form.validate_on_submit():
-        user = User.query.get(session["user_id"])
+        user = g.user
         restaurant = Restaurant(
             user_id=session["user_id"],
             name=form.name.data,
             description=form.description.data,
             address=form.address.data,
-            phone=form.phone.data
+            phone=form.phone.data,
+            latitude=form.latitude.data,
+            longitude=form.longitude.data
         )
         
         db.session.add(restaurant)
@@ -649,14 +2068,9 @@ def setup_restaurant():
     return render_template("setup_restaurant.html", form=form)
 
 @app.route("/manage_menu")
-@login_required
+@role_required("restaurant")
 def manage_menu():
-    if session.get("user_type") != "restaurant":
-        flash("Access denied.", "error")
-        return redirect(url_for("index"))
-    
-    user = User.query.get(session["user_id"])
-    restaurant = Restaurant.query.filter_by(user_id=user.id).first()
+    restaurant = g.restaurant
     
     if not restaurant:
         return redirect(url_for("setup_restaurant"))
@@ -665,14 +2079,9 @@ def manage_menu():
     return render_template("manage_menu.html", dishes=dishes, restaurant=restaurant)
 
 @app.route("/add_dish", methods=["GET", "POST"])
-@login_required
+@role_required("restaurant")
 def add_dish():
-    if session.get("user_type") != "restaurant":
-        flash("Access denied.", "error")
-        return redirect(url_for("index"))
-    
-    user = User.query.get(session["user_id"])
-    restaurant = Restaurant.query.filter_by(user_id=user.id).first()
+    restaurant = g.restaurant
     
     if not restaurant:
         return redirect(url_for("setup_restaurant"))
@@ -698,28 +2107,52 @@ def add_dish():
 
 # Driver Dashboard
 @app.route("/driver_dashboard")
-@login_required
+@role_required("driver")
 def driver_dashboard():
-    if session.get("user_type") != "driver":
-        flash("Access denied. Driver account required.", "error")
-        return redirect(url_for("index"))
-    
-    # Get available orders for delivery
-    available_orders = Order.query.filter_by(status="ready", driver_id=None).all()
+    # Available orders nearest to the driver first
+    available_orders = [order for _, order, _ in available_orders_for_driver(g.user.id)]
     my_deliveries = Order.query.filter_by(driver_id=session["user_id"]).order_by(Order.created_at.desc()).limit(10).all()
     
     return render_template("driver_dashboard.html", available_orders=available_orders, my_deliveries=my_deliveries)
 
+MAX_CLAIM_BATCH = 10  # orders a driver can claim in one request
+
+def claim_orders(driver_id, order_ids):
+    """Assign whichever of order_ids are still ready and unassigned to a driver
+    
+    The check and the write are one UPDATE ... WHERE driver_id IS NULL AND status = 'ready',
+    so when drivers race for an order exactly one UPDATE matches it and the others see
+    it missing from the RETURNING rows. Orders already taken are filtered out by a plain
+    read first, so the many drivers who lose a race never queue for the write lock.
+    Returns the claimed rows; the caller commits.
+    """
+    if not order_ids:
+        return []
+    available = db.session.scalars(
+        db.select(Order.id).where(Order.id.in_(order_ids), Order.status == "ready", Order.driver_id.is_(None))
+    ).all()
+    if not available:
+        return []
+    
+    orders_table = Order.__table__
+    rows = db.session.connection().execute(
+        orders_table.update().where(
+            orders_table.c.id.in_(available), orders_table.c.status == "ready", orders_table.c.driver_id.is_(None)
+        ).values(driver_id=driver_id, status="out_for_delivery").returning(
+            orders_table.c.id, orders_table.c.user_id, orders_table.c.restaurant_id, orders_table.c.driver_id,
+            orders_table.c.status, orders_table.c.payment_status, orders_table.c.total_amount, orders_table.c.created_at
+        )
+    ).all()
+    record_status_change(db.session, rows, "ready")
+    return rows
+
 @app.route("/take_delivery/<int:order_id>", methods=["POST"])
-@login_required
+@role_required("driver", api=True)
 def take_delivery(order_id):
-    if session.get("user_type") != "driver":
-        return jsonify({"success": False, "message": "Access denied"}), 403
-    
     order = Order.query.get_or_404(order_id)
-    if order.driver_id is None and order.status == "ready":
-        order.driver_id = session["user_id"]
-        order.status = "out_for_delivery"
+    # The read turns away drivers who already lost; among those who pass it together,
+    # the conditional UPDATE in claim_orders() lets exactly one win
+    if order.driver_id is None and order.status == "ready" and claim_orders(session["user_id"], [order_id]):
         db.session.commit()
         
         send_notification(order.user_id, f"Your order #{order.id} is out for delivery!", "info")
@@ -728,12 +2161,48 @@ def take_delivery(order_id):
     
     return jsonify({"success": False, "message": "Order not available"}), 400
 
+@app.route("/api/driver/claim", methods=["POST"])
+@role_required("driver", api=True)
+def claim_deliveries():
+    """Claim several ready orders at once: {"order_ids": [...]}; returns which ones this driver got"""
+    data = request.get_json(silent=True) or {}
+    order_ids = data.get("order_ids")
+    if not isinstance(order_ids, list) or not order_ids or not all(isinstance(order_id, int) for order_id in order_ids):
+        return jsonify({"success": False, "message": "order_ids must be a non-empty list of order ids"}), 400
+    if len(order_ids) > MAX_CLAIM_BATCH:
+        return jsonify({"success": False, "message": f"At most {MAX_CLAIM_BATCH} orders per claim"}), 413
+    
+    claimed = claim_orders(g.user.id, order_ids)
+    db.session.commit()
+    
+    for row in claimed:
+        send_notification(row.user_id, f"Your order #{row.id} is out for delivery!", "info")
+    
+    claimed_ids = sorted(row.id for row in claimed)
+    return jsonify({
+        "success": bool(claimed),
+        "message": f"Claimed {len(claimed_ids)} of {len(set(order_ids))} orders",
+        "claimed": claimed_ids,
+        "unavailable": sorted(set(order_ids) - set(claimed_ids))
+    })
+
+@app.route("/mark_picked_up/<int:order_id>", methods=["POST"])
+@role_required("driver", api=True)
+def mark_picked_up(order_id):
+    order = Order.query.get_or_404(order_id)
+    if order.driver_id == session["user_id"] and order.status == "out_for_delivery" and order.picked_up_at is None:
+        order.picked_up_at = datetime.utcnow()
+        db.session.commit()
+        
+        send_notification(order.user_id, f"Your order #{order.id} has been picked up and is on its way!", "info")
+        
+        return jsonify({"success": True, "message": "Order marked as picked up"})
+    
+    return jsonify({"success": False, "message": "Invalid order"}), 400
+
 @app.route("/mark_delivered/<int:order_id>", methods=["POST"])
-@login_required
+@role_required("driver", api=True)
 def mark_delivered(order_id):
-    if session.get("user_type") != "driver":
-        return jsonify({"success": False, "message": "Access denied"}), 403
-    
     order = Order.query.get_or_404(order_id)
     if order.driver_id == session["user_id"] and order.status == "out_for_delivery":
         order.status = "delivered"
@@ -747,12 +2216,8 @@ def mark_delivered(order_id):
 
 # Admin Dashboard
 @app.route("/admin_dashboard")
-@login_required
+@role_required("admin")
 def admin_dashboard():
-    if session.get("user_type") != "admin":
-        flash("Access denied. Admin account required.", "error")
-        return redirect(url_for("index"))
-    
     stats = {
         "total_users": User.query.count(),
         "total_restaurants": Restaurant.query.count(),
@@ -764,22 +2229,82 @@ def admin_dashboard():
     
     return render_template("admin_dashboard.html", stats=stats, recent_orders=recent_orders)
 
+@app.route("/api/admin/metrics")
+@role_required("admin", api=True)
+def api_admin_metrics():
+    metrics = {
+        "email_outbox": email_outbox.stats() if email_outbox else None,
+        "smtp_pool": email_service.pool.stats() if EMAIL_ENABLED else None,
+        "outbox_table": dict(db.session.query(Outbox.status, db.func.count(Outbox.id)).group_by(Outbox.status).all()),
+        "page_cache": page_cache.stats(),
+        "driver_locations": driver_locations.stats(),
+        "event_bus": event_bus.stats(),
+        "event_streams": event_streams.stats(),
+        "dispatcher": dispatcher.stats(),
+        "routes": route_planner.stats()
+    }
+    
+    return jsonify({"success": True, "metrics": metrics})
+
 # Admin Order Management
 @app.route("/admin/orders")
-@login_required
+@role_required("admin")
 def admin_orders():
-    if session.get("user_type") != "admin":
-        flash("Access denied. Admin account required.", "error")
-        return redirect(url_for("index"))
-    
     # Get filter parameters
     status_filter = request.args.get('status', '')
     restaurant_filter = request.args.get('restaurant', '')
     date_filter = request.args.get('date', '')
+    search_query = request.args.get('search', '')
+    
+    orders = paginate_from_request(
+        admin_orders_query(status_filter, restaurant_filter, date_filter, search_query), Order
+    )
+    
+    # Get all restaurants for filter dropdown
+    restaurants = Restaurant.query.all()
     
-    # Build query
+    return render_template("admin_orders.html", 
+                         orders=orders, 
+                         restaurants=restaurants,
+                         status_filter=status_filter,
+                         restaurant_filter=restaurant_filter,
+                         date_filter=date_filter,
+                         search_query=search_query)
+
+@app.route("/api/admin/orders")
+@role_required("admin", api=True)
+def api_admin_orders():
+    query = admin_orders_query(
+        request.args.get('status', ''),
+        request.args.get('restaurant', ''),
+        request.args.get('date', ''),
+        request.args.get('search', '')
+    ).options(db.joinedload(Order.user), db.joinedload(Order.restaurant))
+    orders = paginate_from_request(query, Order)
+    
+    orders_data = [{
+        "id": order.id,
+        "customer_name": f"{order.user.first_name} {order.user.last_name}",
+        "restaurant_name": order.restaurant.name,
+        "total_amount": order.total_amount,
+        "status": order.status,
+        "payment_status": order.payment_status,
+        "created_at": order.created_at.strftime('%Y-%m-%d %H:%M:%S')
+    } for order in orders]
+    
+    return jsonify({"success": True, "orders": orders_data, "pagination": orders.to_dict()})
+
+def admin_orders_query(status_filter, restaurant_filter, date_filter, search_query=''):
+    """Filtered Order query shared by the admin orders page and its JSON API"""
     query = Order.query
     
+    if search_query:
+        # An order number matches directly; anything else goes through phone and delivery address
+        condition = search_filter(Order, 'order_fts', search_query, ORDER_SEARCH_COLUMNS)
+        if search_query.strip().lstrip('#').isdigit():
+            condition = db.or_(Order.id == int(search_query.strip().lstrip('#')), condition)
+        query = query.filter(condition)
+    
     if status_filter:
         query = query.filter(Order.status == status_filter)
     
@@ -788,35 +2313,66 @@ def admin_orders():
     
     if date_filter:
         try:
+            # Half-open range on the raw column so the created_at indexes can be used
             filter_date = datetime.strptime(date_filter, '%Y-%m-%d')
-            query = query.filter(db.func.date(Order.created_at) == filter_date.date())
+            query = query.filter(
+                Order.created_at >= filter_date,
+                Order.created_at < filter_date + timedelta(days=1)
+            )
         except ValueError:
             pass
     
-    # Get paginated results
-    page = request.args.get('page', 1, type=int)
-    per_page = 20
-    orders = query.order_by(Order.created_at.desc()).paginate(
-        page=page, per_page=per_page, error_out=False
-    )
+    return query
+
+@app.route("/api/admin/search")
+@role_required("admin", api=True)
+def api_admin_search():
+    """Typeahead for the admin search box: best matching users, restaurants and orders"""
+    term = request.args.get('q', '').strip()
+    limit = max(1, min(request.args.get('limit', 10, type=int), 50))
+    if not term:
+        return jsonify({"success": True, "users": [], "restaurants": [], "orders": []})
     
-    # Get all restaurants for filter dropdown
-    restaurants = Restaurant.query.all()
+    users = ranked_search(User, 'user_fts', term, USER_SEARCH_COLUMNS, limit)
+    restaurants = ranked_search(Restaurant, 'restaurant_fts', term, RESTAURANT_SEARCH_COLUMNS, limit)
+    orders = ranked_search(Order, 'order_fts', term, ORDER_SEARCH_COLUMNS, limit)
     
-    return render_template("admin_orders.html", 
-                         orders=orders, 
-                         restaurants=restaurants,
-                         status_filter=status_filter,
-                         restaurant_filter=restaurant_filter,
-                         date_filter=date_filter)
+    # An exact order number goes first
+    order_number = term.lstrip('#')
+    if order_number.isdigit():
+        exact = Order.query.get(int(order_number))
+        if exact:
+            orders = [exact] + [order for order in orders if order.id != exact.id][:limit - 1]
+    
+    return jsonify({
+        "success": True,
+        "users": [{
+            "id": user.id,
+            "name": f"{user.first_name} {user.last_name}",
+            "username": user.username,
+            "email": user.email,
+            "phone": user.phone,
+            "user_type": user.user_type
+        } for user in users],
+        "restaurants": [{
+            "id": restaurant.id,
+            "name": restaurant.name,
+            "address": restaurant.address,
+            "phone": restaurant.phone,
+            "is_active": restaurant.is_active
+        } for restaurant in restaurants],
+        "orders": [{
+            "id": order.id,
+            "phone": order.phone,
+            "delivery_address": order.delivery_address,
+            "status": order.status,
+            "total_amount": order.total_amount
+        } for order in orders]
+    })
 
 @app.route("/admin/order/<int:order_id>")
-@login_required
+@role_required("admin")
 def admin_order_details(order_id):
-    if session.get("user_type") != "admin":
-        flash("Access denied. Admin account required.", "error")
-        return redirect(url_for("index"))
-    
     order = Order.query.get_or_404(order_id)
     
     # Get order items with dish details
@@ -825,11 +2381,8 @@ def admin_order_details(order_id):
     return render_template("admin_order_details.html", order=order, order_items=order_items)
 
 @app.route("/api/admin/order/<int:order_id>", methods=["GET"])
-@login_required
+@role_required("admin", api=True)
 def api_admin_order_details(order_id):
-    if session.get("user_type") != "admin":
-        return jsonify({"success": False, "message": "Access denied"}), 403
-    
     order = Order.query.get_or_404(order_id)
     order_items = OrderItem.query.filter_by(order_id=order_id).all()
     
@@ -877,11 +2430,8 @@ def api_admin_order_details(order_id):
     return jsonify({"success": True, "order": order_data})
 
 @app.route("/api/admin/update_order_status", methods=["POST"])
-@login_required
+@role_required("admin", api=True)
 def api_admin_update_order_status():
-    if session.get("user_type") != "admin":
-        return jsonify({"success": False, "message": "Access denied"}), 403
-    
     data = request.get_json()
     order_id = data.get("order_id")
     new_status = data.get("status")
@@ -896,21 +2446,21 @@ def api_admin_update_order_status():
         # You could add a notes field to the Order model or create a separate OrderNotes model
         pass
     
-    db.session.commit()
-    
-    # Send notification to customer about status update
-    send_notification(order.user_id, f"Order #{order.id} status updated from {old_status} to {new_status}", "info")
-    
-    # Send email notification if enabled
+    # Queue the customer's email with the status change, so it survives a crash and can join a digest
     if EMAIL_ENABLED:
         customer = User.query.get(order.user_id)
-        send_email_notification(
+        queue_email_notification(
             customer, 'order_status',
             customer_name=f"{customer.first_name} {customer.last_name}",
             order_id=order.id,
             status=new_status
         )
     
+    db.session.commit()
+    
+    # Send notification to customer about status update
+    send_notification(order.user_id, f"Order #{order.id} status updated from {old_status} to {new_status}", "info")
+    
     return jsonify({
         "success": True, 
         "message": f"Order #{order.id} status updated to {new_status}",
@@ -918,11 +2468,8 @@ def api_admin_update_order_status():
     })
 
 @app.route("/api/toggle_dish_availability", methods=["POST"])
-@login_required
+@role_required("restaurant", api=True)
 def toggle_dish_availability():
-    if session.get("user_type") != "restaurant":
-        return jsonify({"success": False, "message": "Access denied"}), 403
-    
     data = request.get_json()
     dish_id = data.get("dish_id")
     is_available = data.get("is_available")
@@ -930,8 +2477,7 @@ def toggle_dish_availability():
     dish = Dish.query.get_or_404(dish_id)
     
     # Check if user owns this restaurant
-    restaurant = Restaurant.query.filter_by(user_id=session["user_id"]).first()
-    if dish.restaurant_id != restaurant.id:
+    if g.restaurant is None or dish.restaurant_id != g.restaurant.id:
         return jsonify({"success": False, "message": "Access denied"}), 403
     
     dish.is_available = is_available
@@ -940,19 +2486,15 @@ def toggle_dish_availability():
     return jsonify({"success": True, "message": "Dish availability updated"})
 
 @app.route("/api/delete_dish", methods=["POST"])
-@login_required
+@role_required("restaurant", api=True)
 def delete_dish():
-    if session.get("user_type") != "restaurant":
-        return jsonify({"success": False, "message": "Access denied"}), 403
-    
     data = request.get_json()
     dish_id = data.get("dish_id")
     
     dish = Dish.query.get_or_404(dish_id)
     
     # Check if user owns this restaurant
-    restaurant = Restaurant.query.filter_by(user_id=session["user_id"]).first()
-    if dish.restaurant_id != restaurant.id:
+    if g.restaurant is None or dish.restaurant_id != g.restaurant.id:
         return jsonify({"success": False, "message": "Access denied"}), 403
     
     db.session.delete(dish)
@@ -962,18 +2504,46 @@ def delete_dish():
 
 # Admin User Management
 @app.route("/admin/users")
-@login_required
+@role_required("admin")
 def admin_users():
-    if session.get("user_type") != "admin":
-        flash("Access denied. Admin account required.", "error")
-        return redirect(url_for("index"))
-    
     # Get filter parameters
     user_type_filter = request.args.get('user_type', '')
     status_filter = request.args.get('status', '')
     search_query = request.args.get('search', '')
     
-    # Build query
+    users = paginate_from_request(admin_users_query(user_type_filter, status_filter, search_query), User)
+    
+    return render_template("admin_users.html", 
+                         users=users,
+                         user_type_filter=user_type_filter,
+                         status_filter=status_filter,
+                         search_query=search_query)
+
+@app.route("/api/admin/users")
+@role_required("admin", api=True)
+def api_admin_users():
+    users = paginate_from_request(admin_users_query(
+        request.args.get('user_type', ''),
+        request.args.get('status', ''),
+        request.args.get('search', '')
+    ), User)
+    
+    users_data = [{
+        "id": user.id,
+        "username": user.username,
+        "email": user.email,
+        "first_name": user.first_name,
+        "last_name": user.last_name,
+        "phone": user.phone,
+        "user_type": user.user_type,
+        "wallet_balance": user.wallet_balance,
+        "created_at": user.created_at.strftime('%Y-%m-%d %H:%M:%S')
+    } for user in users]
+    
+    return jsonify({"success": True, "users": users_data, "pagination": users.to_dict()})
+
+def admin_users_query(user_type_filter, status_filter, search_query):
+    """Filtered User query shared by the admin users page and its JSON API"""
     query = User.query
     
     if user_type_filter:
@@ -987,35 +2557,13 @@ def admin_users():
         pass
     
     if search_query:
-        query = query.filter(
-            db.or_(
-                User.username.ilike(f'%{search_query}%'),
-                User.email.ilike(f'%{search_query}%'),
-                User.first_name.ilike(f'%{search_query}%'),
-                User.last_name.ilike(f'%{search_query}%')
-            )
-        )
+        query = query.filter(search_filter(User, 'user_fts', search_query, USER_SEARCH_COLUMNS))
     
-    # Get paginated results
-    page = request.args.get('page', 1, type=int)
-    per_page = 20
-    users = query.order_by(User.created_at.desc()).paginate(
-        page=page, per_page=per_page, error_out=False
-    )
-    
-    return render_template("admin_users.html", 
-                         users=users,
-                         user_type_filter=user_type_filter,
-                         status_filter=status_filter,
-                         search_query=search_query)
+    return query
 
 @app.route("/admin/user/<int:user_id>")
-@login_required
+@role_required("admin")
 def admin_user_details(user_id):
-    if session.get("user_type") != "admin":
-        flash("Access denied. Admin account required.", "error")
-        return redirect(url_for("index"))
-    
     user = User.query.get_or_404(user_id)
     
     # Get user statistics
@@ -1039,11 +2587,8 @@ def admin_user_details(user_id):
                          restaurants_owned=restaurants_owned)
 
 @app.route("/api/admin/user/<int:user_id>", methods=["GET"])
-@login_required
+@role_required("admin", api=True)
 def api_admin_user_details(user_id):
-    if session.get("user_type") != "admin":
-        return jsonify({"success": False, "message": "Access denied"}), 403
-    
     user = User.query.get_or_404(user_id)
     
     # Get user statistics
@@ -1072,11 +2617,8 @@ def api_admin_user_details(user_id):
     return jsonify({"success": True, "user": user_data})
 
 @app.route("/api/admin/update_user_status", methods=["POST"])
-@login_required
+@role_required("admin", api=True)
 def api_admin_update_user_status():
-    if session.get("user_type") != "admin":
-        return jsonify({"success": False, "message": "Access denied"}), 403
-    
     data = request.get_json()
     user_id = data.get("user_id")
     action = data.get("action")  # "activate", "deactivate", "change_type"
@@ -1137,11 +2679,8 @@ def api_admin_update_user_status():
     return jsonify({"success": False, "message": "Invalid action"}), 400
 
 @app.route("/api/admin/delete_user", methods=["POST"])
-@login_required
+@role_required("admin", api=True)
 def api_admin_delete_user():
-    if session.get("user_type") != "admin":
-        return jsonify({"success": False, "message": "Access denied"}), 403
-    
     data = request.get_json()
     user_id = data.get("user_id")
     
@@ -1170,12 +2709,8 @@ def api_admin_delete_user():
 
 # Admin Reports
 @app.route("/admin/reports")
-@login_required
+@role_required("admin")
 def admin_reports():
-    if session.get("user_type") != "admin":
-        flash("Access denied. Admin account required.", "error")
-        return redirect(url_for("index"))
-    
     # Get date range parameters
     start_date = request.args.get('start_date', '')
     end_date = request.args.get('end_date', '')
@@ -1194,43 +2729,35 @@ def admin_reports():
         start_dt = datetime.now() - timedelta(days=30)
         end_dt = datetime.now()
     
+    # Everything below reads the DailyStats rollup: O(days) rows instead of O(orders)
+    in_range = daily_stats_range(start_dt, end_dt)
+    
     # Get basic statistics
+    totals = daily_stats_totals()
     stats = {
-        "total_users": User.query.count(),
-        "total_restaurants": Restaurant.query.count(),
-        "total_orders": Order.query.count(),
-        "total_revenue": db.session.query(db.func.sum(Order.total_amount)).filter_by(payment_status="paid").scalar() or 0
+        "total_users": totals["new_users"],
+        "total_restaurants": totals["new_restaurants"],
+        "total_orders": totals["order_count"],
+        "total_revenue": totals["paid_revenue"]
     }
     
     # Get date range statistics
+    range_totals = daily_stats_totals(*in_range)
     range_stats = {
-        "orders_in_range": Order.query.filter(
-            Order.created_at >= start_dt,
-            Order.created_at < end_dt
-        ).count(),
-        "revenue_in_range": db.session.query(db.func.sum(Order.total_amount)).filter(
-            Order.created_at >= start_dt,
-            Order.created_at < end_dt,
-            Order.payment_status == "paid"
-        ).scalar() or 0,
-        "new_users_in_range": User.query.filter(
-            User.created_at >= start_dt,
-            User.created_at < end_dt
-        ).count(),
-        "new_restaurants_in_range": Restaurant.query.filter(
-            Restaurant.created_at >= start_dt,
-            Restaurant.created_at < end_dt
-        ).count()
+        "orders_in_range": range_totals["order_count"],
+        "revenue_in_range": range_totals["paid_revenue"],
+        "new_users_in_range": range_totals["new_users"],
+        "new_restaurants_in_range": range_totals["new_restaurants"]
     }
     
     # Get order status distribution
-    order_status_stats = db.session.query(
-        Order.status,
-        db.func.count(Order.id)
-    ).filter(
-        Order.created_at >= start_dt,
-        Order.created_at < end_dt
-    ).group_by(Order.status).all()
+    order_status_stats = [
+        (status, range_totals[status_count_column(status)])
+        for status in ORDER_STATUSES
+        if range_totals[status_count_column(status)]
+    ]
+    if range_totals["other_status_count"]:
+        order_status_stats.append(("other", range_totals["other_status_count"]))
     
     # Get user type distribution
     user_type_stats = db.session.query(
@@ -1241,26 +2768,26 @@ def admin_reports():
     # Get top restaurants by orders
     top_restaurants = db.session.query(
         Restaurant.name,
-        db.func.count(Order.id).label('order_count'),
-        db.func.sum(Order.total_amount).label('total_revenue')
-    ).join(Order).filter(
-        Order.created_at >= start_dt,
-        Order.created_at < end_dt
-    ).group_by(Restaurant.id, Restaurant.name).order_by(
-        db.func.count(Order.id).desc()
+        db.func.sum(DailyStats.order_count).label('order_count'),
+        db.func.sum(DailyStats.gross_revenue).label('total_revenue')
+    ).join(DailyStats, DailyStats.restaurant_id == Restaurant.id).filter(
+        *in_range
+    ).group_by(Restaurant.id, Restaurant.name).having(
+        db.func.sum(DailyStats.order_count) > 0
+    ).order_by(
+        db.func.sum(DailyStats.order_count).desc()
     ).limit(10).all()
     
     # Get daily order trends
     daily_orders = db.session.query(
-        db.func.date(Order.created_at).label('date'),
-        db.func.count(Order.id).label('order_count'),
-        db.func.sum(Order.total_amount).label('daily_revenue')
+        DailyStats.day.label('date'),
+        db.func.sum(DailyStats.order_count).label('order_count'),
+        db.func.sum(DailyStats.gross_revenue).label('daily_revenue')
     ).filter(
-        Order.created_at >= start_dt,
-        Order.created_at < end_dt
-    ).group_by(db.func.date(Order.created_at)).order_by(
-        db.func.date(Order.created_at)
-    ).all()
+        *in_range
+    ).group_by(DailyStats.day).having(
+        db.func.sum(DailyStats.order_count) > 0
+    ).order_by(DailyStats.day).all()
     
     # Get recent activity
     recent_orders = Order.query.order_by(Order.created_at.desc()).limit(10).all()
@@ -1280,11 +2807,8 @@ def admin_reports():
                          report_type=report_type)
 
 @app.route("/api/admin/reports/data")
-@login_required
+@role_required("admin", api=True)
 def api_admin_reports_data():
-    if session.get("user_type") != "admin":
-        return jsonify({"success": False, "message": "Access denied"}), 403
-    
     # Get parameters
     report_type = request.args.get('type', 'overview')
     start_date = request.args.get('start_date', '')
@@ -1302,18 +2826,16 @@ def api_admin_reports_data():
         start_dt = datetime.now() - timedelta(days=30)
         end_dt = datetime.now()
     
+    in_range = daily_stats_range(start_dt, end_dt)
+    
     if report_type == 'revenue':
         # Revenue data
         daily_revenue = db.session.query(
-            db.func.date(Order.created_at).label('date'),
-            db.func.sum(Order.total_amount).label('revenue')
-        ).filter(
-            Order.created_at >= start_dt,
-            Order.created_at < end_dt,
-            Order.payment_status == "paid"
-        ).group_by(db.func.date(Order.created_at)).order_by(
-            db.func.date(Order.created_at)
-        ).all()
+            DailyStats.day.label('date'),
+            db.func.sum(DailyStats.paid_revenue).label('revenue')
+        ).filter(*in_range).group_by(DailyStats.day).having(
+            db.func.sum(DailyStats.paid_revenue) > 0
+        ).order_by(DailyStats.day).all()
         
         return jsonify({
             "success": True,
@@ -1326,14 +2848,11 @@ def api_admin_reports_data():
     elif report_type == 'orders':
         # Order data
         daily_orders = db.session.query(
-            db.func.date(Order.created_at).label('date'),
-            db.func.count(Order.id).label('order_count')
-        ).filter(
-            Order.created_at >= start_dt,
-            Order.created_at < end_dt
-        ).group_by(db.func.date(Order.created_at)).order_by(
-            db.func.date(Order.created_at)
-        ).all()
+            DailyStats.day.label('date'),
+            db.func.sum(DailyStats.order_count).label('order_count')
+        ).filter(*in_range).group_by(DailyStats.day).having(
+            db.func.sum(DailyStats.order_count) > 0
+        ).order_by(DailyStats.day).all()
         
         return jsonify({
             "success": True,
@@ -1346,14 +2865,13 @@ def api_admin_reports_data():
     elif report_type == 'users':
         # User registration data
         daily_users = db.session.query(
-            db.func.date(User.created_at).label('date'),
-            db.func.count(User.id).label('user_count')
+            DailyStats.day.label('date'),
+            DailyStats.new_users.label('user_count')
         ).filter(
-            User.created_at >= start_dt,
-            User.created_at < end_dt
-        ).group_by(db.func.date(User.created_at)).order_by(
-            db.func.date(User.created_at)
-        ).all()
+            *in_range,
+            DailyStats.restaurant_id == 0,
+            DailyStats.new_users > 0
+        ).order_by(DailyStats.day).all()
         
         return jsonify({
             "success": True,
@@ -1366,12 +2884,8 @@ def api_admin_reports_data():
     return jsonify({"success": False, "message": "Invalid report type"}), 400
 
 @app.route("/admin/reports/export")
-@login_required
+@role_required("admin")
 def admin_reports_export():
-    if session.get("user_type") != "admin":
-        flash("Access denied. Admin account required.", "error")
-        return redirect(url_for("index"))
-    
     report_type = request.args.get('type', 'orders')
     start_date = request.args.get('start_date', '')
     end_date = request.args.get('end_date', '')
@@ -1388,74 +2902,132 @@ def admin_reports_export():
         start_dt = datetime.now() - timedelta(days=30)
         end_dt = datetime.now()
     
+    # Gzip-compressed download with ?gzip=1
+    compress = request.args.get('gzip', '') in ('1', 'true', 'yes')
+    
+    # Each export is one joined projection query streamed in yield_per batches, so
+    # memory stays flat and there are no per-row user/restaurant lookups
     if report_type == 'orders':
         # Export orders report
-        orders = Order.query.filter(
+        rows = db.session.query(
+            Order.id,
+            User.first_name,
+            User.last_name,
+            Restaurant.name,
+            Order.total_amount,
+            Order.status,
+            Order.payment_status,
+            Order.created_at
+        ).join(User, Order.user_id == User.id).join(Restaurant, Order.restaurant_id == Restaurant.id).filter(
             Order.created_at >= start_dt,
             Order.created_at < end_dt
-        ).order_by(Order.created_at.desc()).all()
-        
-        # Create CSV data
-        csv_data = "Order ID,Customer,Restaurant,Amount,Status,Payment Status,Date\n"
-        for order in orders:
-            csv_data += f"{order.id},{order.user.first_name} {order.user.last_name},{order.restaurant.name},{order.total_amount},{order.status},{order.payment_status},{order.created_at.strftime('%Y-%m-%d %H:%M')}\n"
+        ).order_by(Order.created_at.desc()).execution_options(yield_per=1000)
         
-        response = make_response(csv_data)
-        response.headers["Content-Disposition"] = f"attachment; filename=orders_report_{start_date}_to_{end_date}.csv"
-        response.headers["Content-Type"] = "text/csv"
-        return response
+        return stream_csv(
+            f"orders_report_{start_date}_to_{end_date}.csv",
+            ["Order ID", "Customer", "Restaurant", "Amount", "Status", "Payment Status", "Date"],
+            (
+                (row.id, f"{row.first_name} {row.last_name}", row.name, row.total_amount,
+                 row.status, row.payment_status, row.created_at.strftime('%Y-%m-%d %H:%M'))
+                for row in rows
+            ),
+            compress=compress
+        )
     
     elif report_type == 'users':
         # Export users report
-        users = User.query.filter(
+        rows = db.session.query(
+            User.id,
+            User.first_name,
+            User.last_name,
+            User.username,
+            User.email,
+            User.user_type,
+            User.wallet_balance,
+            User.created_at
+        ).filter(
             User.created_at >= start_dt,
             User.created_at < end_dt
-        ).order_by(User.created_at.desc()).all()
-        
-        # Create CSV data
-        csv_data = "User ID,Name,Username,Email,Type,Wallet Balance,Joined\n"
-        for user in users:
-            csv_data += f"{user.id},{user.first_name} {user.last_name},{user.username},{user.email},{user.user_type},{user.wallet_balance},{user.created_at.strftime('%Y-%m-%d')}\n"
+        ).order_by(User.created_at.desc()).execution_options(yield_per=1000)
         
-        response = make_response(csv_data)
-        response.headers["Content-Disposition"] = f"attachment; filename=users_report_{start_date}_to_{end_date}.csv"
-        response.headers["Content-Type"] = "text/csv"
-        return response
+        return stream_csv(
+            f"users_report_{start_date}_to_{end_date}.csv",
+            ["User ID", "Name", "Username", "Email", "Type", "Wallet Balance", "Joined"],
+            (
+                (row.id, f"{row.first_name} {row.last_name}", row.username, row.email,
+                 row.user_type, row.wallet_balance, row.created_at.strftime('%Y-%m-%d'))
+                for row in rows
+            ),
+            compress=compress
+        )
     
     elif report_type == 'revenue':
         # Export revenue report
-        orders = Order.query.filter(
+        rows = db.session.query(
+            Order.created_at,
+            Order.id,
+            User.first_name,
+            User.last_name,
+            Restaurant.name,
+            Order.total_amount
+        ).join(User, Order.user_id == User.id).join(Restaurant, Order.restaurant_id == Restaurant.id).filter(
             Order.created_at >= start_dt,
             Order.created_at < end_dt,
             Order.payment_status == "paid"
-        ).order_by(Order.created_at.desc()).all()
+        ).order_by(Order.created_at.desc()).execution_options(yield_per=1000)
         
-        # Create CSV data
-        csv_data = "Date,Order ID,Customer,Restaurant,Amount\n"
-        for order in orders:
-            csv_data += f"{order.created_at.strftime('%Y-%m-%d')},{order.id},{order.user.first_name} {order.user.last_name},{order.restaurant.name},{order.total_amount}\n"
-        
-        response = make_response(csv_data)
-        response.headers["Content-Disposition"] = f"attachment; filename=revenue_report_{start_date}_to_{end_date}.csv"
-        response.headers["Content-Type"] = "text/csv"
-        return response
+        return stream_csv(
+            f"revenue_report_{start_date}_to_{end_date}.csv",
+            ["Date", "Order ID", "Customer", "Restaurant", "Amount"],
+            (
+                (row.created_at.strftime('%Y-%m-%d'), row.id, f"{row.first_name} {row.last_name}",
+                 row.name, row.total_amount)
+                for row in rows
+            ),
+            compress=compress
+        )
     
     flash("Invalid report type", "error")
     return redirect(url_for("admin_reports"))
 
 # Admin Restaurant Management
 @app.route("/admin/restaurants")
-@login_required
+@role_required("admin")
 def admin_restaurants():
-    if session.get("user_type") != "admin":
-        flash("Access denied. Admin account required.", "error")
-        return redirect(url_for("index"))
-    
     # Get filter parameters
     status_filter = request.args.get('status', '')
     search_query = request.args.get('search', '')
     
-    # Build query
+    restaurants = paginate_from_request(admin_restaurants_query(status_filter, search_query), Restaurant)
+    
+    return render_template("admin_restaurants.html", 
+                         restaurants=restaurants,
+                         status_filter=status_filter,
+                         search_query=search_query)
+
+@app.route("/api/admin/restaurants")
+@role_required("admin", api=True)
+def api_admin_restaurants():
+    query = admin_restaurants_query(
+        request.args.get('status', ''),
+        request.args.get('search', '')
+    ).options(db.joinedload(Restaurant.user))
+    restaurants = paginate_from_request(query, Restaurant)
+    
+    restaurants_data = [{
+        "id": restaurant.id,
+        "name": restaurant.name,
+        "address": restaurant.address,
+        "phone": restaurant.phone,
+        "is_active": restaurant.is_active,
+        "owner_name": f"{restaurant.user.first_name} {restaurant.user.last_name}",
+        "created_at": restaurant.created_at.strftime('%Y-%m-%d %H:%M:%S')
+    } for restaurant in restaurants]
+    
+    return jsonify({"success": True, "restaurants": restaurants_data, "pagination": restaurants.to_dict()})
+
+def admin_restaurants_query(status_filter, search_query):
+    """Filtered Restaurant query shared by the admin restaurants page and its JSON API"""
     query = Restaurant.query
     
     if status_filter == 'active':
@@ -1464,41 +3036,22 @@ def admin_restaurants():
         query = query.filter(Restaurant.is_active == False)
     
     if search_query:
-        query = query.filter(
-            db.or_(
-                Restaurant.name.ilike(f'%{search_query}%'),
-                Restaurant.address.ilike(f'%{search_query}%'),
-                Restaurant.phone.ilike(f'%{search_query}%')
-            )
-        )
-    
-    # Get paginated results
-    page = request.args.get('page', 1, type=int)
-    per_page = 20
-    restaurants = query.order_by(Restaurant.created_at.desc()).paginate(
-        page=page, per_page=per_page, error_out=False
-    )
+        query = query.filter(search_filter(Restaurant, 'restaurant_fts', search_query, RESTAURANT_SEARCH_COLUMNS))
     
-    return render_template("admin_restaurants.html", 
-                         restaurants=restaurants,
-                         status_filter=status_filter,
-                         search_query=search_query)
+    return query
 
 @app.route("/admin/restaurant/<int:restaurant_id>")
-@login_required
+@role_required("admin")
 def admin_restaurant_details(restaurant_id):
-    if session.get("user_type") != "admin":
-        flash("Access denied. Admin account required.", "error")
-        return redirect(url_for("index"))
-    
     restaurant = Restaurant.query.get_or_404(restaurant_id)
     
     # Get restaurant statistics
+    counters = get_restaurant_counters(restaurant_id)
     restaurant_stats = {
-        "total_orders": Order.query.filter_by(restaurant_id=restaurant_id).count(),
-        "total_revenue": db.session.query(db.func.sum(Order.total_amount)).filter_by(restaurant_id=restaurant_id, payment_status="paid").scalar() or 0,
-        "total_dishes": Dish.query.filter_by(restaurant_id=restaurant_id).count(),
-        "active_dishes": Dish.query.filter_by(restaurant_id=restaurant_id, is_available=True).count()
+        "total_orders": counters.total_orders,
+        "total_revenue": counters.paid_revenue,
+        "total_dishes": counters.total_dishes,
+        "active_dishes": counters.active_dishes
     }
     
     # Get recent orders
@@ -1514,19 +3067,17 @@ def admin_restaurant_details(restaurant_id):
                          dishes=dishes)
 
 @app.route("/api/admin/restaurant/<int:restaurant_id>", methods=["GET"])
-@login_required
+@role_required("admin", api=True)
 def api_admin_restaurant_details(restaurant_id):
-    if session.get("user_type") != "admin":
-        return jsonify({"success": False, "message": "Access denied"}), 403
-    
     restaurant = Restaurant.query.get_or_404(restaurant_id)
     
     # Get restaurant statistics
+    counters = get_restaurant_counters(restaurant_id)
     restaurant_stats = {
-        "total_orders": Order.query.filter_by(restaurant_id=restaurant_id).count(),
-        "total_revenue": db.session.query(db.func.sum(Order.total_amount)).filter_by(restaurant_id=restaurant_id, payment_status="paid").scalar() or 0,
-        "total_dishes": Dish.query.filter_by(restaurant_id=restaurant_id).count(),
-        "active_dishes": Dish.query.filter_by(restaurant_id=restaurant_id, is_available=True).count()
+        "total_orders": counters.total_orders,
+        "total_revenue": counters.paid_revenue,
+        "total_dishes": counters.total_dishes,
+        "active_dishes": counters.active_dishes
     }
     
     # Prepare restaurant data for JSON response
@@ -1536,6 +3087,8 @@ def api_admin_restaurant_details(restaurant_id):
         "description": restaurant.description,
         "address": restaurant.address,
         "phone": restaurant.phone,
+        "latitude": restaurant.latitude,
+        "longitude": restaurant.longitude,
         "is_active": restaurant.is_active,
         "created_at": restaurant.created_at.strftime('%Y-%m-%d %H:%M:%S'),
         "owner": {
@@ -1549,11 +3102,8 @@ def api_admin_restaurant_details(restaurant_id):
     return jsonify({"success": True, "restaurant": restaurant_data})
 
 @app.route("/api/admin/update_restaurant_status", methods=["POST"])
-@login_required
+@role_required("admin", api=True)
 def api_admin_update_restaurant_status():
-    if session.get("user_type") != "admin":
-        return jsonify({"success": False, "message": "Access denied"}), 403
-    
     data = request.get_json()
     restaurant_id = data.get("restaurant_id")
     action = data.get("action")  # "activate", "deactivate", "update_info"
@@ -1595,6 +3145,11 @@ def api_admin_update_restaurant_status():
         restaurant.description = new_description
         restaurant.address = new_address
         restaurant.phone = new_phone
+        if data.get("latitude") is not None and data.get("longitude") is not None:
+            try:
+                restaurant.latitude, restaurant.longitude = validate_coordinates(data["latitude"], data["longitude"])
+            except (TypeError, ValueError):
+                return jsonify({"success": False, "message": "Invalid coordinates"}), 400
         db.session.commit()
         
         # Send notification to restaurant owner
@@ -1608,11 +3163,8 @@ def api_admin_update_restaurant_status():
     return jsonify({"success": False, "message": "Invalid action"}), 400
 
 @app.route("/api/admin/delete_restaurant", methods=["POST"])
-@login_required
+@role_required("admin", api=True)
 def api_admin_delete_restaurant():
-    if session.get("user_type") != "admin":
-        return jsonify({"success": False, "message": "Access denied"}), 403
-    
     data = request.get_json()
     restaurant_id = data.get("restaurant_id")
     
@@ -1646,116 +3198,557 @@ def api_admin_delete_restaurant():
 
 # Driver Map Routes
 @app.route("/driver/map")
-@login_required
+@role_required("driver")
 def driver_map():
-    if session.get("user_type") != "driver":
-        flash("Access denied. Driver account required.", "error")
-        return redirect(url_for("index"))
-    
-    # Get driver's active deliveries
-    active_deliveries = Order.query.filter_by(
-        driver_id=session.get("user_id"),
-        status="out_for_delivery"
-    ).all()
+    # Get driver's active deliveries, in the order the route visits them
+    active_deliveries, route, unrouted = driver_route(g.user.id)
     
     # Get available orders for pickup
     available_orders = Order.query.filter_by(status="ready").all()
     
     return render_template("driver_map.html", 
                          active_deliveries=active_deliveries,
-                         available_orders=available_orders)
+                         available_orders=available_orders,
+                         route=route,
+                         unrouted_stops=unrouted)
+
+def nearest_ready_orders(latitude, longitude, limit=20, radius_km=15.0):
+    """Ready, unassigned orders whose restaurant is nearest to a point
+    
+    Returns (distance_km, order, items_count) tuples, nearest first. Candidates come from a
+    bounding box over the indexed restaurant coordinates and are ordered in SQL by an
+    equirectangular approximation, which is exact enough to rank within a city. When the
+    box holds fewer than limit orders, orders from restaurants without coordinates
+    follow, oldest first, with a distance of None.
+    """
+    items_count = db.select(db.func.count(OrderItem.id)).where(
+        OrderItem.order_id == Order.id
+    ).correlate(Order).scalar_subquery()
+    ready = db.session.query(Order, items_count).join(Order.restaurant).options(
+        db.contains_eager(Order.restaurant)
+    ).filter(Order.status == "ready", Order.driver_id.is_(None))
+    
+    lat_span = radius_km / KM_PER_DEGREE
+    lng_scale = max(math.cos(math.radians(latitude)), 0.01)
+    lng_span = lat_span / lng_scale
+    squared_distance = (
+        (Restaurant.latitude - latitude) * (Restaurant.latitude - latitude)
+        + (Restaurant.longitude - longitude) * (Restaurant.longitude - longitude) * (lng_scale * lng_scale)
+    )
+    rows = ready.filter(
+        Restaurant.latitude.between(latitude - lat_span, latitude + lat_span),
+        Restaurant.longitude.between(longitude - lng_span, longitude + lng_span)
+    ).order_by(squared_distance, Order.created_at).limit(limit).all()
+    
+    results = [
+        (haversine_km(latitude, longitude, order.restaurant.latitude, order.restaurant.longitude), order, count)
+        for order, count in rows
+    ]
+    results = [result for result in results if result[0] <= radius_km]
+    if len(results) < limit:
+        unlocated = ready.filter(Restaurant.latitude.is_(None)).order_by(Order.created_at).limit(limit - len(results))
+        results.extend((None, order, count) for order, count in unlocated)
+    return results
+
+def available_orders_for_driver(driver_id, limit=20):
+    """The ready-orders feed for a driver: nearest first when their position is known"""
+    ping = driver_locations.position(driver_id)
+    if ping is not None:
+        return nearest_ready_orders(ping.latitude, ping.longitude, limit)
+    
+    items_count = db.select(db.func.count(OrderItem.id)).where(
+        OrderItem.order_id == Order.id
+    ).correlate(Order).scalar_subquery()
+    rows = db.session.query(Order, items_count).options(db.joinedload(Order.restaurant)).filter(
+        Order.status == "ready", Order.driver_id.is_(None)
+    ).order_by(Order.created_at).limit(limit).all()
+    return [(None, order, count) for order, count in rows]
+
+def nearest_idle_drivers(latitude, longitude, limit=5, radius_km=10.0):
+    """Drivers near a point who have pinged recently and are not out on a delivery
+    
+    Returns (distance_km, ping, driver) tuples, nearest first: one grid lookup plus
+    one query for the candidates' accounts and active deliveries.
+    """
+    nearby = driver_locations.nearby(latitude, longitude, radius_km, limit=None)
+    candidate_ids = [ping.driver_id for _, ping in nearby]
+    if not candidate_ids:
+        return []
+    
+    busy = db.select(Order.id).where(Order.driver_id == User.id, Order.status == "out_for_delivery").exists()
+    drivers = {
+        driver.id: driver for driver in User.query.filter(
+            User.id.in_(candidate_ids), User.user_type == "driver", ~busy
+        )
+    }
+    return [(distance, ping, drivers[ping.driver_id]) for distance, ping in nearby if ping.driver_id in drivers][:limit]
+
+DISPATCH_MAX_KM = float(os.environ.get('DISPATCH_MAX_KM', '8'))  # furthest pickup a round will assign
+DISPATCH_WAIT_WEIGHT = float(os.environ.get('DISPATCH_WAIT_WEIGHT', '0.2'))  # km of pickup distance worth a minute of waiting
+DISPATCH_MAX_ORDERS = int(os.environ.get('DISPATCH_MAX_ORDERS', '1000'))  # oldest ready orders considered per round
+
+def idle_drivers(positions):
+    """The (driver_id, latitude, longitude) positions of drivers not out on a delivery"""
+    if not positions:
+        return []
+    busy = db.select(Order.id).where(Order.driver_id == User.id, Order.status == "out_for_delivery").exists()
+    idle = set(db.session.scalars(db.select(User.id).where(
+        User.id.in_([driver_id for driver_id, _, _ in positions]), User.user_type == "driver", ~busy
+    )))
+    return [position for position in positions if position[0] in idle]
+
+def recent_driver_positions():
+    """Latest DriverLocation of each driver seen within the stale window
+    
+    For dispatch rounds run outside the web process, which cannot see its LocationStore.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=driver_locations.stale_after)
+    latest = db.select(
+        DriverLocation.driver_id, db.func.max(DriverLocation.recorded_at).label("recorded_at")
+    ).where(DriverLocation.recorded_at >= cutoff).group_by(DriverLocation.driver_id).subquery()
+    rows = db.session.execute(
+        db.select(DriverLocation.driver_id, DriverLocation.latitude, DriverLocation.longitude).join(
+            latest, db.and_(DriverLocation.driver_id == latest.c.driver_id,
+                            DriverLocation.recorded_at == latest.c.recorded_at)
+        )
+    )
+    return list({driver_id: (driver_id, latitude, longitude) for driver_id, latitude, longitude in rows}.values())
 
-@app.route("/api/driver/location", methods=["POST"])
-@login_required
-def update_driver_location():
-    if session.get("user_type") != "driver":
-        return jsonify({"success": False, "message": "Access denied"}), 403
+def run_dispatch_round(positions=None):
+    """Assign ready orders to idle drivers in one round; returns how many were assigned
     
-    data = request.get_json()
-    latitude = data.get("latitude")
-    longitude = data.get("longitude")
+    The oldest DISPATCH_MAX_ORDERS ready orders at located restaurants are matched with
+    idle drivers (positions default to the live LocationStore) by plan_assignments, and
+    every assignment is written in one transaction. Each one is a conditional UPDATE,
+    so an order taken by hand, or a driver who took a delivery, since the round read
+    the database is skipped rather than double-booked.
+    """
+    with app.app_context():
+        orders = db.session.execute(
+            db.select(Order.id, Restaurant.latitude, Restaurant.longitude, Order.created_at).join(Order.restaurant).where(
+                Order.status == "ready", Order.driver_id.is_(None),
+                Restaurant.latitude.is_not(None), Restaurant.longitude.is_not(None)
+            ).order_by(Order.created_at).limit(DISPATCH_MAX_ORDERS)
+        ).all()
+        if not orders:
+            return 0
+        if positions is None:
+            positions = [(ping.driver_id, ping.latitude, ping.longitude) for ping in driver_locations.positions()]
+        drivers = idle_drivers(positions)
+        
+        plan = plan_assignments(
+            [(order_id, latitude, longitude, created_at.replace(tzinfo=timezone.utc).timestamp())
+             for order_id, latitude, longitude, created_at in orders],
+            drivers, max_km=DISPATCH_MAX_KM, wait_weight=DISPATCH_WAIT_WEIGHT
+        )
+        if not plan:
+            return 0
+        
+        # One compiled statement, run per assignment: RETURNING is not available with executemany
+        orders_table = Order.__table__
+        other = orders_table.alias()
+        driver_busy = db.select(other.c.id).where(
+            other.c.driver_id == db.bindparam("assigned_driver_id"), other.c.status == "out_for_delivery"
+        ).exists()
+        assign = orders_table.update().where(
+            orders_table.c.id == db.bindparam("order_id"), orders_table.c.status == "ready",
+            orders_table.c.driver_id.is_(None), ~driver_busy
+        ).values(driver_id=db.bindparam("assigned_driver_id"), status="out_for_delivery").returning(
+            orders_table.c.id, orders_table.c.user_id, orders_table.c.restaurant_id, orders_table.c.driver_id,
+            orders_table.c.status, orders_table.c.payment_status, orders_table.c.total_amount, orders_table.c.created_at
+        )
+        connection = db.session.connection()
+        assigned = []
+        for order_id, driver_id, _ in plan:
+            row = connection.execute(assign, {"order_id": order_id, "assigned_driver_id": driver_id}).first()
+            if row is not None:
+                assigned.append(row)
+        record_status_change(db.session, assigned, "ready")
+        db.session.commit()
+        
+        for row in assigned:
+            send_notification(row.user_id, f"Your order #{row.id} is out for delivery!", "info")
+            send_notification(row.driver_id, f"You have been assigned order #{row.id} for pickup", "info")
+        return len(assigned)
+
+# Rounds run in the web process, next to the live driver positions and the event bus; 0 disables them
+dispatcher = Dispatcher(run_dispatch_round, interval=float(os.environ.get('DISPATCH_INTERVAL', '5')))
+
+@app.before_request
+def start_dispatcher():
+    dispatcher.ensure_started()
+
+route_planner = RoutePlanner()
+
+def driver_route(driver_id):
+    """A driver's active deliveries in route order, their RoutePlan and the stops it cannot place
+    
+    Each order contributes its restaurant until it is picked up, then its customer.
+    Stops without coordinates are returned separately as (order, kind) pairs, and their
+    orders come last. The route starts at the driver's last position, or at the oldest
+    order's first stop when the driver has not pinged recently.
+    """
+    orders = Order.query.options(db.joinedload(Order.restaurant), db.joinedload(Order.user)).filter(
+        Order.driver_id == driver_id, Order.status == "out_for_delivery"
+    ).order_by(Order.created_at, Order.id).all()
+    
+    stops, unrouted = [], []
+    for order in orders:
+        if order.picked_up_at is None:
+            if order.restaurant.latitude is not None and order.restaurant.longitude is not None:
+                stops.append(Stop(order.id, PICKUP, order.restaurant.latitude, order.restaurant.longitude))
+            else:
+                unrouted.append((order, PICKUP))
+        if order.delivery_latitude is not None and order.delivery_longitude is not None:
+            stops.append(Stop(order.id, DROPOFF, order.delivery_latitude, order.delivery_longitude))
+        else:
+            unrouted.append((order, DROPOFF))
     
-    if not latitude or not longitude:
+    ping = driver_locations.position(driver_id)
+    if ping is not None:
+        start = (ping.latitude, ping.longitude)
+    elif stops:
+        start = (stops[0].latitude, stops[0].longitude)
+    else:
+        start = None
+    route = route_planner.route(driver_id, start, stops)
+    
+    rank = {}
+    for index, stop in enumerate(route.stops):
+        rank.setdefault(stop.order_id, index)
+    orders.sort(key=lambda order: rank.get(order.id, len(route.stops)))
+    return orders, route, unrouted
+
+def restaurant_coords(restaurant):
+    if restaurant.latitude is None or restaurant.longitude is None:
+        return None
+    return {"lat": restaurant.latitude, "lng": restaurant.longitude}
+
+def delivery_coords(order):
+    if order.delivery_latitude is None or order.delivery_longitude is None:
+        return None
+    return {"lat": order.delivery_latitude, "lng": order.delivery_longitude}
+
+@app.route("/api/events/customer")
+@login_required
+def customer_events():
+    """Status changes of the user's own orders"""
+    return event_stream([f"customer:{g.user.id}"])
+
+@app.route("/api/events/restaurant")
+@role_required("restaurant", api=True)
+def restaurant_events():
+    """New orders and status changes for the user's restaurant"""
+    if g.restaurant is None:
+        return jsonify({"success": False, "message": "No restaurant found"}), 404
+    return event_stream([f"restaurant:{g.restaurant.id}"])
+
+@app.route("/api/events/driver")
+@role_required("driver", api=True)
+def driver_events():
+    """The driver's own deliveries, plus orders becoming ready or being taken by anyone"""
+    return event_stream([f"driver:{g.user.id}", "drivers"])
+
+@app.route("/api/driver/location", methods=["POST"])
+@role_required("driver", api=True)
+def update_driver_location():
+    data = request.get_json(silent=True) or {}
+    
+    # Recorded in memory; the DriverLocation table is written in batches in the background
+    try:
+        driver_locations.record(
+            g.user.id,
+            data.get("latitude"),
+            data.get("longitude"),
+            accuracy=float(data["accuracy"]) if data.get("accuracy") is not None else None
+        )
+    except (TypeError, ValueError):
         return jsonify({"success": False, "message": "Invalid coordinates"}), 400
     
-    # In a real app, you would store this in a DriverLocation table
-    # For now, we'll just return success
     return jsonify({
         "success": True,
         "message": "Location updated successfully"
     })
 
+MAX_LOCATION_BATCH = 1000  # points per request
+MAX_LOCATION_BATCH_BYTES = 256 * 1024  # decompressed body
+
+def read_json_body(max_bytes):
+    """Request JSON, gunzipped first when sent with Content-Encoding: gzip
+    
+    Neither the body as sent nor its decompressed form is read past max_bytes, so
+    a large upload or a small compressed one that expands cannot fill memory.
+    Raises ValueError for bad gzip, oversized bodies or bad JSON.
+    """
+    if request.content_length is not None and request.content_length > max_bytes:
+        raise ValueError("Body is larger than allowed")
+    body = request.stream.read(max_bytes + 1)
+    if len(body) > max_bytes:
+        raise ValueError("Body is larger than allowed")
+    if request.content_encoding == "gzip":
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try:
+            body = decompressor.decompress(body, max_bytes + 1)
+        except zlib.error as e:
+            raise ValueError(f"Invalid gzip body: {e}")
+        if not decompressor.eof:
+            raise ValueError("Body is truncated or larger than allowed")
+    if len(body) > max_bytes:
+        raise ValueError("Body is larger than allowed")
+    return json.loads(body)
+
+@app.route("/api/driver/locations", methods=["POST"])
+@role_required("driver", api=True)
+def update_driver_locations():
+    """A batch of timestamped pings in one request: {"points": [{latitude, longitude, recorded_at, accuracy}]}"""
+    try:
+        data = read_json_body(MAX_LOCATION_BATCH_BYTES)
+    except ValueError as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+    
+    points = data.get("points") if isinstance(data, dict) else None
+    if not isinstance(points, list) or not points:
+        return jsonify({"success": False, "message": "points must be a non-empty list"}), 400
+    if len(points) > MAX_LOCATION_BATCH:
+        return jsonify({"success": False, "message": f"At most {MAX_LOCATION_BATCH} points per request"}), 413
+    
+    valid, rejected = validate_points(points)
+    driver_locations.record_many(g.user.id, valid)
+    
+    return jsonify({
+        "success": True,
+        "accepted": len(valid),
+        "rejected": rejected
+    })
+
+def driver_location_dict(ping):
+    if ping is None:
+        return None
+    return {
+        "lat": ping.latitude,
+        "lng": ping.longitude,
+        "accuracy": ping.accuracy,
+        "recorded_at": datetime.utcfromtimestamp(ping.recorded_at).strftime('%Y-%m-%d %H:%M:%S')
+    }
+
 @app.route("/api/driver/deliveries")
-@login_required
+@role_required("driver", api=True)
 def get_driver_deliveries():
-    if session.get("user_type") != "driver":
-        return jsonify({"success": False, "message": "Access denied"}), 403
-    
-    # Get driver's active deliveries
-    active_deliveries = Order.query.filter_by(
-        driver_id=session.get("user_id"),
-        status="out_for_delivery"
-    ).all()
+    # Active deliveries in the order the driver's route reaches them
+    active_deliveries, route, unrouted = driver_route(g.user.id)
     
     deliveries_data = []
     for delivery in active_deliveries:
-        # In a real app, you would have actual coordinates
-        # For demo purposes, we'll use placeholder coordinates
         deliveries_data.append({
             "id": delivery.id,
             "restaurant_name": delivery.restaurant.name,
             "customer_name": f"{delivery.user.first_name} {delivery.user.last_name}",
             "delivery_address": delivery.delivery_address,
             "restaurant_address": delivery.restaurant.address,
-            "restaurant_coords": {
-                "lat": -6.8235,  # Dar es Salaam coordinates
-                "lng": 39.2695
-            },
-            "delivery_coords": {
-                "lat": -6.8235 + (delivery.id * 0.001),  # Slightly offset for demo
-                "lng": 39.2695 + (delivery.id * 0.001)
-            },
+            "restaurant_coords": restaurant_coords(delivery.restaurant),
+            "delivery_coords": delivery_coords(delivery),
+            "picked_up": delivery.picked_up_at is not None,
             "total_amount": delivery.total_amount,
             "created_at": delivery.created_at.strftime('%I:%M %p')
         })
     
+    route_data = []
+    for stop, leg_km in zip(route.stops, route.legs):
+        route_data.append({**stop.to_dict(), "leg_km": round(leg_km, 3)})
+    
     return jsonify({
         "success": True,
-        "deliveries": deliveries_data
+        "driver_coords": driver_location_dict(driver_locations.position(g.user.id)),
+        "deliveries": deliveries_data,
+        "route": route_data,
+        "route_km": round(route.total_km, 3),
+        "unrouted_stops": [{"order_id": order.id, "type": kind} for order, kind in unrouted]
     })
 
 @app.route("/api/driver/available-orders")
-@login_required
+@role_required("driver", api=True)
 def get_available_orders():
-    if session.get("user_type") != "driver":
-        return jsonify({"success": False, "message": "Access denied"}), 403
-    
-    # Get available orders for pickup
-    available_orders = Order.query.filter_by(status="ready").all()
+    # The K nearest ready orders to this driver (oldest first until the driver has a position)
+    limit = max(1, min(request.args.get("limit", 20, type=int), 100))
+    available_orders = available_orders_for_driver(g.user.id, limit)
     
     orders_data = []
-    for order in available_orders:
+    for distance, order, items_count in available_orders:
         orders_data.append({
             "id": order.id,
             "restaurant_name": order.restaurant.name,
             "restaurant_address": order.restaurant.address,
-            "restaurant_coords": {
-                "lat": -6.8235,  # Dar es Salaam coordinates
-                "lng": 39.2695
-            },
+            "restaurant_coords": restaurant_coords(order.restaurant),
+            "distance_km": round(distance, 2) if distance is not None else None,
             "total_amount": order.total_amount,
-            "items_count": len(order.items),
+            "items_count": items_count,
             "created_at": order.created_at.strftime('%I:%M %p')
         })
     
     return jsonify({
         "success": True,
+        "driver_coords": driver_location_dict(driver_locations.position(g.user.id)),
         "orders": orders_data
     })
 
+@app.route("/api/admin/drivers/nearby")
+@role_required("admin", api=True)
+def api_admin_nearby_drivers():
+    """Drivers that pinged recently within radius_km of lat/lng, nearest first"""
+    try:
+        latitude, longitude = validate_coordinates(request.args["lat"], request.args["lng"])
+    except (KeyError, ValueError):
+        return jsonify({"success": False, "message": "lat and lng must be valid coordinates"}), 400
+    radius_km = request.args.get("radius_km", 5.0, type=float)
+    if not radius_km > 0:  # also rejects nan, which the grid cannot place
+        return jsonify({"success": False, "message": "radius_km must be positive"}), 400
+    radius_km = min(radius_km, 50.0)
+    limit = max(1, min(request.args.get("limit", 20, type=int), 100))
+    
+    nearby = driver_locations.nearby(latitude, longitude, radius_km, limit)
+    drivers = {driver.id: driver for driver in User.query.filter(User.id.in_([ping.driver_id for _, ping in nearby]))}
+    
+    return jsonify({"success": True, "drivers": [{
+        "id": ping.driver_id,
+        "name": f"{drivers[ping.driver_id].first_name} {drivers[ping.driver_id].last_name}" if ping.driver_id in drivers else None,
+        "distance_km": round(distance, 3),
+        "coords": driver_location_dict(ping)
+    } for distance, ping in nearby]})
+
+@app.route("/api/admin/orders/<int:order_id>/nearest-drivers")
+@role_required("admin", api=True)
+def api_admin_order_nearest_drivers(order_id):
+    """Idle drivers nearest to the order's restaurant, for manual dispatch"""
+    order = Order.query.get_or_404(order_id)
+    if order.restaurant.latitude is None or order.restaurant.longitude is None:
+        return jsonify({"success": False, "message": "Restaurant has no coordinates"}), 400
+    limit = max(1, min(request.args.get("limit", 5, type=int), 50))
+    radius_km = request.args.get("radius_km", 10.0, type=float)
+    if not radius_km > 0:  # also rejects nan, which the grid cannot place
+        return jsonify({"success": False, "message": "radius_km must be positive"}), 400
+    radius_km = min(radius_km, 50.0)
+    
+    candidates = nearest_idle_drivers(order.restaurant.latitude, order.restaurant.longitude, limit, radius_km)
+    return jsonify({"success": True, "order_id": order.id, "drivers": [{
+        "id": driver.id,
+        "name": f"{driver.first_name} {driver.last_name}",
+        "phone": driver.phone,
+        "distance_km": round(distance, 3),
+        "coords": driver_location_dict(ping)
+    } for distance, ping, driver in candidates]})
+
+@app.route("/api/admin/drivers/<int:driver_id>/track")
+@role_required("admin", api=True)
+def api_admin_driver_track(driver_id):
+    """A driver's recent pings, oldest first (older history is in DriverLocation)"""
+    limit = max(1, min(request.args.get("limit", 50, type=int), 500))
+    return jsonify({
+        "success": True,
+        "track": [driver_location_dict(ping) for ping in driver_locations.track(driver_id, limit)]
+    })
+
+@app.cli.command("rebuild-daily-stats")
+def rebuild_daily_stats_command():
+    """Recompute the DailyStats rollup from the Order, User and Restaurant tables"""
+    started = time.monotonic()
+    rows = rebuild_daily_stats()
+    print(f"📊 Rebuilt DailyStats: {rows} rows in {time.monotonic() - started:.2f}s")
+
+@app.cli.command("rebuild-search-index")
+def rebuild_search_index_command():
+    """Create the FTS5 admin search index if needed and re-index every user, restaurant and order"""
+    if search_index.install(db.engine) is None:
+        print("⚠️ FTS5 is not available on this database - admin search uses ilike scans")
+        return
+    started = time.monotonic()
+    search_index.rebuild(db.engine)
+    print(f"🔎 Rebuilt search index in {time.monotonic() - started:.2f}s")
+
+@app.cli.command("check-restaurant-counters")
+@click.option("--fix", is_flag=True, help="Overwrite wrong counters with the recomputed values.")
+def check_restaurant_counters_command(fix):
+    """Recompute RestaurantCounters from scratch and report (or fix) any drift"""
+    mismatches = check_restaurant_counters(fix=fix)
+    for restaurant_id, have, want in mismatches:
+        print(f"⚠️ Restaurant {restaurant_id}: stored {have}, expected {want}")
+    if not mismatches:
+        print("✅ Restaurant counters are consistent")
+    elif fix:
+        print(f"🔧 Fixed counters for {len(mismatches)} restaurants")
+
+@app.cli.command("drain-outbox")
+@click.option("--batch-size", default=50, help="Rows leased per round.")
+@click.option("--idle-sleep", default=1.0, help="Seconds to wait when the outbox is empty.")
+@click.option("--once", is_flag=True, help="Drain until empty, then exit.")
+def drain_outbox_command(batch_size, idle_sleep, once):
+    """Deliver queued Outbox emails (run as a separate worker process)"""
+    if not EMAIL_ENABLED:
+        print("⚠️ Email notifications disabled - nothing to drain")
+        return
+    
+    print(f"📬 Draining notification outbox (batch size {batch_size})")
+    window_started = time.monotonic()
+    window_rows = 0
+    
+    while True:
+        processed = drain_outbox(batch_size=batch_size)
+        window_rows += processed
+        
+        elapsed = time.monotonic() - window_started
+        if window_rows and (elapsed >= 10 or not processed):
+            print(f"📊 Outbox drain: {window_rows} emails in {elapsed:.1f}s ({window_rows / elapsed:.1f}/s)")
+            window_started = time.monotonic()
+            window_rows = 0
+        
+        if not processed:
+            if once:
+                return
+            time.sleep(idle_sleep)
+            window_started = time.monotonic()
+
+@app.cli.command("purge-idempotency-keys")
+@click.option("--batch-size", default=10000, help="Rows deleted per transaction.")
+def purge_idempotency_keys_command(batch_size):
+    """Delete idempotency keys older than IDEMPOTENCY_KEY_TTL_HOURS (run from cron)"""
+    started = time.monotonic()
+    removed = purge_idempotency_keys(batch_size=batch_size)
+    print(f"🧹 Purged {removed} idempotency keys in {time.monotonic() - started:.2f}s")
+
+@app.cli.command("dispatch-orders")
+@click.option("--loop", is_flag=True, help="Keep running a round every DISPATCH_INTERVAL seconds.")
+def dispatch_orders_command(loop):
+    """Assign ready orders to idle drivers using their last persisted positions
+    
+    Events of these assignments are published in this process, not the web one, so
+    prefer DISPATCH_INTERVAL on the web process when drivers rely on live updates.
+    """
+    interval = dispatcher.interval or 5.0
+    while True:
+        started = time.monotonic()
+        assigned = run_dispatch_round(recent_driver_positions())
+        print(f"🛵 Dispatch round: {assigned} orders assigned in {(time.monotonic() - started) * 1000:.0f}ms")
+        if not loop:
+            return
+        time.sleep(interval)
+
 if __name__ == "__main__":
     with app.app_context():
         db.create_all()
+        add_missing_columns()
+        remove_duplicate_carts()
+        create_missing_indexes()
+        
+        # Backfill the reports rollup the first time it is deployed on an existing database
+        if not DailyStats.query.first() and (Order.query.first() or User.query.first()):
+            print(f"📊 Backfilled DailyStats: {rebuild_daily_stats()} rows")
+        if not RestaurantCounters.query.first() and Restaurant.query.first():
+            print(f"📊 Backfilled RestaurantCounters: {len(check_restaurant_counters(fix=True))} restaurants")
+        
+        # Admin search index; tables created just now start empty and need indexing
+        new_search_tables = search_index.install(db.engine)
+        if new_search_tables:
+            search_index.rebuild(db.engine, new_search_tables)
+            print(f"🔎 Built search index: {', '.join(new_search_tables)}")
         
         # Create admin user
         admin = User.query.filter_by(username="admin").first()
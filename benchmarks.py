@@ -0,0 +1,1312 @@
+#!/usr/bin/env python3
+"""
+MsosiHub Performance Benchmarks
+Run individual benchmarks with: python benchmarks.py <name>
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import tempfile
+import contextlib
+import socketserver
+import threading
+
+# Benchmarks must never reach a real mail server
+os.environ.setdefault('SMTP_USE_TLS', '0')
+os.environ.setdefault('EMAIL_PASSWORD', 'benchmark')
+
+from notifications import EmailNotificationService
+
+class StandInSMTPHandler(socketserver.StreamRequestHandler):
+    """Minimal SMTP server that accepts everything and simulates handshake cost"""
+    
+    def reply(self, line):
+        self.wfile.write((line + "\r\n").encode())
+    
+    def handle(self):
+        # Connection setup + TLS negotiation latency of a real provider
+        time.sleep(self.server.handshake_delay)
+        self.reply("220 standin.msosihub.local ESMTP")
+        
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode(errors='replace').strip()
+            verb = command.split(' ', 1)[0].upper()
+            
+            if verb in ('EHLO', 'HELO'):
+                self.reply("250-standin.msosihub.local")
+                self.reply("250-AUTH PLAIN LOGIN")
+                self.reply("250 8BITMIME")
+            elif verb == 'AUTH':
+                time.sleep(self.server.auth_delay)
+                self.reply("235 2.7.0 Authentication successful")
+            elif verb in ('MAIL', 'RCPT', 'RSET', 'NOOP'):
+                self.reply("250 OK")
+            elif verb == 'DATA':
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                while True:
+                    data_line = self.rfile.readline()
+                    if not data_line or data_line == b".\r\n":
+                        break
+                self.server.messages += 1
+                self.reply("250 OK queued")
+            elif verb == 'QUIT':
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+class StandInSMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    
+    def __init__(self, handshake_delay=0.05, auth_delay=0.05):
+        super().__init__(('127.0.0.1', 0), StandInSMTPHandler)
+        self.handshake_delay = handshake_delay
+        self.auth_delay = auth_delay
+        self.messages = 0
+    
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+def benchmark_smtp(count=100):
+    """Messages/sec for connect-per-message vs pooled sessions vs send_many()"""
+    import smtplib
+    
+    print("📧 SMTP delivery benchmark (stand-in server, 50ms handshake + 50ms auth)")
+    print("=" * 50)
+    
+    server = StandInSMTPServer().start()
+    host, port = server.server_address
+    
+    service = EmailNotificationService()
+    service.smtp_server = host
+    service.smtp_port = port
+    service.pool.server = host
+    service.pool.port = port
+    
+    html = service.get_email_template('welcome', name='Benchmark User', title='Welcome')
+    messages = [
+        {'to': f'customer{i}@example.com', 'subject': 'Welcome to MsosiHub', 'html': html}
+        for i in range(count)
+    ]
+    
+    # Before: a fresh connection, login and quit for every single email
+    started = time.perf_counter()
+    for message in messages:
+        msg = service.build_message(message['to'], message['subject'], message['html'])
+        conn = smtplib.SMTP(host, port)
+        conn.login(service.email_user, service.email_password)
+        conn.send_message(msg)
+        conn.quit()
+    before = time.perf_counter() - started
+    
+    # After: send_email() one at a time, reusing pooled sessions
+    started = time.perf_counter()
+    for message in messages:
+        service.send_email(message['to'], message['subject'], message['html'])
+    pooled = time.perf_counter() - started
+    
+    # After: a whole batch over one session
+    started = time.perf_counter()
+    results = service.send_many(messages)
+    batched = time.perf_counter() - started
+    
+    service.pool.close_all()
+    server.shutdown()
+    
+    assert all(result['success'] for result in results)
+    
+    print(f"\n{'Mode':<28}{'Seconds':>10}{'Msgs/sec':>12}")
+    for label, elapsed in (("connect per message", before), ("pooled send_email()", pooled), ("send_many()", batched)):
+        print(f"{label:<28}{elapsed:>10.3f}{count / elapsed:>12.1f}")
+    print(f"\nSMTP sessions opened by pool: {service.pool.stats()['connections_opened']}")
+
+def benchmark_templates(rounds=2000):
+    """Render time of the order confirmation email for small, typical and huge orders"""
+    print("🧾 Email template rendering benchmark (order_confirmation)")
+    print("=" * 50)
+    
+    service = EmailNotificationService()
+    restaurant = {'name': 'Healthy Bites Tanzania'}
+    
+    print(f"\n{'Items':>6}{'µs/render':>14}{'Renders/sec':>14}{'HTML bytes':>12}")
+    for item_count in (1, 20, 200):
+        items = [
+            {'name': f'Quinoa Power Bowl #{i}', 'quantity': 2, 'price': 15000, 'total': 30000}
+            for i in range(item_count)
+        ]
+        order = {
+            'id': 12345,
+            'subtotal': 30000 * item_count,
+            'total': 30000 * item_count + 2000,
+            'delivery_address': 'Masaki, Dar es Salaam',
+            'phone': '+255 754 123 456'
+        }
+        
+        iterations = max(rounds // item_count, 50)
+        started = time.perf_counter()
+        for _ in range(iterations):
+            html = service.get_email_template(
+                'order_confirmation',
+                customer_name='Test Customer',
+                order=order,
+                items=items,
+                restaurant=restaurant,
+                title='Order Confirmation'
+            )
+        elapsed = time.perf_counter() - started
+        
+        per_render = elapsed / iterations
+        print(f"{item_count:>6}{per_render * 1e6:>14.1f}{1 / per_render:>14.0f}{len(html):>12}")
+
+def load_app(db_path):
+    """Import the Flask app against a throwaway SQLite database"""
+    os.environ['DATABASE_URL'] = f"sqlite:///{db_path}"
+    with contextlib.redirect_stdout(io.StringIO()):
+        import app as msosihub
+    with msosihub.app.app_context():
+        msosihub.db.create_all()
+    return msosihub
+
+def benchmark_outbox(count=2000, batch_size=50):
+    """Rows/sec the Outbox table drain sustains against a zero-latency SMTP server"""
+    print("📬 Outbox table drain benchmark")
+    print("=" * 50)
+    
+    workdir = tempfile.mkdtemp(prefix="msosihub-bench-")
+    msosihub = load_app(os.path.join(workdir, "outbox.db"))
+    db, Outbox = msosihub.db, msosihub.Outbox
+    
+    server = StandInSMTPServer(handshake_delay=0, auth_delay=0).start()
+    pool = msosihub.email_service.pool
+    pool.server, pool.port = server.server_address
+    pool.use_tls = False
+    
+    with msosihub.app.app_context():
+        # Half customer confirmations, half new-order emails spread over 20 restaurants
+        rows = []
+        for i in range(count):
+            if i % 2:
+                email_data = {'type': 'welcome', 'email': f'customer{i}@example.com', 'name': 'Benchmark'}
+            else:
+                email_data = {
+                    'type': 'new_order_restaurant',
+                    'email': f'restaurant{i % 20}@example.com',
+                    'customer_name': 'Benchmark Customer',
+                    'event_time': '12:00 PM',
+                    'order': {'id': i, 'total': 17000, 'phone': '+255 754 000 000'},
+                    'items': [{'name': 'Quinoa Power Bowl', 'quantity': 1, 'price': 15000, 'total': 15000}]
+                }
+            rows.append({'email_type': email_data['type'], 'payload': json.dumps(email_data), 'status': 'pending'})
+        db.session.execute(db.insert(Outbox), rows)
+        db.session.commit()
+        
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            while msosihub.drain_outbox(batch_size=batch_size):
+                pass
+        elapsed = time.perf_counter() - started
+        
+        sent = Outbox.query.filter_by(status="sent").count()
+    
+    server.shutdown()
+    
+    print(f"Rows drained:     {sent} / {count}")
+    print(f"SMTP messages:    {server.messages} (new-order emails folded into per-batch digests)")
+    print(f"Elapsed:          {elapsed:.2f}s")
+    print(f"Throughput:       {sent / elapsed:.0f} rows/sec (batch size {batch_size})")
+
+def load_orders(db, count, seed=42):
+    """Bulk-insert count random orders spread over 2025 straight through the DB-API connection"""
+    import random
+    from datetime import datetime, timedelta
+    
+    statuses = ['pending', 'confirmed', 'preparing', 'ready', 'out_for_delivery', 'delivered', 'cancelled']
+    start = datetime(2025, 1, 1)
+    rng = random.Random(seed)
+    conn = db.engine.raw_connection()
+    rows = (
+        (
+            rng.randint(1, 50_000),  # user_id
+            rng.randint(1, 500),  # restaurant_id
+            rng.randint(5_000, 80_000),  # total_amount
+            status,
+            'paid' if status != 'cancelled' else 'failed',
+            'wallet',
+            'Dar es Salaam',
+            '+255 754 000 000',
+            rng.randint(1, 2_000) if status in ('out_for_delivery', 'delivered') else None,
+            (start + timedelta(seconds=rng.randint(0, 365 * 86400))).strftime('%Y-%m-%d %H:%M:%S.000000')
+        )
+        for status in (rng.choices(statuses, weights=[1, 1, 1, 1, 1, 90, 5])[0] for _ in range(count))
+    )
+    conn.executemany(
+        'INSERT INTO "order" (user_id, restaurant_id, total_amount, status, payment_status, payment_method, '
+        'delivery_address, phone, driver_id, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+        rows
+    )
+    conn.commit()
+    conn.close()
+
+def benchmark_order_indexes(count=1_000_000):
+    """Query plans and latency of the Order hot queries with and without the composite indexes"""
+    from datetime import datetime, timedelta
+    
+    print(f"🗂️  Order index benchmark ({count:,} orders)")
+    print("=" * 50)
+    
+    workdir = tempfile.mkdtemp(prefix="msosihub-bench-")
+    msosihub = load_app(os.path.join(workdir, "orders.db"))
+    db, Order = msosihub.db, msosihub.Order
+    
+    day = datetime(2025, 6, 15)
+    
+    with msosihub.app.app_context():
+        indexes = list(Order.__table__.indexes)
+        for index in indexes:
+            index.drop(db.engine)
+        
+        print("Loading orders...")
+        load_orders(db, count)
+        
+        queries = [
+            ("restaurant dashboard", Order.query.filter_by(restaurant_id=42).order_by(Order.created_at.desc()).limit(10)),
+            ("restaurant paid revenue", db.session.query(db.func.sum(Order.total_amount)).filter_by(restaurant_id=42, payment_status="paid")),
+            ("my_orders", Order.query.filter_by(user_id=1234).order_by(Order.created_at.desc())),
+            ("ready, unassigned", Order.query.filter_by(status="ready", driver_id=None)),
+            ("driver deliveries done", Order.query.filter_by(driver_id=77, status="delivered")),
+            ("paid revenue, 30 days", db.session.query(db.func.sum(Order.total_amount)).filter(
+                Order.payment_status == "paid", Order.created_at >= day, Order.created_at < day + timedelta(days=30))),
+            ("admin_orders date (old)", Order.query.filter(db.func.date(Order.created_at) == day.date())
+                .order_by(Order.created_at.desc()).limit(20)),
+            ("admin_orders date (new)", Order.query.filter(Order.created_at >= day, Order.created_at < day + timedelta(days=1))
+                .order_by(Order.created_at.desc()).limit(20)),
+        ]
+        
+        def run_all(label):
+            print(f"\n--- {label} ---")
+            timings = {}
+            for name, query in queries:
+                sql = str(query.statement.compile(db.engine, compile_kwargs={"literal_binds": True}))
+                plan = db.session.execute(db.text("EXPLAIN QUERY PLAN " + sql)).all()
+                started = time.perf_counter()
+                db.session.execute(db.text(sql)).all()
+                timings[name] = time.perf_counter() - started
+                print(f"{name:<26}{timings[name] * 1000:>10.2f} ms   " + " | ".join(row[-1] for row in plan))
+            return timings
+        
+        before = run_all("without indexes")
+        
+        for index in indexes:
+            index.create(db.engine)
+        db.session.execute(db.text("ANALYZE"))
+        
+        after = run_all("with indexes")
+    
+    print(f"\n{'Query':<26}{'Before ms':>12}{'After ms':>12}{'Speedup':>10}")
+    for name, _ in queries:
+        print(f"{name:<26}{before[name] * 1000:>12.2f}{after[name] * 1000:>12.2f}{before[name] / max(after[name], 1e-9):>9.0f}x")
+
+def benchmark_pagination(count=200_000, per_page=20):
+    """Latency of page N of the admin orders listing: OFFSET + COUNT(*) vs (created_at, id) keyset"""
+    print(f"📄 Admin orders pagination benchmark ({count:,} orders)")
+    print("=" * 50)
+    
+    workdir = tempfile.mkdtemp(prefix="msosihub-bench-")
+    msosihub = load_app(os.path.join(workdir, "pages.db"))
+    db, Order = msosihub.db, msosihub.Order
+    
+    with msosihub.app.app_context():
+        load_orders(db, count)
+        db.session.execute(db.text("ANALYZE"))
+        
+        last_page = count // per_page
+        pages = sorted({1, 10, 100, 1_000, last_page // 2, last_page})
+        newest_first = (Order.created_at.desc(), Order.id.desc())
+        
+        print(f"{'Page':>8}{'OFFSET ms':>12}{'Keyset ms':>12}")
+        for page in pages:
+            started = time.perf_counter()
+            Order.query.order_by(*newest_first).paginate(page=page, per_page=per_page, error_out=False).items
+            offset_elapsed = time.perf_counter() - started
+            
+            # The cursor a client would hold after walking to page - 1
+            after = None
+            if page > 1:
+                anchor = Order.query.order_by(*newest_first).offset((page - 1) * per_page - 1).first()
+                after = msosihub.encode_cursor(anchor)
+            
+            started = time.perf_counter()
+            msosihub.keyset_paginate(Order.query, Order, per_page=per_page, after=after)
+            keyset_elapsed = time.perf_counter() - started
+            
+            print(f"{page:>8}{offset_elapsed * 1000:>12.2f}{keyset_elapsed * 1000:>12.2f}")
+        
+        started = time.perf_counter()
+        total, estimated = msosihub.count_rows(Order.query, "approx")
+        print(f"\nApprox count: {total:,}{'+' if estimated else ''} in {(time.perf_counter() - started) * 1000:.2f} ms")
+        started = time.perf_counter()
+        total, _ = msosihub.count_rows(Order.query, "exact")
+        print(f"Exact count:  {total:,} in {(time.perf_counter() - started) * 1000:.2f} ms")
+
+def benchmark_search(count=500_000):
+    """Admin user search latency: FTS5 index vs the four-way ilike scan"""
+    import random
+    import search_index
+    
+    print(f"🔎 Admin search benchmark ({count:,} users)")
+    print("=" * 50)
+    
+    workdir = tempfile.mkdtemp(prefix="msosihub-bench-")
+    msosihub = load_app(os.path.join(workdir, "search.db"))
+    db, User = msosihub.db, msosihub.User
+    
+    first_names = ['Amina', 'Baraka', 'Neema', 'Juma', 'Rehema', 'Hassan', 'Zawadi', 'Emmanuel', 'Fatuma', 'Daudi']
+    last_names = ['Mushi', 'Kimaro', 'Mwakyusa', 'Said', 'Lyimo', 'Massawe', 'Ngowi', 'Temba', 'Mrema', 'Swai']
+    
+    with msosihub.app.app_context():
+        rng = random.Random(7)
+        conn = db.engine.raw_connection()
+        conn.executemany(
+            'INSERT INTO user (username, email, password_hash, first_name, last_name, phone, user_type, wallet_balance, created_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (
+                (f"user{i}", f"user{i}@example.co.tz", "x", rng.choice(first_names), rng.choice(last_names),
+                 f"+255 7{rng.randint(10, 79)} {rng.randint(100, 999)} {rng.randint(100, 999)}", 'customer', 0.0,
+                 f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} 12:00:00.000000")
+                for i in range(count)
+            )
+        )
+        conn.commit()
+        conn.close()
+        
+        started = time.perf_counter()
+        search_index.install(db.engine)
+        search_index.rebuild(db.engine)
+        print(f"Index build: {time.perf_counter() - started:.2f}s")
+        db.session.execute(db.text("ANALYZE"))
+        
+        def first_page(term, use_index):
+            if use_index:
+                condition = msosihub.search_filter(User, 'user_fts', term, msosihub.USER_SEARCH_COLUMNS)
+            else:
+                condition = db.or_(*[column.ilike(f'%{term}%') for column in msosihub.USER_SEARCH_COLUMNS])
+            return msosihub.keyset_paginate(User.query.filter(condition), User, per_page=20)
+        
+        def timed(fn, repeat=5):
+            best = float('inf')
+            for _ in range(repeat):
+                started = time.perf_counter()
+                result = fn()
+                best = min(best, time.perf_counter() - started)
+            return best, result
+        
+        print(f"\n{'Term':<16}{'Matches':>10}{'ilike ms':>10}{'FTS ms':>10}{'Ranked ms':>11}")
+        for term in ['user4242', 'user4242@', 'zaw', 'zawadi kim', '+255 745 1', 'nobody']:
+            ilike_time, _ = timed(lambda: first_page(term, False), repeat=1)
+            fts_time, page = timed(lambda: first_page(term, True))
+            ranked_time, _ = timed(lambda: search_index.ranked_ids(db.session.connection(), 'user_fts', term, 10))
+            matches, _ = msosihub.count_rows(User.query.filter(
+                msosihub.search_filter(User, 'user_fts', term, msosihub.USER_SEARCH_COLUMNS)), "approx")
+            print(f"{term:<16}{matches:>10}{ilike_time * 1000:>10.1f}{fts_time * 1000:>10.2f}{ranked_time * 1000:>11.2f}")
+
+def benchmark_dish_search(count=100_000):
+    """Customer dish search latency over the FTS5 menu index as the catalog grows"""
+    import random
+    import search_index
+    
+    print(f"🍲 Dish search benchmark ({count:,} dishes)")
+    print("=" * 50)
+    
+    workdir = tempfile.mkdtemp(prefix="msosihub-bench-")
+    msosihub = load_app(os.path.join(workdir, "dishes.db"))
+    db = msosihub.db
+    
+    words = ['quinoa', 'tilapia', 'chicken', 'ugali', 'pilau', 'chapati', 'mchicha', 'avocado', 'mango', 'coconut',
+             'grilled', 'spicy', 'salad', 'bowl', 'wrap', 'soup', 'juice', 'beans', 'rice', 'kachumbari']
+    # A long tail of house specialities, each on a handful of menus
+    specialities = [f"special{i}" for i in range(2_000)]
+    categories = ['Bowls', 'Salads', 'Seafood', 'Grill', 'Beverages', 'Snacks', 'Soups', 'Wraps']
+    restaurants = 2_000
+    
+    with msosihub.app.app_context():
+        search_index.install(db.engine)
+        rng = random.Random(11)
+        conn = db.engine.raw_connection()
+        conn.executemany(
+            'INSERT INTO restaurant (user_id, name, address, phone, is_active) VALUES (1, ?, ?, ?, ?)',
+            ((f"Restaurant {i}", "Dar es Salaam", "+255 754 000 000", i % 10 != 0) for i in range(restaurants))
+        )
+        conn.executemany(
+            'INSERT INTO dish (restaurant_id, title, description, price, category, is_available, inventory) '
+            'VALUES (?, ?, ?, ?, ?, ?, 100)',
+            (
+                (rng.randint(1, restaurants), f"{rng.choice(specialities)} {' '.join(rng.sample(words, 2))}".title(),
+                 " ".join(rng.sample(words, 8)),
+                 rng.randrange(2_000, 40_000, 500), rng.choice(categories), rng.random() > 0.1)
+                for _ in range(count)
+            )
+        )
+        conn.commit()
+        conn.close()
+        db.session.execute(db.text("ANALYZE"))
+        
+        cases = [
+            ("quinoa", {}),
+            ("quinoa", {"category": "Bowls", "max_price": 10_000}),
+            ("grilled tilapia", {}),
+            ("kachu", {}),
+            ("special42", {}),
+            ("special4", {}),
+            ("", {"category": "Seafood", "min_price": 5_000, "max_price": 8_000}),
+        ]
+        
+        print(f"{'Search':<34}{'ilike ms':>10}{'FTS ms':>10}")
+        for term, filters in cases:
+            timings = []
+            for use_index in (False, True):
+                search_index.is_installed = lambda engine: use_index
+                best = float('inf')
+                for _ in range(5):
+                    started = time.perf_counter()
+                    msosihub.search_dishes(term, **filters)
+                    best = min(best, time.perf_counter() - started)
+                timings.append(best)
+            label = term + (" " + ",".join(f"{k}={v}" for k, v in filters.items()) if filters else "")
+            print(f"{label:<34}{timings[0] * 1000:>10.2f}{timings[1] * 1000:>10.2f}")
+
+def benchmark_checkout(customers=100, attempts=3, workers=32):
+    """Parallel checkouts racing for the same wallets and a scarce dish: nothing lost, nothing oversold"""
+    from concurrent.futures import ThreadPoolExecutor
+    from werkzeug.security import generate_password_hash
+    
+    price, delivery_fee = 10_000, 2_000
+    stock = customers * attempts // 2
+    starting_balance = 2 * (price + delivery_fee)  # each customer can afford two of their attempts
+    
+    print(f"🛒 Checkout stress test ({customers} customers x {attempts} checkouts, {workers} threads)")
+    print("=" * 50)
+    
+    workdir = tempfile.mkdtemp(prefix="msosihub-bench-")
+    msosihub = load_app(os.path.join(workdir, "checkout.db"))
+    app, db = msosihub.app, msosihub.db
+    User, Restaurant, Dish, Order, OrderItem = msosihub.User, msosihub.Restaurant, msosihub.Dish, msosihub.Order, msosihub.OrderItem
+    
+    with app.app_context():
+        owner = User(username="owner", email="owner@example.com", password_hash=generate_password_hash("x"),
+                     first_name="Owner", last_name="Bench", phone="+255 754 000 000", user_type="restaurant")
+        db.session.add(owner)
+        db.session.flush()
+        restaurant = Restaurant(user_id=owner.id, name="Benchmark Bites", address="Masaki", phone="+255 754 000 000")
+        db.session.add(restaurant)
+        db.session.flush()
+        dish = Dish(restaurant_id=restaurant.id, title="Quinoa Power Bowl", price=price, inventory=stock)
+        db.session.add(dish)
+        customer_ids = []
+        for i in range(customers):
+            customer = User(username=f"customer{i}", email=f"customer{i}@example.com", password_hash="x",
+                            first_name="Customer", last_name=str(i), phone="+255 754 000 000",
+                            address="Dar es Salaam", wallet_balance=starting_balance)
+            db.session.add(customer)
+            db.session.flush()
+            customer_ids.append(customer.id)
+        db.session.commit()
+        dish_id = dish.id
+    
+    def shop(customer_id):
+        # Every attempt is its own session, so one customer's checkouts race each other too
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session["user_id"] = customer_id
+            session["user_type"] = "customer"
+        try:
+            added = client.post("/add_to_cart", json={"dish_id": dish_id, "quantity": 1})
+            response = client.post("/checkout", data={"delivery_address": "Dar es Salaam"})
+        except Exception as e:
+            return f"error: {type(e).__name__}"
+        if added.status_code >= 500 or response.status_code >= 500:
+            return "error: HTTP 5xx"
+        location = response.headers.get("Location", "")
+        if "/order_success/" in location:
+            return "ordered"
+        if location.endswith("/wallet"):
+            return "no funds"
+        if location.endswith("/cart"):
+            return "sold out"
+        if location.endswith("/restaurants"):
+            return "cart taken"  # a parallel session of the same customer checked it out
+        return "other: " + location
+    
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()), ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(shop, [customer_id for _ in range(attempts) for customer_id in customer_ids]))
+    elapsed = time.perf_counter() - started
+    
+    counts = {}
+    for outcome in results:
+        counts[outcome] = counts.get(outcome, 0) + 1
+    
+    with app.app_context():
+        balances = [balance for (balance,) in db.session.query(User.wallet_balance).filter(User.id.in_(customer_ids))]
+        order_count = Order.query.count()
+        charged = db.session.query(db.func.coalesce(db.func.sum(Order.total_amount), 0)).scalar()
+        sold = db.session.query(db.func.coalesce(db.func.sum(OrderItem.quantity), 0)).scalar()
+        inventory = db.session.get(Dish, dish_id).inventory
+    
+    print(f"Checkouts:        {len(results)} in {elapsed:.2f}s ({len(results) / elapsed:.0f}/s)")
+    for outcome, count in sorted(counts.items()):
+        print(f"  {outcome:<16}{count}")
+    
+    errors = sum(count for outcome, count in counts.items() if outcome.startswith("error"))
+    checks = [
+        ("no failed requests", errors == 0),
+        ("orders match successful checkouts", order_count == counts.get("ordered", 0)),
+        ("no negative wallet", min(balances) >= 0),
+        ("money conserved", abs(sum(balances) + charged - customers * starting_balance) < 0.01),
+        ("inventory conserved", inventory + sold == stock),
+        ("not oversold", inventory >= 0),
+    ]
+    print(f"Stock:            {stock} -> {inventory} (sold {sold})")
+    for name, ok in checks:
+        print(f"{'✅' if ok else '❌'} {name}")
+
+def benchmark_idempotency(count=1_000_000, requests=500):
+    """Latency of fresh and replayed keyed wallet recharges, with few and with count stored keys"""
+    from datetime import datetime
+    
+    print(f"🔁 Idempotency key benchmark ({requests} requests, up to {count:,} stored keys)")
+    print("=" * 50)
+    
+    workdir = tempfile.mkdtemp(prefix="msosihub-bench-")
+    msosihub = load_app(os.path.join(workdir, "idempotency.db"))
+    app, db, User = msosihub.app, msosihub.db, msosihub.User
+    
+    with app.app_context():
+        customer = User(username="customer", email="customer@example.com", password_hash="x",
+                        first_name="Customer", last_name="Bench", phone="+255 754 000 000")
+        db.session.add(customer)
+        db.session.commit()
+        customer_id = customer.id
+    
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["user_id"] = customer_id
+        session["user_type"] = "customer"
+    
+    def timed_round(label):
+        keys = [f"{label}-{i}" for i in range(requests)]
+        timings = {}
+        with contextlib.redirect_stdout(io.StringIO()):
+            for mode in ("fresh", "replay"):
+                elapsed = 0.0
+                for key in keys:
+                    started = time.perf_counter()
+                    client.post("/recharge_wallet", data={"amount": "1000"}, headers={"Idempotency-Key": key})
+                    elapsed += time.perf_counter() - started
+                    # Nothing renders the wallet page here, so drop the flash before it piles up in the cookie
+                    with client.session_transaction() as session:
+                        session.pop("_flashes", None)
+                timings[mode] = elapsed / requests * 1000
+        return timings
+    
+    rows = [("few keys", timed_round("small"))]
+    
+    # Other customers' keys, straight through the DB-API connection
+    with app.app_context():
+        conn = db.engine.raw_connection()
+    created_at = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S.000000')
+    conn.executemany(
+        'INSERT INTO idempotency_key (user_id, "key", endpoint, request_hash, status_code, response_headers, '
+        'response_body, flashes, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+        ((i % 50_000 + 2, f"key-{i}", "recharge_wallet", "0" * 64, 302, '{"Location": "/wallet"}', "", "[]", created_at)
+         for i in range(count))
+    )
+    conn.commit()
+    conn.close()
+    rows.append((f"{count:,} keys", timed_round("large")))
+    
+    with app.app_context():
+        balance = db.session.get(User, customer_id).wallet_balance
+    
+    print(f"\n{'Stored keys':<18}{'Fresh ms/req':>14}{'Replay ms/req':>15}")
+    for label, timings in rows:
+        print(f"{label:<18}{timings['fresh']:>14.2f}{timings['replay']:>15.2f}")
+    print(f"\n{'✅' if balance == 2 * requests * 1000 else '❌'} each key credited the wallet once (balance {balance:,.0f})")
+
+def benchmark_driver_locations(pings=200_000, drivers=5_000, threads=8):
+    """Ping ingest rate, radius queries with the grid index vs a full scan, and batched persistence"""
+    import random
+    from concurrent.futures import ThreadPoolExecutor
+    from driver_locations import haversine_km
+    
+    print(f"📍 Driver location benchmark ({pings:,} pings from {drivers:,} drivers, {threads} threads)")
+    print("=" * 50)
+    
+    workdir = tempfile.mkdtemp(prefix="msosihub-bench-")
+    msosihub = load_app(os.path.join(workdir, "locations.db"))
+    app, db, DriverLocation = msosihub.app, msosihub.db, msosihub.DriverLocation
+    store = msosihub.driver_locations
+    
+    # Drivers spread over greater Dar es Salaam (roughly 40 x 40 km)
+    rng = random.Random(42)
+    home = {driver_id: (-6.80 + rng.uniform(-0.18, 0.18), 39.25 + rng.uniform(-0.18, 0.18))
+            for driver_id in range(1, drivers + 1)}
+    
+    def send(chunk):
+        local_rng = random.Random(chunk)
+        for _ in range(pings // threads):
+            driver_id = local_rng.randint(1, drivers)
+            lat, lng = home[driver_id]
+            store.record(driver_id, lat + local_rng.uniform(-0.002, 0.002), lng + local_rng.uniform(-0.002, 0.002))
+    
+    with contextlib.redirect_stdout(io.StringIO()):
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            list(pool.map(send, range(threads)))
+        ingest = time.perf_counter() - started
+        
+        started = time.perf_counter()
+        store.flush()
+        drain = time.perf_counter() - started
+    
+    stats = store.stats()
+    with app.app_context():
+        persisted = DriverLocation.query.count()
+    
+    print(f"Ingest:           {stats['pings_received']:,} pings in {ingest:.2f}s ({stats['pings_received'] / ingest:,.0f}/s)")
+    print(f"Persisted:        {persisted:,} rows in {stats['flushes']} flushes "
+          f"(final drain {drain * 1000:.0f} ms, avg flush {stats['avg_flush_ms']:.0f} ms)")
+    
+    centres = [(-6.80 + rng.uniform(-0.15, 0.15), 39.25 + rng.uniform(-0.15, 0.15)) for _ in range(200)]
+    print(f"\n{'Radius':<10}{'Found':>8}{'Grid ms':>10}{'Scan ms':>10}")
+    for radius_km in (1, 3, 5):
+        started = time.perf_counter()
+        found = [len(store.nearby(lat, lng, radius_km, limit=drivers)) for lat, lng in centres]
+        grid_ms = (time.perf_counter() - started) / len(centres) * 1000
+        
+        started = time.perf_counter()
+        scanned = []
+        for lat, lng in centres:
+            scanned.append(sum(
+                1 for ping in list(store.latest.values())
+                if haversine_km(lat, lng, ping.latitude, ping.longitude) <= radius_km
+            ))
+        scan_ms = (time.perf_counter() - started) / len(centres) * 1000
+        
+        assert found == scanned, "grid index disagrees with the full scan"
+        print(f"{str(radius_km) + ' km':<10}{sum(found) / len(found):>8.1f}{grid_ms:>10.2f}{scan_ms:>10.2f}")
+    
+    checks = [
+        ("every ping persisted", persisted == stats['pings_received']),
+        ("tracks bounded", max(len(track) for track in store.tracks.values()) <= store.history),
+    ]
+    print()
+    for name, ok in checks:
+        print(f"{'✅' if ok else '❌'} {name}")
+
+def benchmark_location_batches(points=20_000):
+    """Points/sec and request count for one-ping requests vs batched (and gzipped) uploads"""
+    import gzip
+    import random
+    import driver_locations
+    
+    print(f"📦 Location batch benchmark ({points:,} points per mode, numpy {'on' if driver_locations.np else 'off'})")
+    print("=" * 50)
+    
+    workdir = tempfile.mkdtemp(prefix="msosihub-bench-")
+    msosihub = load_app(os.path.join(workdir, "batches.db"))
+    app, store = msosihub.app, msosihub.driver_locations
+    
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session["user_id"] = 1
+        session["user_type"] = "driver"
+    with app.app_context():
+        driver = msosihub.User(username="driver", email="driver@example.com", password_hash="x", first_name="Driver",
+                               last_name="Bench", phone="+255 754 000 000", user_type="driver")
+        msosihub.db.session.add(driver)
+        msosihub.db.session.commit()
+    
+    rng = random.Random(42)
+    now = time.time()
+    track = [{"latitude": -6.80 + rng.uniform(-0.05, 0.05), "longitude": 39.25 + rng.uniform(-0.05, 0.05),
+              "recorded_at": now - points + i, "accuracy": 8.0} for i in range(points)]
+    
+    def singles():
+        for point in track:
+            client.post("/api/driver/location", json=point)
+        return len(track)
+    
+    def batches(size, compress):
+        requests = 0
+        for start in range(0, len(track), size):
+            body = json.dumps({"points": track[start:start + size]}).encode()
+            headers = {"Content-Type": "application/json"}
+            if compress:
+                body = gzip.compress(body)
+                headers["Content-Encoding"] = "gzip"
+            response = client.post("/api/driver/locations", data=body, headers=headers)
+            assert response.json["accepted"] == len(track[start:start + size])
+            requests += 1
+        return requests
+    
+    modes = [("one point per request", singles)]
+    for size in (10, 50, 500):
+        modes.append((f"batches of {size}", lambda size=size: batches(size, False)))
+    modes.append(("batches of 50, gzip", lambda: batches(50, True)))
+    
+    print(f"\n{'Mode':<24}{'Requests':>10}{'Seconds':>10}{'Points/sec':>12}")
+    for label, run in modes:
+        started = time.perf_counter()
+        requests = run()
+        elapsed = time.perf_counter() - started
+        print(f"{label:<24}{requests:>10,}{elapsed:>10.2f}{points / elapsed:>12,.0f}")
+    
+    started = time.perf_counter()
+    for _ in range(20):
+        driver_locations.validate_points(track[:500], now=now + 1)
+    print(f"\nvalidate_points(): {(time.perf_counter() - started) / 20 * 1000:.2f} ms per 500 points")
+    store.flush()
+
+def benchmark_driver_feed(ready=1_000, restaurants=300, polls=200):
+    """Available-orders poll: every ready order with lazy item counts vs the K nearest in one query"""
+    import random
+    from datetime import datetime
+    
+    print(f"🛵 Driver feed benchmark ({ready:,} ready orders at {restaurants} restaurants, {polls} polls)")
+    print("=" * 50)
+    
+    workdir = tempfile.mkdtemp(prefix="msosihub-bench-")
+    msosihub = load_app(os.path.join(workdir, "feed.db"))
+    app, db, Order = msosihub.app, msosihub.db, msosihub.Order
+    
+    rng = random.Random(42)
+    now = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S.000000')
+    with app.app_context():
+        conn = db.engine.raw_connection()
+    conn.executemany(
+        'INSERT INTO restaurant (id, user_id, name, address, phone, latitude, longitude, is_active, created_at) '
+        'VALUES (?, 1, ?, ?, ?, ?, ?, 1, ?)',
+        ((i, f"Restaurant {i}", "Dar es Salaam", "+255 754 000 000",
+          -6.80 + rng.uniform(-0.15, 0.15), 39.25 + rng.uniform(-0.15, 0.15), now) for i in range(1, restaurants + 1))
+    )
+    conn.executemany(
+        'INSERT INTO "order" (id, user_id, restaurant_id, total_amount, status, payment_status, payment_method, '
+        'delivery_address, phone, created_at) VALUES (?, 1, ?, 20000, \'ready\', \'paid\', \'wallet\', \'Dar es Salaam\', ?, ?)',
+        ((i, rng.randint(1, restaurants), "+255 754 000 000", now) for i in range(1, ready + 1))
+    )
+    conn.executemany(
+        'INSERT INTO order_item (order_id, dish_id, quantity, price) VALUES (?, 1, 1, 5000)',
+        ((order_id,) for order_id in range(1, ready + 1) for _ in range(3))
+    )
+    conn.commit()
+    conn.close()
+    
+    positions = [(-6.80 + rng.uniform(-0.12, 0.12), 39.25 + rng.uniform(-0.12, 0.12)) for _ in range(polls)]
+    
+    with app.app_context():
+        # Before: every ready order, with a lazy load of its items and restaurant each
+        started = time.perf_counter()
+        for _ in positions:
+            rows = [(order.id, order.restaurant.name, len(order.items)) for order in Order.query.filter_by(status="ready").all()]
+            db.session.remove()
+        before = (time.perf_counter() - started) / polls * 1000
+        before_rows = len(rows)
+        
+        # After: the 20 nearest, item counts from a subquery
+        started = time.perf_counter()
+        for lat, lng in positions:
+            rows = msosihub.nearest_ready_orders(lat, lng, limit=20)
+            db.session.remove()
+        after = (time.perf_counter() - started) / polls * 1000
+    
+    print(f"\n{'Feed':<30}{'Orders':>8}{'ms/poll':>10}")
+    print(f"{'all ready, lazy item counts':<30}{before_rows:>8}{before:>10.2f}")
+    print(f"{'20 nearest, one query':<30}{len(rows):>8}{after:>10.2f}")
+
+def benchmark_events(subscribers=1_000, events=20):
+    """Memory held by idle SSE subscribers and publish-to-delivery latency across all of them"""
+    import statistics
+    import tracemalloc
+    from events import EventBus
+    
+    print(f"📡 Event bus benchmark ({subscribers:,} idle subscribers, {events} broadcasts)")
+    print("=" * 50)
+    
+    def rss_kb():
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+        return 0
+    
+    bus = EventBus(history=100)
+    received = [[] for _ in range(subscribers)]
+    stop = threading.Event()
+    ready = threading.Barrier(subscribers + 1)
+    
+    def listen(index):
+        # What an SSE response thread does between events: block in wait()
+        subscription = bus.subscribe([f"driver:{index}", "drivers"])
+        cursor = bus.last_id
+        ready.wait()
+        while not stop.is_set():
+            for event in subscription.wait(cursor, 1.0):
+                received[index].append((event.id, time.perf_counter()))
+                cursor = event.id
+        subscription.close()
+    
+    tracemalloc.start()
+    rss_before, traced_before = rss_kb(), tracemalloc.get_traced_memory()[0]
+    threads = [threading.Thread(target=listen, args=(i,), daemon=True) for i in range(subscribers)]
+    for thread in threads:
+        thread.start()
+    ready.wait()
+    time.sleep(0.5)
+    rss_after, traced_after = rss_kb(), tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    
+    published = {}
+    for _ in range(events):
+        started = time.perf_counter()
+        event = bus.publish(["drivers"], "order_updated", {"order_id": 1, "status": "ready"})
+        published[event.id] = started
+        time.sleep(0.05)
+    time.sleep(0.5)
+    stop.set()
+    
+    latencies = sorted(
+        (delivered_at - published[event_id]) * 1000
+        for deliveries in received for event_id, delivered_at in deliveries
+    )
+    expected = subscribers * events
+    print(f"Idle memory:      {(rss_after - rss_before) / subscribers:.1f} KB RSS per subscriber "
+          f"({(traced_after - traced_before) / subscribers / 1024:.2f} KB of Python objects)")
+    print(f"Delivered:        {len(latencies):,} of {expected:,}")
+    print(f"Fan-out latency:  p50 {statistics.median(latencies):.2f} ms, "
+          f"p99 {latencies[int(len(latencies) * 0.99) - 1]:.2f} ms, max {latencies[-1]:.2f} ms")
+    print(f"{'✅' if len(latencies) == expected else '❌'} every subscriber got every broadcast")
+
+def benchmark_event_streams(streams=100, threads=64):
+    """Open SSE streams against gunicorn as the Procfile runs it, and whether ordinary requests still get through"""
+    import socket
+    import subprocess
+    import statistics
+    import http.client
+    from concurrent.futures import ThreadPoolExecutor
+    
+    print(f"📡 Event stream benchmark ({streams} open streams, gunicorn with {threads} threads)")
+    print("=" * 50)
+    
+    workdir = tempfile.mkdtemp(prefix="msosihub-bench-")
+    db_path = os.path.join(workdir, "streams.db")
+    msosihub = load_app(db_path)
+    app, db = msosihub.app, msosihub.db
+    with app.app_context():
+        customers = [msosihub.User(username=f"customer{i}", email=f"customer{i}@example.com", password_hash="x",
+                                   first_name="Customer", last_name=str(i), phone="+255 754 000 000")
+                     for i in range(streams)]
+        db.session.add_all(customers)
+        db.session.commit()
+        serializer = app.session_interface.get_signing_serializer(app)
+        cookies = [f"{app.config['SESSION_COOKIE_NAME']}={serializer.dumps({'user_id': customer.id, 'user_type': 'customer'})}"
+                   for customer in customers]
+    
+    def free_port():
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            return probe.getsockname()[1]
+    
+    def run(stream_limit):
+        port = free_port()
+        env = dict(os.environ, DATABASE_URL=f"sqlite:///{db_path}", DISPATCH_INTERVAL="0",
+                   EVENT_STREAM_MAX_OPEN=str(stream_limit))
+        server = subprocess.Popen(
+            [sys.executable, "-m", "gunicorn", "--workers", "1", "--threads", str(threads),
+             "--bind", f"127.0.0.1:{port}", "app:app"],
+            cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        opened = []
+        try:
+            deadline = time.monotonic() + 30
+            while True:
+                try:
+                    socket.create_connection(("127.0.0.1", port), timeout=1).close()
+                    break
+                except OSError:
+                    if time.monotonic() > deadline:
+                        raise RuntimeError("gunicorn did not start")
+                    time.sleep(0.1)
+            
+            def open_stream(cookie):
+                # Reads only the status line and keeps the connection, like a browser tab left open
+                connection = socket.create_connection(("127.0.0.1", port), timeout=3)
+                opened.append(connection)
+                connection.sendall(f"GET /api/events/customer HTTP/1.1\r\nHost: localhost\r\nCookie: {cookie}\r\n\r\n".encode())
+                try:
+                    return int(connection.recv(64).split()[1])
+                except (socket.timeout, IndexError, ValueError):
+                    return "no answer"
+            
+            statuses = {}
+            with ThreadPoolExecutor(max_workers=streams) as pool:
+                for status in pool.map(open_stream, cookies):
+                    statuses[status] = statuses.get(status, 0) + 1
+            
+            def ordinary(cookie):
+                # The customer's order history, while every stream above is still open
+                client = http.client.HTTPConnection("127.0.0.1", port, timeout=3)
+                started = time.perf_counter()
+                try:
+                    client.request("GET", "/api/my_orders", headers={"Cookie": cookie})
+                    status = client.getresponse().status
+                except (socket.timeout, OSError):
+                    return None
+                finally:
+                    client.close()
+                return (time.perf_counter() - started) * 1000 if status == 200 else None
+            
+            with ThreadPoolExecutor(max_workers=16) as pool:
+                latencies = list(pool.map(ordinary, cookies[:50]))
+            return statuses, latencies
+        finally:
+            for connection in opened:
+                connection.close()
+            server.terminate()
+            server.wait()
+    
+    checks = []
+    for label, stream_limit in (("no stream limit", streams * 10), ("EVENT_STREAM_MAX_OPEN=32", 32)):
+        statuses, latencies = run(stream_limit)
+        answered = sorted(latency for latency in latencies if latency is not None)
+        print(f"{label}:")
+        print(f"  streams:          " + ", ".join(f"{count} x {status}" for status, count in sorted(statuses.items(), key=str)))
+        summary = f", p50 {statistics.median(answered):.1f} ms, max {answered[-1]:.1f} ms" if answered else ""
+        print(f"  /api/my_orders:   {len(answered)} of {len(latencies)} answered within 3s{summary}")
+        if stream_limit == 32:
+            checks = [
+                ("streams beyond the limit get 503", statuses.get(200, 0) == min(streams, 32)
+                 and statuses.get(503, 0) == streams - statuses.get(200, 0)),
+                ("ordinary requests answered while streams are open", len(answered) == len(latencies)),
+            ]
+    for name, ok in checks:
+        print(f"{'✅' if ok else '❌'} {name}")
+
+def benchmark_dispatch(size=1_000):
+    """One dispatch round at size x size: each assignment solver, then the full round against the database"""
+    import random
+    from datetime import datetime, timedelta
+    import dispatch
+    from driver_locations import haversine_km
+    
+    print(f"🧭 Dispatch benchmark ({size:,} ready orders x {size:,} idle drivers)")
+    print("=" * 50)
+    
+    rng = random.Random(42)
+    now = time.time()
+    restaurants = [(-6.80 + rng.uniform(-0.15, 0.15), 39.25 + rng.uniform(-0.15, 0.15)) for _ in range(300)]
+    orders = [(i, *rng.choice(restaurants), now - rng.uniform(0, 1200)) for i in range(1, size + 1)]
+    drivers = [(size + i, -6.80 + rng.uniform(-0.15, 0.15), 39.25 + rng.uniform(-0.15, 0.15)) for i in range(1, size + 1)]
+    
+    def greedy():
+        # Oldest order first takes the nearest free driver: what first-come-first-served converges to
+        free = dict((driver_id, (lat, lng)) for driver_id, lat, lng in drivers)
+        plan = []
+        for order_id, lat, lng, _ in sorted(orders, key=lambda order: order[3]):
+            distance, driver_id = min(((haversine_km(lat, lng, *position), driver_id) for driver_id, position in free.items()),
+                                      default=(None, None))
+            if driver_id is not None and distance <= 8.0:
+                plan.append((order_id, driver_id, distance))
+                del free[driver_id]
+        return plan
+    
+    solvers = [("greedy, oldest first", greedy)]
+    saved = dispatch.np, dispatch.linear_sum_assignment
+    if dispatch.linear_sum_assignment is not None:
+        solvers.append(("scipy", lambda: dispatch.plan_assignments(orders, drivers, now=now)))
+    if dispatch.np is not None:
+        def numpy_solver():
+            dispatch.linear_sum_assignment = None
+            try:
+                return dispatch.plan_assignments(orders, drivers, now=now)
+            finally:
+                dispatch.np, dispatch.linear_sum_assignment = saved
+        solvers.append(("numpy shortest path", numpy_solver))
+    def sparse_auction():
+        dispatch.np = dispatch.linear_sum_assignment = None
+        try:
+            return dispatch.plan_assignments(orders, drivers, now=now)
+        finally:
+            dispatch.np, dispatch.linear_sum_assignment = saved
+    solvers.append(("pure-Python auction", sparse_auction))
+    
+    print(f"\n{'Solver':<24}{'ms':>9}{'Assigned':>10}{'Total km':>10}{'Mean km':>9}")
+    for name, solve in solvers:
+        started = time.perf_counter()
+        plan = solve()
+        elapsed = (time.perf_counter() - started) * 1000
+        total = sum(distance for _, _, distance in plan)
+        assert len({driver_id for _, driver_id, _ in plan}) == len(plan), f"{name} booked a driver twice"
+        print(f"{name:<24}{elapsed:>9.1f}{len(plan):>10}{total:>10.1f}{total / max(len(plan), 1):>9.2f}")
+    
+    # The whole round: read, solve, and write every assignment in one transaction
+    workdir = tempfile.mkdtemp(prefix="msosihub-bench-")
+    msosihub = load_app(os.path.join(workdir, "dispatch.db"))
+    app, db, Order = msosihub.app, msosihub.db, msosihub.Order
+    created = datetime.utcnow()
+    with app.app_context():
+        conn = db.engine.raw_connection()
+    conn.executemany(
+        'INSERT INTO user (id, username, email, password_hash, first_name, last_name, phone, user_type, created_at) '
+        'VALUES (?, ?, ?, \'x\', \'Driver\', ?, \'+255 754 000 000\', ?, ?)',
+        [(1, "customer", "customer@example.com", "Customer", "customer", created.strftime('%Y-%m-%d %H:%M:%S.000000'))]
+        + [(driver_id, f"driver{driver_id}", f"driver{driver_id}@example.com", str(driver_id), "driver",
+            created.strftime('%Y-%m-%d %H:%M:%S.000000')) for driver_id, _, _ in drivers]
+    )
+    conn.executemany(
+        'INSERT INTO restaurant (id, user_id, name, address, phone, latitude, longitude, is_active, created_at) '
+        'VALUES (?, 1, ?, \'Dar es Salaam\', \'+255 754 000 000\', ?, ?, 1, ?)',
+        ((i, f"Restaurant {i}", lat, lng, created.strftime('%Y-%m-%d %H:%M:%S.000000'))
+         for i, (lat, lng) in enumerate(restaurants, 1))
+    )
+    restaurant_ids = {position: i for i, position in enumerate(restaurants, 1)}
+    conn.executemany(
+        'INSERT INTO "order" (id, user_id, restaurant_id, total_amount, status, payment_status, payment_method, '
+        'delivery_address, phone, created_at) VALUES (?, 1, ?, 20000, \'ready\', \'paid\', \'wallet\', \'Dar es Salaam\', '
+        '\'+255 754 000 000\', ?)',
+        ((order_id, restaurant_ids[lat, lng], datetime.utcfromtimestamp(ready_since).strftime('%Y-%m-%d %H:%M:%S.000000'))
+         for order_id, lat, lng, ready_since in orders)
+    )
+    conn.commit()
+    conn.close()
+    with app.app_context():
+        msosihub.rebuild_daily_stats()
+        msosihub.check_restaurant_counters(fix=True)
+    
+    for driver_id, lat, lng in drivers:
+        msosihub.driver_locations.record(driver_id, lat, lng)
+    with contextlib.redirect_stdout(io.StringIO()):
+        started = time.perf_counter()
+        assigned = msosihub.run_dispatch_round()
+        elapsed = (time.perf_counter() - started) * 1000
+        again = msosihub.run_dispatch_round()
+    
+    with app.app_context():
+        drivers_used = db.session.query(db.func.count(db.distinct(Order.driver_id))).filter(
+            Order.status == "out_for_delivery").scalar()
+        drift = msosihub.check_restaurant_counters()
+    print(f"\nFull round:       {assigned:,} orders assigned in {elapsed:.0f} ms (solver: "
+          f"{'scipy' if dispatch.linear_sum_assignment else 'numpy shortest path' if dispatch.np else 'pure-Python auction'})")
+    checks = [
+        ("every assignment written", drivers_used == assigned),
+        ("second round finds nothing left to assign", again == 0),
+        ("restaurant counters consistent", not drift),
+    ]
+    for name, ok in checks:
+        print(f"{'✅' if ok else '❌'} {name}")
+
+def benchmark_routes(orders=8, trials=200):
+    """Route length and planning time for a driver carrying several orders: as taken vs nearest-neighbour vs 2-opt"""
+    import random
+    import statistics
+    import routing
+    
+    print(f"🗺️ Route benchmark ({orders} orders per driver, {trials} drivers)")
+    print("=" * 50)
+    
+    rng = random.Random(42)
+    lengths = {"as taken": [], "nearest neighbour": [], "nearest neighbour + 2-opt": []}
+    timings = {"full plan": [], "incremental (1 order added)": [], "cached": []}
+    feasible = True
+    
+    def point():
+        return (-6.80 + rng.uniform(-0.08, 0.08), 39.25 + rng.uniform(-0.08, 0.08))
+    
+    for trial in range(trials):
+        start = point()
+        stops = []
+        for order_id in range(1, orders + 2):
+            stops.append(routing.Stop(order_id, routing.PICKUP, *point()))
+            stops.append(routing.Stop(order_id, routing.DROPOFF, *point()))
+        first, extra = stops[:-2], stops
+        
+        matrix = routing.distance_matrix([start] + [(stop.latitude, stop.longitude) for stop in first])
+        pickup_of = routing.precedence(first)
+        greedy = routing.nearest_neighbour(matrix, pickup_of)
+        improved = routing.two_opt(greedy, matrix, pickup_of)
+        lengths["as taken"].append(routing.route_length(range(1, len(first) + 1), matrix))
+        lengths["nearest neighbour"].append(routing.route_length(greedy, matrix))
+        lengths["nearest neighbour + 2-opt"].append(routing.route_length(improved, matrix))
+        feasible = feasible and routing.is_feasible(improved, pickup_of)
+        
+        planner = routing.RoutePlanner()
+        for name, route_stops in (("full plan", first), ("cached", first), ("incremental (1 order added)", extra)):
+            started = time.perf_counter()
+            plan = planner.route(trial, start, route_stops)
+            timings[name].append((time.perf_counter() - started) * 1000)
+        position = {stop.key: index for index, stop in enumerate(plan.stops)}
+        feasible = feasible and all(position[(order_id, routing.PICKUP)] < position[(order_id, routing.DROPOFF)]
+                                    for order_id in range(1, orders + 2))
+    
+    print(f"\n{'Route':<30}{'Mean km':>10}")
+    for name, values in lengths.items():
+        print(f"{name:<30}{statistics.mean(values):>10.2f}")
+    print(f"\n{'Planning':<30}{'Mean ms':>10}{'Max ms':>10}")
+    for name, values in timings.items():
+        print(f"{name:<30}{statistics.mean(values):>10.3f}{max(values):>10.3f}")
+    print(f"\n{'✅' if feasible else '❌'} every pickup comes before its dropoff")
+
+def benchmark_claims(drivers=200, orders=50, threads=64):
+    """Drivers racing to claim the same ready orders, one at a time and in batches: each order goes to exactly one
+    
+    threads matches the Procfile's gunicorn --threads, the most requests the app serves at once.
+    """
+    import random
+    from concurrent.futures import ThreadPoolExecutor
+    
+    print(f"🏁 Delivery claim stress test ({drivers} drivers racing for {orders} orders, {threads} threads)")
+    print("=" * 50)
+    
+    workdir = tempfile.mkdtemp(prefix="msosihub-bench-")
+    msosihub = load_app(os.path.join(workdir, "claims.db"))
+    app, db, User, Restaurant, Order = msosihub.app, msosihub.db, msosihub.User, msosihub.Restaurant, msosihub.Order
+    
+    with app.app_context():
+        customer = User(username="customer", email="customer@example.com", password_hash="x", first_name="Customer",
+                        last_name="Bench", phone="+255 754 000 000", address="Dar es Salaam")
+        owner = User(username="owner", email="owner@example.com", password_hash="x", first_name="Owner",
+                     last_name="Bench", phone="+255 754 000 000", user_type="restaurant")
+        db.session.add_all([customer, owner])
+        db.session.flush()
+        restaurant = Restaurant(user_id=owner.id, name="Benchmark Bites", address="Masaki", phone="+255 754 000 000")
+        db.session.add(restaurant)
+        driver_ids = []
+        for i in range(drivers):
+            driver = User(username=f"driver{i}", email=f"driver{i}@example.com", password_hash="x", first_name="Driver",
+                          last_name=str(i), phone="+255 754 000 000", user_type="driver")
+            db.session.add(driver)
+            db.session.flush()
+            driver_ids.append(driver.id)
+        db.session.commit()
+        customer_id, restaurant_id = customer.id, restaurant.id
+    
+    def ready_orders():
+        with app.app_context():
+            batch = [Order(user_id=customer_id, restaurant_id=restaurant_id, total_amount=20000, status="ready",
+                           payment_status="paid", delivery_address="Dar es Salaam", phone="+255 754 000 000")
+                     for _ in range(orders)]
+            db.session.add_all(batch)
+            db.session.commit()
+            return [order.id for order in batch]
+    
+    def take_one_by_one(driver_id, order_ids):
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session["user_id"] = driver_id
+            session["user_type"] = "driver"
+        won, attempts, errors = [], 0, 0
+        for order_id in random.Random(driver_id).sample(order_ids, len(order_ids)):
+            attempts += 1
+            status = client.post(f"/take_delivery/{order_id}").status_code
+            if status == 200:
+                won.append(order_id)
+            errors += status >= 500
+        return won, attempts, errors
+    
+    def claim_in_batches(driver_id, order_ids):
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session["user_id"] = driver_id
+            session["user_type"] = "driver"
+        shuffled = random.Random(driver_id).sample(order_ids, len(order_ids))
+        won, attempts, errors = [], 0, 0
+        for i in range(0, len(shuffled), msosihub.MAX_CLAIM_BATCH):
+            attempts += 1
+            response = client.post("/api/driver/claim", json={"order_ids": shuffled[i:i + msosihub.MAX_CLAIM_BATCH]})
+            if response.status_code >= 500:
+                errors += 1
+            else:
+                won.extend(response.get_json()["claimed"])
+        return won, attempts, errors
+    
+    for name, claim in (("take_delivery, one order per request", take_one_by_one),
+                        ("/api/driver/claim, batches of 10", claim_in_batches)):
+        order_ids = ready_orders()
+        subscription = msosihub.event_bus.subscribe(["drivers"])
+        cursor = msosihub.event_bus.last_id
+        
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()), ThreadPoolExecutor(max_workers=threads) as pool:
+            results = list(pool.map(lambda driver_id: claim(driver_id, order_ids), driver_ids))
+        elapsed = time.perf_counter() - started
+        
+        winners = {}
+        for driver_id, (won, _, _) in zip(driver_ids, results):
+            for order_id in won:
+                winners.setdefault(order_id, []).append(driver_id)
+        requests = sum(attempts for _, attempts, _ in results)
+        errors = sum(errors for _, _, errors in results)
+        with app.app_context():
+            assigned = dict(db.session.query(Order.id, Order.driver_id).filter(
+                Order.id.in_(order_ids), Order.status == "out_for_delivery"
+            ))
+            drift = msosihub.check_restaurant_counters()
+        events = [event for event in subscription.wait(cursor, 0) if event.data["order_id"] in order_ids]
+        subscription.close()
+        
+        print(f"\n{name}")
+        print(f"Requests:         {requests:,} in {elapsed:.2f}s ({requests / elapsed:,.0f}/s)")
+        print(f"Orders claimed:   {len(winners)} by {len({driver for ids in winners.values() for driver in ids})} drivers")
+        checks = [
+            ("no failed requests", errors == 0),
+            ("every order claimed", set(winners) == set(order_ids)),
+            ("no order won twice", all(len(ids) == 1 for ids in winners.values())),
+            ("stored driver is the winner", all(assigned.get(order_id) == ids[0] for order_id, ids in winners.items())),
+            ("one event per order", len(events) == len(order_ids)),
+            ("restaurant counters consistent", not drift),
+        ]
+        for check, ok in checks:
+            print(f"{'✅' if ok else '❌'} {check}")
+
+BENCHMARKS = {
+    'smtp': benchmark_smtp,
+    'templates': benchmark_templates,
+    'outbox': benchmark_outbox,
+    'indexes': benchmark_order_indexes,
+    'pagination': benchmark_pagination,
+    'search': benchmark_search,
+    'dish-search': benchmark_dish_search,
+    'checkout': benchmark_checkout,
+    'idempotency': benchmark_idempotency,
+    'driver-locations': benchmark_driver_locations,
+    'location-batches': benchmark_location_batches,
+    'driver-feed': benchmark_driver_feed,
+    'events': benchmark_events,
+    'event-streams': benchmark_event_streams,
+    'dispatch': benchmark_dispatch,
+    'routes': benchmark_routes,
+    'claims': benchmark_claims,
+}
+
+def main():
+    """Main function"""
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+        print("Usage: python benchmarks.py <benchmark> [size]")
+        print("Available benchmarks: " + ", ".join(BENCHMARKS))
+        return 1
+    
+    # An optional second argument overrides the benchmark's default size
+    BENCHMARKS[sys.argv[1]](*[int(arg) for arg in sys.argv[2:3]])
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+MsosiHub Dispatch
+Assigns ready orders to idle drivers in rounds by solving a distance/wait assignment problem
+"""
+
+import os
+import math
+import time
+import threading
+
+from driver_locations import GridIndex, EARTH_RADIUS_KM
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:
+    linear_sum_assignment = None
+
+# Without numpy each order only considers its nearest drivers, which keeps the pure-Python path fast
+SPARSE_CANDIDATES = 30
+
+
+def benefit(distance_km, waited_minutes, max_km, wait_weight):
+    """Value of one pickup: always positive within max_km, higher for near drivers and old orders
+
+    Leaving an order unassigned is worth 0, so a round assigns as many orders as it can
+    and only then trades distance against waiting time.
+    """
+    return max_km - distance_km + wait_weight * waited_minutes
+
+
+def benefit_matrix(orders, drivers, now, max_km, wait_weight):
+    """orders x drivers benefits with numpy (-inf beyond max_km) and the distance matrix"""
+    order_lat = np.radians(np.array([order[1] for order in orders], dtype=float))[:, None]
+    order_lng = np.radians(np.array([order[2] for order in orders], dtype=float))[:, None]
+    driver_lat = np.radians(np.array([driver[1] for driver in drivers], dtype=float))[None, :]
+    driver_lng = np.radians(np.array([driver[2] for driver in drivers], dtype=float))[None, :]
+    a = (np.sin((driver_lat - order_lat) / 2) ** 2
+         + np.cos(order_lat) * np.cos(driver_lat) * np.sin((driver_lng - order_lng) / 2) ** 2)
+    distances = 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+    waited = np.array([(now - order[3]) / 60.0 for order in orders], dtype=float)[:, None]
+    benefits = benefit(distances, waited, max_km, wait_weight)
+    benefits[distances > max_km] = -np.inf
+    return benefits, distances
+
+
+def shortest_augmenting_path(cost):
+    """Minimum-cost assignment of every row to a distinct column (rows <= columns), in numpy
+
+    The Jonker-Volgenant scheme scipy's linear_sum_assignment implements in C: rows
+    first take their cheapest free column, then each remaining row is assigned along a
+    shortest augmenting path over reduced costs, one vectorized relaxation per step.
+    Returns the column of each row.
+    """
+    rows, columns = cost.shape
+    column_of = np.full(rows, -1)
+    row_of = np.full(columns, -1)
+    cheapest = cost.argmin(axis=1)
+    u = cost[np.arange(rows), cheapest]  # row duals; column duals v start at 0
+    v = np.zeros(columns)
+    for row, column in enumerate(cheapest.tolist()):
+        if row_of[column] < 0:
+            row_of[column], column_of[row] = row, column
+
+    reduced = np.empty(columns)
+    improved = np.empty(columns, dtype=bool)
+    for start in np.flatnonzero(column_of < 0).tolist():
+        live_v = v.copy()  # scanned columns get -inf here, which keeps them out of later relaxations
+        distance = np.full(columns, np.inf)
+        path = np.full(columns, -1)
+        scanned, scanned_distance = [], []
+        row, min_value = start, 0.0
+        while True:
+            np.subtract(cost[row], live_v, out=reduced)
+            reduced += min_value - u[row]
+            np.less(reduced, distance, out=improved)
+            np.copyto(distance, reduced, where=improved)
+            np.copyto(path, row, where=improved)
+            column = int(distance.argmin())
+            min_value = distance[column]
+            scanned.append(column)
+            scanned_distance.append(min_value)
+            distance[column] = np.inf
+            live_v[column] = -np.inf
+            if row_of[column] < 0:
+                break
+            row = row_of[column]
+
+        # Rows reached along the way are those matched to the scanned columns, in order
+        scanned_distance = np.array(scanned_distance)
+        u[start] += min_value
+        u[row_of[scanned[:-1]]] += min_value - scanned_distance[:-1]
+        v[scanned] -= min_value - scanned_distance
+        while True:
+            row = path[column]
+            row_of[column] = row
+            column_of[row], column = column, column_of[row]
+            if row == start:
+                break
+    return column_of
+
+
+def solve_dense(cost):
+    """(row, column) pairs of a minimum-cost assignment: scipy when installed, numpy otherwise"""
+    if linear_sum_assignment is not None:
+        rows, columns = linear_sum_assignment(cost)
+        return list(zip(rows.tolist(), columns.tolist()))
+    if cost.shape[0] > cost.shape[1]:
+        return [(row, column) for column, row in enumerate(shortest_augmenting_path(cost.T).tolist())]
+    return list(enumerate(shortest_augmenting_path(cost).tolist()))
+
+
+def sparse_auction(candidates, min_eps=0.01):
+    """Forward auction over candidate lists, candidates[row] = [(column, benefit), ...], in pure Python
+
+    Each unmatched row bids for its best column, raising its price by the margin over
+    the row's second best option, and displaces the previous holder. Epsilon scaling
+    runs rough, fast phases first and keeps the prices for the next; that is only exact
+    when every row ends up matched, so the candidates must admit a perfect matching.
+    Columns are small integers. The result is within rows * min_eps of the optimum.
+    Returns {row: column}.
+    """
+    values = [value for options in candidates.values() for _, value in options]
+    spread = max(values) - min(values) + 1.0
+    prices = [0.0] * (max(column for options in candidates.values() for column, _ in options) + 1)
+    eps = max(spread / 4, min_eps)
+
+    while True:
+        column_of, row_of = {}, {}
+        queue = list(candidates)
+        while queue:
+            row = queue.pop()
+            best_column, best_value, second_value = None, -math.inf, -math.inf
+            for column, value in candidates[row]:
+                value -= prices[column]
+                if value > best_value:
+                    best_column, best_value, second_value = column, value, best_value
+                elif value > second_value:
+                    second_value = value
+            prices[best_column] += min(best_value - second_value, spread) + eps
+            previous = row_of.get(best_column)
+            if previous is not None:
+                del column_of[previous]
+                queue.append(previous)
+            row_of[best_column] = row
+            column_of[row] = best_column
+
+        if eps <= min_eps:
+            return column_of
+        eps = max(eps / 5, min_eps)
+
+
+def plan_assignments(orders, drivers, now=None, max_km=8.0, wait_weight=0.2):
+    """Pair ready orders with idle drivers for one dispatch round
+
+    orders are (order_id, latitude, longitude, ready_since) with ready_since in epoch
+    seconds; drivers are (driver_id, latitude, longitude). The round maximizes the total
+    benefit(): as many pickups as possible, then short ones, then long-waiting orders
+    first. Uses scipy's solver when installed, the same algorithm in numpy otherwise
+    and, without numpy, an auction over each order's nearest drivers.
+    Returns (order_id, driver_id, distance_km) tuples.
+    """
+    if not orders or not drivers:
+        return []
+    now = time.time() if now is None else now
+    count = len(drivers)
+
+    if np is not None:
+        benefits, distances = benefit_matrix(orders, drivers, now, max_km, wait_weight)
+        # Forbidden pairs cost the same as leaving the order unassigned, then get dropped
+        pairs = solve_dense(np.where(np.isfinite(benefits), -benefits, 0.0))
+        return [(orders[row][0], drivers[column][0], float(distances[row, column]))
+                for row, column in pairs if np.isfinite(benefits[row, column])]
+
+    # Order i may stay unassigned (column count + i) and driver j idle (row len(orders) + j).
+    # Idle rows can take the unassigned column of any order their driver was a candidate
+    # for, so every partial assignment extends to a perfect matching of the same value.
+    grid = GridIndex()
+    for column, (_, latitude, longitude) in enumerate(drivers):
+        grid.update(column, latitude, longitude)
+    candidates, distances = {}, {}
+    idle = {column: [(column, 0.0)] for column in range(count)}
+    for row, (_, latitude, longitude, ready_since) in enumerate(orders):
+        waited = (now - ready_since) / 60.0
+        nearest = grid.nearby(latitude, longitude, max_km)[:SPARSE_CANDIDATES]
+        candidates[row] = [(column, benefit(distance, waited, max_km, wait_weight)) for distance, column in nearest]
+        candidates[row].append((count + row, 0.0))
+        for distance, column in nearest:
+            distances[row, column] = distance
+            idle[column].append((count + row, 0.0))
+    candidates.update({len(orders) + column: options for column, options in idle.items()})
+    column_of = sparse_auction(candidates)
+    return [(orders[row][0], drivers[column_of[row]][0], distances[row, column_of[row]])
+            for row in range(len(orders)) if column_of[row] < count]
+
+
+class Dispatcher:
+    """Background thread that calls run_round() every interval seconds in the web process
+
+    It runs next to the LocationStore and the event bus, so it sees live driver positions
+    and its assignments reach SSE clients. An interval of 0 disables it.
+    """
+
+    def __init__(self, run_round, interval=5.0):
+        self.run_round = run_round
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._pid = None
+
+        # Counters exposed through stats()
+        self.rounds = 0
+        self.assigned = 0
+        self.errors = 0
+        self.last_round_ms = 0.0
+        self.max_round_ms = 0.0
+
+    def ensure_started(self):
+        """Start the thread once per process (gunicorn forks after import)"""
+        if self.interval <= 0 or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            thread = threading.Thread(target=self._run, name="dispatcher", daemon=True)
+            thread.start()
+            self._pid = os.getpid()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.run_once()
+
+    def run_once(self):
+        started = time.monotonic()
+        try:
+            assigned = self.run_round()
+        except Exception as e:
+            with self._lock:
+                self.errors += 1
+            print(f"❌ Dispatch round failed: {str(e)}")
+            return 0
+        elapsed = (time.monotonic() - started) * 1000
+        with self._lock:
+            self.rounds += 1
+            self.assigned += assigned
+            self.last_round_ms = elapsed
+            self.max_round_ms = max(self.max_round_ms, elapsed)
+        return assigned
+
+    def stats(self):
+        with self._lock:
+            return {
+                "interval_seconds": self.interval,
+                "rounds": self.rounds,
+                "assigned": self.assigned,
+                "errors": self.errors,
+                "last_round_ms": round(self.last_round_ms, 2),
+                "max_round_ms": round(self.max_round_ms, 2),
+            }
\ No newline at end of file
@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+"""
+MsosiHub Driver Locations
+Recent driver pings in memory, a grid index for radius queries and batched persistence
+"""
+
+import os
+import math
+import time
+import threading
+from collections import deque
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = 111.32
+MAX_CLOCK_SKEW = 60  # seconds a device clock may run ahead of ours
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    """Great-circle distance between two points in kilometres"""
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def validate_coordinates(latitude, longitude):
+    """Coordinates as floats; raises ValueError for anything that is not a point on Earth"""
+    try:
+        latitude, longitude = float(latitude), float(longitude)
+    except OverflowError:
+        raise ValueError("Coordinates out of range")
+    if not (-90.0 <= latitude <= 90.0 and -180.0 <= longitude <= 180.0):
+        raise ValueError("Coordinates out of range")
+    return latitude, longitude
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError, OverflowError):  # OverflowError: JSON integers beyond float range
+        return math.nan
+
+
+def _column(points, key):
+    values = [point.get(key) if isinstance(point, dict) else None for point in points]
+    try:
+        column = np.array(values, dtype=float)
+        if column.ndim == 1:
+            return column
+    except (TypeError, ValueError, OverflowError):
+        pass
+    return np.array([_to_float(value) for value in values], dtype=float)
+
+
+def validate_points(points, max_age=86400, now=None):
+    """Split a batch of {latitude, longitude, recorded_at, accuracy} dicts into good and bad
+
+    recorded_at is epoch seconds and is required; accuracy is optional. A point is
+    rejected when it is malformed, off the globe, has a negative accuracy or was
+    recorded outside [now - max_age, now + MAX_CLOCK_SKEW]. Returns (valid, rejected):
+    (latitude, longitude, accuracy, recorded_at) tuples for record_many() and the
+    indexes of the rejected points. The checks run as one vectorized pass when numpy
+    is installed.
+    """
+    now = time.time() if now is None else now
+    oldest, newest = now - max_age, now + MAX_CLOCK_SKEW
+
+    if np is not None:
+        latitudes = _column(points, "latitude")
+        longitudes = _column(points, "longitude")
+        recorded_ats = _column(points, "recorded_at")
+        accuracies = _column(points, "accuracy")
+        # NaN fails every comparison, so missing or malformed values drop out here
+        ok = (
+            (np.abs(latitudes) <= 90.0) & (np.abs(longitudes) <= 180.0)
+            & (recorded_ats >= oldest) & (recorded_ats <= newest)
+            & (np.isnan(accuracies) | (accuracies >= 0))
+        )
+        valid = [
+            (latitude, longitude, None if math.isnan(accuracy) else accuracy, recorded_at)
+            for latitude, longitude, accuracy, recorded_at in zip(
+                latitudes[ok].tolist(), longitudes[ok].tolist(), accuracies[ok].tolist(), recorded_ats[ok].tolist()
+            )
+        ]
+        return valid, np.flatnonzero(~ok).tolist()
+
+    valid, rejected = [], []
+    for index, point in enumerate(points):
+        if not isinstance(point, dict):
+            rejected.append(index)
+            continue
+        latitude = _to_float(point.get("latitude"))
+        longitude = _to_float(point.get("longitude"))
+        recorded_at = _to_float(point.get("recorded_at"))
+        accuracy = _to_float(point.get("accuracy"))
+        if (abs(latitude) <= 90.0 and abs(longitude) <= 180.0 and oldest <= recorded_at <= newest
+                and (math.isnan(accuracy) or accuracy >= 0)):
+            valid.append((latitude, longitude, None if math.isnan(accuracy) else accuracy, recorded_at))
+        else:
+            rejected.append(index)
+    return valid, rejected
+
+
+class Ping:
+    """One location report from a driver"""
+    __slots__ = ("driver_id", "latitude", "longitude", "accuracy", "recorded_at")
+
+    def __init__(self, driver_id, latitude, longitude, accuracy, recorded_at):
+        self.driver_id = driver_id
+        self.latitude = latitude
+        self.longitude = longitude
+        self.accuracy = accuracy
+        self.recorded_at = recorded_at  # epoch seconds
+
+    def to_dict(self):
+        return {
+            "driver_id": self.driver_id,
+            "lat": self.latitude,
+            "lng": self.longitude,
+            "accuracy": self.accuracy,
+            "recorded_at": self.recorded_at,
+        }
+
+
+class GridIndex:
+    """Uniform lat/lng grid of driver positions for radius queries
+
+    Each driver sits in exactly one cell; a radius query only looks at the cells the
+    circle's bounding box touches, so its cost depends on local density rather than
+    on how many drivers are online. Not thread-safe; LocationStore locks around it.
+    """
+
+    def __init__(self, cell_degrees=0.01):
+        self.cell_degrees = cell_degrees  # ~1.1 km north-south
+        self.cells = {}
+        self.positions = {}  # driver_id -> (cell, latitude, longitude)
+
+    def _cell(self, latitude, longitude):
+        return (math.floor(latitude / self.cell_degrees), math.floor(longitude / self.cell_degrees))
+
+    def update(self, driver_id, latitude, longitude):
+        cell = self._cell(latitude, longitude)
+        previous = self.positions.get(driver_id)
+        if previous is not None and previous[0] != cell:
+            self._discard(previous[0], driver_id)
+        if previous is None or previous[0] != cell:
+            self.cells.setdefault(cell, set()).add(driver_id)
+        self.positions[driver_id] = (cell, latitude, longitude)
+
+    def remove(self, driver_id):
+        previous = self.positions.pop(driver_id, None)
+        if previous is not None:
+            self._discard(previous[0], driver_id)
+
+    def _discard(self, cell, driver_id):
+        members = self.cells.get(cell)
+        if members is not None:
+            members.discard(driver_id)
+            if not members:
+                del self.cells[cell]
+
+    def nearby(self, latitude, longitude, radius_km):
+        """(distance_km, driver_id) pairs within radius_km, nearest first"""
+        lat_span = radius_km / KM_PER_DEGREE
+        lng_span = radius_km / (KM_PER_DEGREE * max(math.cos(math.radians(latitude)), 0.01))
+        min_row, min_col = self._cell(latitude - lat_span, longitude - lng_span)
+        max_row, max_col = self._cell(latitude + lat_span, longitude + lng_span)
+
+        found = []
+        for row in range(min_row, max_row + 1):
+            for col in range(min_col, max_col + 1):
+                for driver_id in self.cells.get((row, col), ()):
+                    _, driver_lat, driver_lng = self.positions[driver_id]
+                    distance = haversine_km(latitude, longitude, driver_lat, driver_lng)
+                    if distance <= radius_km:
+                        found.append((distance, driver_id))
+        found.sort()
+        return found
+
+
+class LocationStore:
+    """Latest position and a bounded track of recent pings per driver, persisted in batches
+
+    record() only touches memory: the ping goes into the driver's ring buffer, the grid
+    index and a pending list that a background thread hands to persist(pings) every
+    flush_interval seconds or once flush_batch pings are waiting. If persistence falls
+    behind by max_pending pings, the caller flushes inline rather than growing without
+    bound. The store lives in the worker process, like the page cache, so run a single
+    web worker or route a driver's pings to the same one.
+    """
+
+    def __init__(self, persist, history=50, flush_interval=2.0, flush_batch=2000,
+                 max_pending=50000, stale_after=300, cell_degrees=0.01):
+        self.persist = persist
+        self.history = history
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self.max_pending = max_pending
+        self.stale_after = stale_after
+        self.tracks = {}
+        self.latest = {}
+        self.grid = GridIndex(cell_degrees)
+        self._pending = []
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._pid = None
+
+        # Counters exposed through stats()
+        self.pings_received = 0
+        self.pings_persisted = 0
+        self.flushes = 0
+        self.flush_errors = 0
+        self.flush_time_total = 0.0
+
+    def _ensure_thread(self):
+        """Start the flusher once per process (gunicorn forks after import)"""
+        if self._pid == os.getpid():
+            return
+        with self._cond:
+            if self._pid == os.getpid():
+                return
+            thread = threading.Thread(target=self._run, name="driver-location-flusher", daemon=True)
+            thread.start()
+            self._pid = os.getpid()
+
+    def record(self, driver_id, latitude, longitude, accuracy=None, recorded_at=None):
+        """Store a ping; raises ValueError for invalid coordinates"""
+        latitude, longitude = validate_coordinates(latitude, longitude)
+        return self.record_many(driver_id, [(latitude, longitude, accuracy, recorded_at or time.time())])[-1]
+
+    def record_many(self, driver_id, points):
+        """Store a batch of (latitude, longitude, accuracy, recorded_at) tuples from one driver
+
+        Points must already be validated (see validate_points). The whole batch is
+        added under one lock acquisition and queued for the same flush.
+        """
+        if not points:
+            return []
+        pings = [Ping(driver_id, latitude, longitude, accuracy, recorded_at)
+                 for latitude, longitude, accuracy, recorded_at in sorted(points, key=lambda point: point[3])]
+        self._ensure_thread()
+
+        with self._cond:
+            self.pings_received += len(pings)
+            track = self.tracks.get(driver_id)
+            if track is None:
+                track = self.tracks[driver_id] = deque(maxlen=self.history)
+            track.extend(pings)
+            # Late-arriving pings extend the track but must not move the driver back
+            newest = pings[-1]
+            current = self.latest.get(driver_id)
+            if current is None or newest.recorded_at >= current.recorded_at:
+                self.latest[driver_id] = newest
+                self.grid.update(driver_id, newest.latitude, newest.longitude)
+            self._pending.extend(pings)
+            pending = len(self._pending)
+            if pending >= self.flush_batch:
+                self._cond.notify()
+
+        if pending >= self.max_pending:
+            self.flush()
+        return pings
+
+    def position(self, driver_id):
+        """Latest ping of a driver, or None if it is unknown or stale"""
+        with self._cond:
+            ping = self.latest.get(driver_id)
+        if ping is None or ping.recorded_at < time.time() - self.stale_after:
+            return None
+        return ping
+
+    def track(self, driver_id, limit=None):
+        """Recent pings of a driver, oldest first"""
+        with self._cond:
+            pings = list(self.tracks.get(driver_id, ()))
+        return pings[-limit:] if limit else pings
+
+    def positions(self):
+        """Latest ping of every driver seen within stale_after"""
+        cutoff = time.time() - self.stale_after
+        with self._cond:
+            return [ping for ping in self.latest.values() if ping.recorded_at >= cutoff]
+
+    def nearby(self, latitude, longitude, radius_km=5.0, limit=20):
+        """(distance_km, ping) pairs for drivers seen recently within radius_km, nearest first
+
+        limit=None returns every driver in the radius.
+        """
+        cutoff = time.time() - self.stale_after
+        results = []
+        with self._cond:
+            for distance, driver_id in self.grid.nearby(latitude, longitude, radius_km):
+                ping = self.latest[driver_id]
+                if ping.recorded_at >= cutoff:
+                    results.append((distance, ping))
+                    if limit and len(results) >= limit:
+                        break
+        return results
+
+    def evict_stale(self):
+        """Forget drivers that have not pinged within stale_after; returns how many"""
+        cutoff = time.time() - self.stale_after
+        with self._cond:
+            stale = [driver_id for driver_id, ping in self.latest.items() if ping.recorded_at < cutoff]
+            for driver_id in stale:
+                del self.latest[driver_id]
+                self.tracks.pop(driver_id, None)
+                self.grid.remove(driver_id)
+        return len(stale)
+
+    def _run(self):
+        last_eviction = time.monotonic()
+        while True:
+            with self._cond:
+                if len(self._pending) < self.flush_batch:
+                    self._cond.wait(self.flush_interval)
+            try:
+                self.flush()
+                if time.monotonic() - last_eviction >= self.stale_after:
+                    self.evict_stale()
+                    last_eviction = time.monotonic()
+            except Exception as e:
+                print(f"❌ Driver location flusher error: {str(e)}")
+
+    def flush(self):
+        """Hand every pending ping to persist(); failed batches are kept for the next flush"""
+        with self._flush_lock:
+            with self._cond:
+                batch, self._pending = self._pending, []
+            if not batch:
+                return 0
+
+            started = time.monotonic()
+            try:
+                self.persist(batch)
+            except Exception as e:
+                with self._cond:
+                    self.flush_errors += 1
+                    # Keep the oldest pings first; beyond max_pending the oldest are dropped
+                    self._pending = (batch + self._pending)[-self.max_pending:]
+                print(f"❌ Failed to persist {len(batch)} driver locations: {str(e)}")
+                return 0
+
+            with self._cond:
+                self.flushes += 1
+                self.pings_persisted += len(batch)
+                self.flush_time_total += time.monotonic() - started
+            return len(batch)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "drivers_tracked": len(self.latest),
+                "grid_cells": len(self.grid.cells),
+                "pending_pings": len(self._pending),
+                "pings_received": self.pings_received,
+                "pings_persisted": self.pings_persisted,
+                "flushes": self.flushes,
+                "flush_errors": self.flush_errors,
+                "avg_flush_ms": round(self.flush_time_total / self.flushes * 1000, 2) if self.flushes else 0.0,
+            }
\ No newline at end of file
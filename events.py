@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+MsosiHub Event Bus
+In-process publish/subscribe with a replay buffer per channel, streamed to browsers as Server-Sent Events
+"""
+
+import os
+import json
+import time
+import threading
+from collections import deque
+
+
+class Event:
+    """One published event; the id orders events across every channel of the bus"""
+    __slots__ = ("id", "type", "data")
+
+    def __init__(self, id, type, data):
+        self.id = id
+        self.type = type
+        self.data = data
+
+    def to_sse(self):
+        return f"id: {self.id}\nevent: {self.type}\ndata: {json.dumps(self.data)}\n\n"
+
+
+class ChannelLog:
+    """The last events of one channel, plus the newest id that is no longer retained"""
+    __slots__ = ("events", "floor", "subscribers", "last_published")
+
+    def __init__(self, history, floor):
+        self.events = deque(maxlen=history)
+        self.floor = floor  # events with an id <= floor may have been missed
+        self.subscribers = set()
+        self.last_published = time.monotonic()
+
+
+class Subscription:
+    """A listener on one or more channels; wait() blocks until something is published to them"""
+
+    def __init__(self, bus, channels):
+        self.bus = bus
+        self.channels = tuple(channels)
+        self.wakeup = threading.Event()
+
+    def wait(self, after_id, timeout):
+        """Events newer than after_id, waiting up to timeout seconds for the first one
+
+        If after_id is older than what the channels still retain, a single 'resync'
+        event is returned instead: the client must refetch its state.
+        """
+        self.wakeup.clear()
+        events = self.bus.since(self.channels, after_id)
+        if events:
+            return events
+        self.wakeup.wait(timeout)
+        return self.bus.since(self.channels, after_id)
+
+    def close(self):
+        self.bus.unsubscribe(self)
+
+
+class EventBus:
+    """Fan-out of application events to subscribers of named channels
+
+    Each channel keeps its last `history` events so a reconnecting client can resume
+    from its Last-Event-ID. Ids start from the wall clock in milliseconds, so they keep
+    increasing across restarts and a client resuming from a previous process's id gets
+    a resync rather than silence. The bus lives in the worker process, like the page
+    cache: publish and subscribe must happen in the same one.
+    """
+
+    def __init__(self, history=None, idle_retention=None):
+        self.history = history or int(os.getenv('EVENT_BUS_HISTORY', 100))
+        self.idle_retention = idle_retention if idle_retention is not None else float(os.getenv('EVENT_BUS_RETENTION', 3600))
+        self.channels = {}
+        self.lock = threading.Lock()
+        self.start_id = int(time.time() * 1000)
+        self.last_id = self.start_id
+        self.pruned_floor = self.start_id  # floor for channels whose log was pruned or never existed
+        self.published = 0
+        self.delivered = 0
+        self.resyncs = 0
+
+    def publish(self, channels, event_type, data):
+        """Append an event to each channel's log and wake their subscribers"""
+        with self.lock:
+            self.last_id += 1
+            event = Event(self.last_id, event_type, data)
+            subscribers = set()
+            for channel in channels:
+                log = self.channels.get(channel)
+                if log is None:
+                    log = self.channels[channel] = ChannelLog(self.history, self.pruned_floor)
+                if len(log.events) == log.events.maxlen:
+                    log.floor = log.events[0].id
+                log.events.append(event)
+                log.last_published = time.monotonic()
+                subscribers |= log.subscribers
+            self.published += 1
+            if self.published % 1000 == 0:
+                self._prune()
+
+        for subscription in subscribers:
+            subscription.wakeup.set()
+        return event
+
+    def since(self, channels, after_id):
+        """Events on any of channels with an id above after_id, oldest first"""
+        with self.lock:
+            events = {}
+            for channel in channels:
+                log = self.channels.get(channel)
+                floor = log.floor if log is not None else self.pruned_floor
+                if after_id < floor:
+                    self.resyncs += 1
+                    return [Event(self.last_id, "resync", {"channels": list(channels)})]
+                if log is not None:
+                    for event in reversed(log.events):
+                        if event.id <= after_id:
+                            break
+                        events[event.id] = event
+            self.delivered += len(events)
+        return [events[event_id] for event_id in sorted(events)]
+
+    def subscribe(self, channels):
+        subscription = Subscription(self, channels)
+        with self.lock:
+            for channel in subscription.channels:
+                log = self.channels.get(channel)
+                if log is None:
+                    log = self.channels[channel] = ChannelLog(self.history, self.pruned_floor)
+                log.subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            for channel in subscription.channels:
+                log = self.channels.get(channel)
+                if log is not None:
+                    log.subscribers.discard(subscription)
+
+    def _prune(self):
+        """Drop logs of channels nobody listens to that have been quiet for idle_retention"""
+        cutoff = time.monotonic() - self.idle_retention
+        for channel, log in list(self.channels.items()):
+            if not log.subscribers and log.last_published < cutoff:
+                if log.events:
+                    self.pruned_floor = max(self.pruned_floor, log.events[-1].id)
+                del self.channels[channel]
+
+    def stats(self):
+        with self.lock:
+            return {
+                "channels": len(self.channels),
+                "subscribers": sum(len(log.subscribers) for log in self.channels.values()),
+                "last_id": self.last_id,
+                "published": self.published,
+                "delivered": self.delivered,
+                "resyncs": self.resyncs,
+            }
+
+
+class StreamLimiter:
+    """Caps the streams one worker holds open, since each ties up a server thread
+
+    acquire() refuses once `limit` streams are open, so the remaining threads stay
+    free for ordinary requests; release() is called when a stream's response closes.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.open = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            if self.open >= self.limit:
+                self.rejected += 1
+                return False
+            self.open += 1
+            return True
+
+    def release(self):
+        with self.lock:
+            self.open -= 1
+
+    def stats(self):
+        with self.lock:
+            return {"open": self.open, "limit": self.limit, "rejected": self.rejected}
+
+
+event_bus = EventBus()
\ No newline at end of file
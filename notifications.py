@@ -11,75 +11,39 @@ from email.mime.base import MIMEBase
 from email import encoders
 from datetime import datetime
 import os
+import queue
+import threading
+import time
+import atexit
+from functools import lru_cache
+from jinja2 import Environment, DictLoader
+from markupsafe import Markup
+from html import escape as html_escape
 from flask import current_app
 
-class EmailNotificationService:
-    def __init__(self):
-        # Email configuration - can be set via environment variables
-        self.smtp_server = os.environ.get('SMTP_SERVER', 'smtp.gmail.com')
-        self.smtp_port = int(os.environ.get('SMTP_PORT', '587'))
-        self.email_user = os.environ.get('EMAIL_USER', 'msosihub@gmail.com')
-        self.email_password = os.environ.get('EMAIL_PASSWORD', 'your-app-password')
-        self.from_name = "MsosiHub Tanzania"
-        
-    def send_email(self, to_email, subject, html_content, text_content=None):
-        """Send HTML email with fallback text content"""
-        try:
-            # Create message
-            msg = MIMEMultipart('alternative')
-            msg['From'] = f"{self.from_name} <{self.email_user}>"
-            msg['To'] = to_email
-            msg['Subject'] = subject
-            
-            # Add text version if provided
-            if text_content:
-                text_part = MIMEText(text_content, 'plain', 'utf-8')
-                msg.attach(text_part)
-            
-            # Add HTML version
-            html_part = MIMEText(html_content, 'html', 'utf-8')
-            msg.attach(html_part)
-            
-            # Send email
-            server = smtplib.SMTP(self.smtp_server, self.smtp_port)
-            server.starttls()
-            server.login(self.email_user, self.email_password)
-            server.send_message(msg)
-            server.quit()
-            
-            print(f"✅ Email sent successfully to {to_email}: {subject}")
-            return {'success': True, 'message': 'Email sent successfully'}
-            
-        except Exception as e:
-            print(f"❌ Failed to send email to {to_email}: {str(e)}")
-            return {'success': False, 'error': str(e)}
-    
-    def get_email_template(self, template_type, **kwargs):
-        """Generate HTML email templates"""
-        
-        # Common header and footer
-        header = f"""
+# Email templates - compiled once at import time instead of rebuilt on every send
+EMAIL_HEADER = """
         <!DOCTYPE html>
         <html lang="en">
         <head>
             <meta charset="UTF-8">
             <meta name="viewport" content="width=device-width, initial-scale=1.0">
-            <title>MsosiHub - {kwargs.get('title', 'Notification')}</title>
+            <title>MsosiHub - {{ title }}</title>
             <style>
-                body {{ font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif; margin: 0; padding: 0; background-color: #f8f9fa; }}
-                .container {{ max-width: 600px; margin: 0 auto; background-color: white; }}
-                .header {{ background: linear-gradient(135deg, #2C5F41 0%, #21AC78 100%); color: white; padding: 30px 20px; text-align: center; }}
-                .content {{ padding: 30px 20px; }}
-                .footer {{ background-color: #f8f9fa; padding: 20px; text-align: center; color: #6c757d; font-size: 14px; }}
-                .btn {{ display: inline-block; padding: 12px 24px; background-color: #21AC78; color: white; text-decoration: none; border-radius: 25px; font-weight: bold; }}
-                .btn:hover {{ background-color: #2C5F41; }}
-                .order-summary {{ background-color: #f8f9fa; padding: 20px; border-radius: 10px; margin: 20px 0; }}
-                .status-badge {{ display: inline-block; padding: 5px 15px; border-radius: 15px; font-size: 12px; font-weight: bold; text-transform: uppercase; }}
-                .status-confirmed {{ background-color: #d4edda; color: #155724; }}
-                .status-preparing {{ background-color: #cce7ff; color: #004085; }}
-                .status-ready {{ background-color: #d1ecf1; color: #0c5460; }}
-                .status-delivered {{ background-color: #d4edda; color: #155724; }}
-                .highlight {{ background-color: #fff3cd; padding: 15px; border-radius: 8px; border-left: 4px solid #ffc107; }}
+                body { font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif; margin: 0; padding: 0; background-color: #f8f9fa; }
+                .container { max-width: 600px; margin: 0 auto; background-color: white; }
+                .header { background: linear-gradient(135deg, #2C5F41 0%, #21AC78 100%); color: white; padding: 30px 20px; text-align: center; }
+                .content { padding: 30px 20px; }
+                .footer { background-color: #f8f9fa; padding: 20px; text-align: center; color: #6c757d; font-size: 14px; }
+                .btn { display: inline-block; padding: 12px 24px; background-color: #21AC78; color: white; text-decoration: none; border-radius: 25px; font-weight: bold; }
+                .btn:hover { background-color: #2C5F41; }
+                .order-summary { background-color: #f8f9fa; padding: 20px; border-radius: 10px; margin: 20px 0; }
+                .status-badge { display: inline-block; padding: 5px 15px; border-radius: 15px; font-size: 12px; font-weight: bold; text-transform: uppercase; }
+                .status-confirmed { background-color: #d4edda; color: #155724; }
+                .status-preparing { background-color: #cce7ff; color: #004085; }
+                .status-ready { background-color: #d1ecf1; color: #0c5460; }
+                .status-delivered { background-color: #d4edda; color: #155724; }
+                .highlight { background-color: #fff3cd; padding: 15px; border-radius: 8px; border-left: 4px solid #ffc107; }
             </style>
         </head>
         <body>
@@ -90,8 +54,8 @@ class EmailNotificationService:
                 </div>
                 <div class="content">
         """
-        
-        footer = f"""
+
+EMAIL_FOOTER = """
                 </div>
                 <div class="footer">
                     <p><strong>MsosiHub Tanzania</strong></p>
@@ -106,12 +70,11 @@ class EmailNotificationService:
         </body>
         </html>
         """
-        
-        # Template content based on type
-        if template_type == 'welcome':
-            content = f"""
+
+EMAIL_TEMPLATES = {
+    'welcome': """
                 <h2>Welcome to MsosiHub! 🎉</h2>
-                <p>Dear {kwargs.get('name', 'Valued Customer')},</p>
+                <p>Dear {{ name or 'Valued Customer' }},</p>
                 <p>Thank you for joining MsosiHub, Tanzania's premier healthy food delivery platform!</p>
                 
                 <div class="highlight">
@@ -133,32 +96,16 @@ class EmailNotificationService:
                 
                 <p>Stay healthy, stay happy!</p>
                 <p><strong>The MsosiHub Team</strong></p>
-            """
-            
-        elif template_type == 'order_confirmation':
-            order = kwargs.get('order')
-            items = kwargs.get('items', [])
-            restaurant = kwargs.get('restaurant')
-            
-            items_html = ""
-            for item in items:
-                items_html += f"""
-                    <tr>
-                        <td>{item['name']}</td>
-                        <td style="text-align: center;">{item['quantity']}</td>
-                        <td style="text-align: right;">TZS {item['price']:,.0f}</td>
-                        <td style="text-align: right; font-weight: bold;">TZS {item['total']:,.0f}</td>
-                    </tr>
-                """
-            
-            content = f"""
+            """,
+    
+    'order_confirmation': """
                 <h2>Order Confirmed! 🎉</h2>
-                <p>Dear {kwargs.get('customer_name')},</p>
+                <p>Dear {{ customer_name }},</p>
                 <p>Your healthy meal order has been confirmed and is being prepared with care.</p>
                 
                 <div class="order-summary">
-                    <h3>Order #{order['id']}</h3>
-                    <p><strong>Restaurant:</strong> {restaurant['name']}</p>
+                    <h3>Order #{{ order.id }}</h3>
+                    <p><strong>Restaurant:</strong> {{ restaurant.name }}</p>
                     <p><strong>Estimated Delivery:</strong> 25-30 minutes</p>
                     <p><strong>Status:</strong> <span class="status-badge status-confirmed">Confirmed</span></p>
                     
@@ -172,21 +119,21 @@ class EmailNotificationService:
                             </tr>
                         </thead>
                         <tbody>
-                            {items_html}
+                            {{ items|order_item_rows }}
                         </tbody>
                     </table>
                     
                     <div style="text-align: right; border-top: 2px solid #21AC78; padding-top: 10px;">
-                        <p><strong>Subtotal: TZS {order['subtotal']:,.0f}</strong></p>
+                        <p><strong>Subtotal: TZS {{ order.subtotal|tzs }}</strong></p>
                         <p><strong>Delivery Fee: TZS 2,000</strong></p>
-                        <p style="font-size: 18px; color: #21AC78;"><strong>Total Paid: TZS {order['total']:,.0f}</strong></p>
+                        <p style="font-size: 18px; color: #21AC78;"><strong>Total Paid: TZS {{ order.total|tzs }}</strong></p>
                     </div>
                 </div>
                 
                 <div class="highlight">
                     <h4>📍 Delivery Details</h4>
-                    <p><strong>Address:</strong> {order['delivery_address']}</p>
-                    <p><strong>Phone:</strong> {order['phone']}</p>
+                    <p><strong>Address:</strong> {{ order.delivery_address }}</p>
+                    <p><strong>Phone:</strong> {{ order.phone }}</p>
                 </div>
                 
                 <p style="text-align: center; margin: 30px 0;">
@@ -194,53 +141,37 @@ class EmailNotificationService:
                 </p>
                 
                 <p>Thank you for choosing healthy eating with MsosiHub!</p>
-            """
-            
-        elif template_type == 'order_status_update':
-            order_id = kwargs.get('order_id')
-            status = kwargs.get('status')
-            customer_name = kwargs.get('customer_name')
-            
-            status_messages = {
-                'confirmed': ('Order Confirmed! 👨‍🍳', 'Your order has been confirmed and the restaurant is preparing your healthy meal.'),
-                'preparing': ('Cooking in Progress! 🔥', 'Your delicious healthy meal is being freshly prepared by our chef.'),
-                'ready': ('Order Ready! ✅', 'Your order is ready and waiting for our delivery driver to pick it up.'),
-                'out_for_delivery': ('On the Way! 🏍️', 'Your healthy meal is out for delivery and will arrive soon!'),
-                'delivered': ('Delivered! 🎉', 'Your order has been delivered. Enjoy your healthy meal!')
-            }
-            
-            title, message = status_messages.get(status, ('Order Updated', 'Your order status has been updated.'))
-            
-            content = f"""
-                <h2>{title}</h2>
-                <p>Dear {customer_name},</p>
-                <p>{message}</p>
+            """,
+    
+    'order_status_update': """
+                <h2>{{ status_title }}</h2>
+                <p>Dear {{ customer_name }},</p>
+                <p>{{ status_message }}</p>
                 
                 <div class="order-summary">
-                    <h3>Order #{order_id}</h3>
-                    <p><strong>Status:</strong> <span class="status-badge status-{status}">{status.replace('_', ' ').title()}</span></p>
-                    <p><strong>Updated:</strong> {datetime.now().strftime('%B %d, %Y at %I:%M %p')}</p>
+                    <h3>Order #{{ order_id }}</h3>
+                    <p><strong>Status:</strong> <span class="status-badge status-{{ status }}">{{ status.replace('_', ' ').title() }}</span></p>
+                    <p><strong>Updated:</strong> {{ now.strftime('%B %d, %Y at %I:%M %p') }}</p>
                 </div>
                 
-                {"<p>🍽️ <strong>Enjoy your healthy meal and thank you for choosing MsosiHub!</strong></p>" if status == 'delivered' else ""}
+                {% if status == 'delivered' %}<p>🍽️ <strong>Enjoy your healthy meal and thank you for choosing MsosiHub!</strong></p>{% endif %}
                 
                 <p style="text-align: center; margin: 30px 0;">
                     <a href="http://localhost:5000/my_orders" class="btn">View Order Details</a>
                 </p>
-            """
-            
-        elif template_type == 'wallet_recharge':
-            content = f"""
+            """,
+    
+    'wallet_recharge': """
                 <h2>Wallet Recharged! 💰</h2>
-                <p>Dear {kwargs.get('customer_name')},</p>
+                <p>Dear {{ customer_name }},</p>
                 <p>Your MsosiHub wallet has been successfully recharged.</p>
                 
                 <div class="order-summary">
                     <h3>Recharge Details</h3>
-                    <p><strong>Amount Added:</strong> TZS {kwargs.get('amount'):,.0f}</p>
-                    <p><strong>New Balance:</strong> TZS {kwargs.get('new_balance'):,.0f}</p>
-                    <p><strong>Payment Method:</strong> {kwargs.get('payment_method', 'Mobile Money')}</p>
-                    <p><strong>Date:</strong> {datetime.now().strftime('%B %d, %Y at %I:%M %p')}</p>
+                    <p><strong>Amount Added:</strong> TZS {{ amount|tzs }}</p>
+                    <p><strong>New Balance:</strong> TZS {{ new_balance|tzs }}</p>
+                    <p><strong>Payment Method:</strong> {{ payment_method or 'Mobile Money' }}</p>
+                    <p><strong>Date:</strong> {{ now.strftime('%B %d, %Y at %I:%M %p') }}</p>
                 </div>
                 
                 <p>You're all set to order more healthy meals!</p>
@@ -248,12 +179,11 @@ class EmailNotificationService:
                 <p style="text-align: center; margin: 30px 0;">
                     <a href="http://localhost:5000/restaurants" class="btn">Order Healthy Food</a>
                 </p>
-            """
-            
-        elif template_type == 'restaurant_welcome':
-            content = f"""
+            """,
+    
+    'restaurant_welcome': """
                 <h2>Welcome to MsosiHub Partner Network! 🏪</h2>
-                <p>Dear {kwargs.get('restaurant_name')} Team,</p>
+                <p>Dear {{ restaurant_name }} Team,</p>
                 <p>Congratulations! Your restaurant has been successfully registered with MsosiHub.</p>
                 
                 <div class="highlight">
@@ -275,12 +205,11 @@ class EmailNotificationService:
                 
                 <p>Welcome to the MsosiHub family!</p>
                 <p><strong>The MsosiHub Team</strong></p>
-            """
-            
-        elif template_type == 'driver_welcome':
-            content = f"""
+            """,
+    
+    'driver_welcome': """
                 <h2>Welcome to MsosiHub Delivery Team! 🏍️</h2>
-                <p>Dear {kwargs.get('name', 'Valued Driver')},</p>
+                <p>Dear {{ name or 'Valued Driver' }},</p>
                 <p>Congratulations! You've joined MsosiHub as a delivery driver and are now part of our mission to deliver healthy food across Tanzania!</p>
                 
                 <div class="highlight">
@@ -312,36 +241,28 @@ class EmailNotificationService:
                 
                 <p>Welcome to the MsosiHub delivery family!</p>
                 <p><strong>The MsosiHub Team</strong></p>
-            """
-            
-        elif template_type == 'new_order_restaurant':
-            order = kwargs.get('order')
-            items = kwargs.get('items', [])
-            
-            items_html = ""
-            for item in items:
-                items_html += f"<li>{item['quantity']}x {item['name']} - TZS {item['total']:,.0f}</li>"
-            
-            content = f"""
+            """,
+    
+    'new_order_restaurant': """
                 <h2>New Order Received! 📝</h2>
                 <p>Dear Restaurant Team,</p>
                 <p>You have received a new healthy meal order that needs preparation.</p>
                 
                 <div class="order-summary">
-                    <h3>Order #{order['id']}</h3>
-                    <p><strong>Customer:</strong> {kwargs.get('customer_name')}</p>
-                    <p><strong>Phone:</strong> {order['phone']}</p>
-                    <p><strong>Order Time:</strong> {datetime.now().strftime('%I:%M %p')}</p>
+                    <h3>Order #{{ order.id }}</h3>
+                    <p><strong>Customer:</strong> {{ customer_name }}</p>
+                    <p><strong>Phone:</strong> {{ order.phone }}</p>
+                    <p><strong>Order Time:</strong> {{ now.strftime('%I:%M %p') }}</p>
                     <p><strong>Target Prep Time:</strong> 25-30 minutes</p>
                     
                     <h4>Items to Prepare:</h4>
-                    <ul>{items_html}</ul>
+                    <ul>{{ items|order_item_list }}</ul>
                     
-                    <p style="font-size: 18px; color: #21AC78;"><strong>Total: TZS {order['total']:,.0f}</strong></p>
+                    <p style="font-size: 18px; color: #21AC78;"><strong>Total: TZS {{ order.total|tzs }}</strong></p>
                 </div>
                 
                 <div class="highlight">
-                    <p><strong>Special Instructions:</strong> {order.get('special_instructions', 'None')}</p>
+                    <p><strong>Special Instructions:</strong> {{ order.get('special_instructions', 'None') }}</p>
                 </div>
                 
                 <p style="text-align: center; margin: 30px 0;">
@@ -349,16 +270,356 @@ class EmailNotificationService:
                 </p>
                 
                 <p>Please confirm and start preparation as soon as possible!</p>
-            """
-            
-        else:
-            content = f"""
+            """,
+    
+    'new_order_digest': """
+                <h2>{{ events|length }} New Orders Received! 📝</h2>
+                <p>Dear Restaurant Team,</p>
+                <p>You have received {{ events|length }} new healthy meal orders that need preparation.</p>
+                
+                {% for event in events %}
+                <div class="order-summary">
+                    <h3>Order #{{ event['order']['id'] }}</h3>
+                    <p><strong>Customer:</strong> {{ event['customer_name'] }}</p>
+                    <p><strong>Phone:</strong> {{ event['order']['phone'] }}</p>
+                    <p><strong>Order Time:</strong> {{ event['event_time'] }}</p>
+                    
+                    <h4>Items to Prepare:</h4>
+                    <ul>{{ event['items']|order_item_list }}</ul>
+                    
+                    <p><strong>Special Instructions:</strong> {{ event['order'].get('special_instructions', 'None') }}</p>
+                    <p style="font-size: 18px; color: #21AC78;"><strong>Total: TZS {{ event['order']['total']|tzs }}</strong></p>
+                </div>
+                {% endfor %}
+                
+                <p style="text-align: center; margin: 30px 0;">
+                    <a href="http://localhost:5000/restaurant_dashboard" class="btn">Manage Orders</a>
+                </p>
+                
+                <p>Please confirm and start preparation as soon as possible!</p>
+            """,
+    
+    'order_status_digest': """
+                <h2>Your Order Updates 📦</h2>
+                <p>Dear {{ customer_name }},</p>
+                <p>Here is everything that happened with your orders in the last few minutes.</p>
+                
+                <div class="order-summary">
+                    <table style="width: 100%; border-collapse: collapse; margin: 20px 0;">
+                        <thead>
+                            <tr style="background-color: #e9ecef;">
+                                <th style="padding: 10px; text-align: left;">Order</th>
+                                <th style="padding: 10px; text-align: left;">Status</th>
+                                <th style="padding: 10px; text-align: right;">Time</th>
+                            </tr>
+                        </thead>
+                        <tbody>
+                            {% for event in events %}
+                            <tr>
+                                <td>#{{ event['order_id'] }}</td>
+                                <td><span class="status-badge status-{{ event['status'] }}">{{ event['status'].replace('_', ' ').title() }}</span></td>
+                                <td style="text-align: right;">{{ event['event_time'] }}</td>
+                            </tr>
+                            {% endfor %}
+                        </tbody>
+                    </table>
+                </div>
+                
+                {% if events|selectattr('status', 'equalto', 'delivered')|list %}<p>🍽️ <strong>Enjoy your healthy meal and thank you for choosing MsosiHub!</strong></p>{% endif %}
+                
+                <p style="text-align: center; margin: 30px 0;">
+                    <a href="http://localhost:5000/my_orders" class="btn">View Order Details</a>
+                </p>
+            """,
+    
+    'notification': """
                 <h2>MsosiHub Notification</h2>
                 <p>You have received a notification from MsosiHub.</p>
-                <p>{kwargs.get('message', 'No message provided.')}</p>
+                <p>{{ message or 'No message provided.' }}</p>
             """
+}
+
+ORDER_STATUS_MESSAGES = {
+    'confirmed': ('Order Confirmed! 👨‍🍳', 'Your order has been confirmed and the restaurant is preparing your healthy meal.'),
+    'preparing': ('Cooking in Progress! 🔥', 'Your delicious healthy meal is being freshly prepared by our chef.'),
+    'ready': ('Order Ready! ✅', 'Your order is ready and waiting for our delivery driver to pick it up.'),
+    'out_for_delivery': ('On the Way! 🏍️', 'Your healthy meal is out for delivery and will arrive soon!'),
+    'delivered': ('Delivered! 🎉', 'Your order has been delivered. Enjoy your healthy meal!')
+}
+
+# Item rows are the only part that grows with the order, so they skip the Jinja
+# loop machinery and are built from a plain format string in a single join
+ORDER_ITEM_ROW = """
+                    <tr>
+                        <td>{name}</td>
+                        <td style="text-align: center;">{quantity}</td>
+                        <td style="text-align: right;">TZS {price:,.0f}</td>
+                        <td style="text-align: right; font-weight: bold;">TZS {total:,.0f}</td>
+                    </tr>
+                """
+
+ORDER_ITEM_LIST_ENTRY = "<li>{quantity}x {name} - TZS {total:,.0f}</li>"
+
+def format_tzs(value):
+    """Jinja filter: 12345.6 -> '12,346'"""
+    return f"{value:,.0f}"
+
+def render_order_item_rows(items):
+    """Jinja filter: order items as <tr> rows for the confirmation table"""
+    row = ORDER_ITEM_ROW.format
+    return Markup("".join([
+        row(name=html_escape(str(item['name'])), quantity=int(item['quantity']), price=item['price'], total=item['total'])
+        for item in items or []
+    ]))
+
+def render_order_item_list(items):
+    """Jinja filter: order items as <li> entries for the restaurant's prep list"""
+    entry = ORDER_ITEM_LIST_ENTRY.format
+    return Markup("".join([
+        entry(name=html_escape(str(item['name'])), quantity=int(item['quantity']), total=item['total'])
+        for item in items or []
+    ]))
+
+email_template_env = Environment(
+    loader=DictLoader(EMAIL_TEMPLATES),
+    autoescape=True,
+    keep_trailing_newline=True
+)
+email_template_env.filters['tzs'] = format_tzs
+email_template_env.filters['order_item_rows'] = render_order_item_rows
+email_template_env.filters['order_item_list'] = render_order_item_list
+
+# Parsed and compiled to Python once; rendering is just a call
+compiled_email_templates = {name: email_template_env.get_template(name) for name in EMAIL_TEMPLATES}
+compiled_email_header = email_template_env.from_string(EMAIL_HEADER)
+
+# The footer never changes, so it is rendered exactly once
+rendered_email_footer = email_template_env.from_string(EMAIL_FOOTER).render()
+
+@lru_cache(maxsize=32)
+def render_email_header(title):
+    """The header only varies by title, and there is a handful of those"""
+    return compiled_email_header.render(title=title)
+
+class SMTPConnectionPool:
+    """Keeps authenticated SMTP sessions alive so connect/TLS/login is paid once per session"""
+    
+    def __init__(self, server, port, user, password, use_tls=True, max_size=4,
+                 max_messages=100, max_idle=300, health_check_after=30, timeout=30):
+        self.server = server
+        self.port = port
+        self.user = user
+        self.password = password
+        self.use_tls = use_tls
+        self.max_size = max_size
+        self.max_messages = max_messages
+        self.max_idle = max_idle
+        self.health_check_after = health_check_after
+        self.timeout = timeout
+        self._idle = []
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        
+        # Counters
+        self.connections_opened = 0
+        self.connections_reused = 0
+        self.health_checks_failed = 0
+    
+    def _connect(self):
+        """Open a new session and pay the connect/STARTTLS/login cost"""
+        conn = smtplib.SMTP(self.server, self.port, timeout=self.timeout)
+        if self.use_tls:
+            conn.starttls()
+        conn.login(self.user, self.password)
+        with self._lock:
+            self.connections_opened += 1
+        return {'conn': conn, 'last_used': time.monotonic(), 'sent': 0}
+    
+    def _close(self, entry):
+        try:
+            entry['conn'].quit()
+        except Exception:
+            try:
+                entry['conn'].close()
+            except Exception:
+                pass
+    
+    def _is_healthy(self, entry):
+        """Cheap NOOP round trip for sessions that sat idle long enough to be dropped"""
+        idle_for = time.monotonic() - entry['last_used']
+        if idle_for > self.max_idle:
+            return False
+        if idle_for < self.health_check_after:
+            return True
+        try:
+            return entry['conn'].noop()[0] == 250
+        except Exception:
+            return False
+    
+    def acquire(self):
+        """Get an authenticated session, reusing an idle one when it is still healthy"""
+        while True:
+            with self._lock:
+                if self._pid != os.getpid():
+                    # Sockets must not be shared with a forked parent process
+                    self._idle = []
+                    self._pid = os.getpid()
+                entry = self._idle.pop() if self._idle else None
+            
+            if entry is None:
+                return self._connect()
+            
+            if self._is_healthy(entry):
+                with self._lock:
+                    self.connections_reused += 1
+                return entry
+            
+            with self._lock:
+                self.health_checks_failed += 1
+            self._close(entry)
+    
+    def release(self, entry, healthy=True):
+        """Return a session to the pool, closing it if it is broken, worn out or surplus"""
+        entry['last_used'] = time.monotonic()
+        if healthy and entry['sent'] < self.max_messages:
+            with self._lock:
+                if len(self._idle) < self.max_size and self._pid == os.getpid():
+                    self._idle.append(entry)
+                    return
+        self._close(entry)
+    
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for entry in idle:
+            self._close(entry)
+    
+    def stats(self):
+        with self._lock:
+            return {
+                'idle_connections': len(self._idle),
+                'connections_opened': self.connections_opened,
+                'connections_reused': self.connections_reused,
+                'health_checks_failed': self.health_checks_failed
+            }
+
+class EmailNotificationService:
+    def __init__(self):
+        # Email configuration - can be set via environment variables
+        self.smtp_server = os.environ.get('SMTP_SERVER', 'smtp.gmail.com')
+        self.smtp_port = int(os.environ.get('SMTP_PORT', '587'))
+        self.email_user = os.environ.get('EMAIL_USER', 'msosihub@gmail.com')
+        self.email_password = os.environ.get('EMAIL_PASSWORD', 'your-app-password')
+        self.from_name = "MsosiHub Tanzania"
+        
+        # Pooled SMTP sessions shared by the outbox workers
+        self.pool = SMTPConnectionPool(
+            self.smtp_server,
+            self.smtp_port,
+            self.email_user,
+            self.email_password,
+            use_tls=os.environ.get('SMTP_USE_TLS', '1') != '0',
+            max_size=int(os.environ.get('SMTP_POOL_SIZE', os.environ.get('EMAIL_WORKERS', '4'))),
+            max_messages=int(os.environ.get('SMTP_MAX_MESSAGES_PER_CONNECTION', '100'))
+        )
+        
+    def build_message(self, to_email, subject, html_content, text_content=None):
+        """Build the MIME message for an HTML email with fallback text content"""
+        msg = MIMEMultipart('alternative')
+        msg['From'] = f"{self.from_name} <{self.email_user}>"
+        msg['To'] = to_email
+        msg['Subject'] = subject
+        
+        # Add text version if provided
+        if text_content:
+            text_part = MIMEText(text_content, 'plain', 'utf-8')
+            msg.attach(text_part)
+        
+        # Add HTML version
+        html_part = MIMEText(html_content, 'html', 'utf-8')
+        msg.attach(html_part)
+        
+        return msg
+    
+    def send_email(self, to_email, subject, html_content, text_content=None):
+        """Send HTML email with fallback text content"""
+        return self.send_many([{
+            'to': to_email,
+            'subject': subject,
+            'html': html_content,
+            'text': text_content
+        }])[0]
+    
+    def send_many(self, messages):
+        """Send several emails over one pooled SMTP session
+        
+        messages is a list of dicts with 'to', 'subject', 'html' and optional 'text'.
+        Returns one result dict per message, in the same order.
+        """
+        results = []
+        entry = None
+        
+        for message in messages:
+            to_email = message['to']
+            subject = message['subject']
+            
+            try:
+                msg = self.build_message(to_email, subject, message['html'], message.get('text'))
+            except Exception as e:
+                print(f"❌ Failed to send email to {to_email}: {str(e)}")
+                results.append({'success': False, 'error': str(e)})
+                continue
+            
+            # One reconnect per message if the session died under us
+            for attempt in range(2):
+                try:
+                    if entry is None:
+                        entry = self.pool.acquire()
+                    entry['conn'].send_message(msg)
+                    entry['sent'] += 1
+                    
+                    print(f"✅ Email sent successfully to {to_email}: {subject}")
+                    results.append({'success': True, 'message': 'Email sent successfully'})
+                    break
+                    
+                except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError) as e:
+                    # The server rejected this message but the session is still usable
+                    print(f"❌ Failed to send email to {to_email}: {str(e)}")
+                    results.append({'success': False, 'error': str(e)})
+                    break
+                    
+                except Exception as e:
+                    if entry is not None:
+                        self.pool.release(entry, healthy=False)
+                        entry = None
+                    if attempt == 1 or not isinstance(e, (smtplib.SMTPServerDisconnected, OSError)):
+                        print(f"❌ Failed to send email to {to_email}: {str(e)}")
+                        results.append({'success': False, 'error': str(e)})
+                        break
+            
+            # Rotate sessions that have carried their share of messages
+            if entry is not None and entry['sent'] >= self.pool.max_messages:
+                self.pool.release(entry)
+                entry = None
+        
+        if entry is not None:
+            self.pool.release(entry)
         
-        return header + content + footer
+        return results
+    
+    def get_email_template(self, template_type, **kwargs):
+        """Render an HTML email from the precompiled templates"""
+        template = compiled_email_templates.get(template_type, compiled_email_templates['notification'])
+        
+        context = dict(kwargs)
+        context['now'] = datetime.now()
+        if template_type == 'order_status_update':
+            context['status_title'], context['status_message'] = ORDER_STATUS_MESSAGES.get(
+                kwargs.get('status'), ('Order Updated', 'Your order status has been updated.')
+            )
+        
+        header = render_email_header(kwargs.get('title', 'Notification'))
+        return header + template.render(context) + rendered_email_footer
     
     # Specific notification methods
     def send_welcome_email(self, user_email, user_name):
@@ -444,63 +705,299 @@ class EmailNotificationService:
             title='New Order'
         )
         return self.send_email(restaurant_email, subject, html_content)
+    
+    def send_new_order_digest(self, restaurant_email, events):
+        """Send several new orders to a restaurant in one email"""
+        subject = f"{len(events)} New Orders - Prepare Now! 📝"
+        html_content = self.get_email_template(
+            'new_order_digest',
+            events=events,
+            title='New Orders'
+        )
+        return self.send_email(restaurant_email, subject, html_content)
+    
+    def send_order_status_digest(self, user_email, customer_name, events):
+        """Send several order status changes to a customer in one email"""
+        order_ids = sorted({event['order_id'] for event in events})
+        if len(order_ids) == 1:
+            subject = f"Order #{order_ids[0]} - {len(events)} Status Updates"
+        else:
+            subject = f"{len(events)} Updates on Your Orders - MsosiHub"
+        html_content = self.get_email_template(
+            'order_status_digest',
+            customer_name=customer_name,
+            events=events,
+            title='Order Updates'
+        )
+        return self.send_email(user_email, subject, html_content)
 
 # Global instance
 email_service = EmailNotificationService()
 
+def deliver_email(email_data):
+    """Render and send a single email described by email_data (runs on outbox workers)"""
+    email_type = email_data.get('type')
+    email_address = email_data.get('email')
+    
+    if email_type == 'welcome':
+        return email_service.send_welcome_email(
+            email_address, 
+            email_data.get('name')
+        )
+    elif email_type == 'order_confirmation':
+        return email_service.send_order_confirmation(
+            email_address,
+            email_data.get('customer_name'),
+            email_data.get('order'),
+            email_data.get('items'),
+            email_data.get('restaurant')
+        )
+    elif email_type == 'order_status':
+        return email_service.send_order_status_update(
+            email_address,
+            email_data.get('customer_name'),
+            email_data.get('order_id'),
+            email_data.get('status')
+        )
+    elif email_type == 'wallet_recharge':
+        return email_service.send_wallet_recharge_notification(
+            email_address,
+            email_data.get('customer_name'),
+            email_data.get('amount'),
+            email_data.get('new_balance'),
+            email_data.get('payment_method')
+        )
+    elif email_type == 'restaurant_welcome':
+        return email_service.send_restaurant_welcome(
+            email_address,
+            email_data.get('restaurant_name')
+        )
+    elif email_type == 'driver_welcome':
+        return email_service.send_driver_welcome(
+            email_address,
+            email_data.get('name')
+        )
+    elif email_type == 'new_order_restaurant':
+        return email_service.send_new_order_to_restaurant(
+            email_address,
+            email_data.get('customer_name'),
+            email_data.get('order'),
+            email_data.get('items')
+        )
+    elif email_type == 'new_order_digest':
+        return email_service.send_new_order_digest(
+            email_address,
+            email_data.get('events')
+        )
+    elif email_type == 'order_status_digest':
+        return email_service.send_order_status_digest(
+            email_address,
+            email_data.get('customer_name'),
+            email_data.get('events')
+        )
+    
+    return {'success': False, 'error': f"Unknown email type: {email_type}"}
+
+class EmailOutbox:
+    """Bounded in-memory email queue drained by a pool of background sender threads"""
+    
+    def __init__(self, deliver, workers=4, max_size=1000, max_retries=3, retry_backoff=2.0):
+        self.deliver = deliver
+        self.workers = workers
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.queue = queue.Queue(maxsize=max_size)
+        self._lock = threading.Lock()
+        self._pid = None
+        self._pending_retries = 0
+        
+        # Counters exposed through stats()
+        self.enqueued = 0
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.sent_inline = 0
+        self.send_time_total = 0.0
+        self.send_time_max = 0.0
+        self.wait_time_total = 0.0
+    
+    def _ensure_workers(self):
+        """Start the sender threads once per process (gunicorn forks after import)"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"email-outbox-{i}", daemon=True)
+                thread.start()
+            self._pid = os.getpid()
+    
+    def enqueue(self, email_data):
+        """Queue an email for background delivery; never blocks the request"""
+        self._ensure_workers()
+        job = {'email_data': email_data, 'attempts': 0, 'queued_at': time.monotonic()}
+        try:
+            self.queue.put_nowait(job)
+        except queue.Full:
+            # Outbox is saturated - deliver inline rather than dropping the email
+            print(f"⚠️ Email outbox full, sending inline to {email_data.get('email')}")
+            with self._lock:
+                self.sent_inline += 1
+            self._attempt(job)
+            return {'success': True, 'message': 'Email sent inline (outbox full)'}
+        
+        with self._lock:
+            self.enqueued += 1
+        return {'success': True, 'message': 'Email queued'}
+    
+    def _run(self):
+        while True:
+            job = self.queue.get()
+            try:
+                self._attempt(job)
+            except Exception as e:
+                print(f"❌ Email outbox worker error: {str(e)}")
+            finally:
+                self.queue.task_done()
+    
+    def _attempt(self, job):
+        job['attempts'] += 1
+        started = time.monotonic()
+        wait_time = started - job['queued_at']
+        
+        try:
+            result = self.deliver(job['email_data'])
+        except Exception as e:
+            result = {'success': False, 'error': str(e)}
+        
+        elapsed = time.monotonic() - started
+        with self._lock:
+            self.send_time_total += elapsed
+            self.send_time_max = max(self.send_time_max, elapsed)
+            self.wait_time_total += wait_time
+            if result.get('success'):
+                self.sent += 1
+                return result
+        
+        if job['attempts'] > self.max_retries:
+            with self._lock:
+                self.failed += 1
+            print(f"❌ Giving up on email to {job['email_data'].get('email')} after {job['attempts']} attempts")
+            return result
+        
+        # Retry with exponential backoff without holding a worker thread
+        delay = self.retry_backoff * (2 ** (job['attempts'] - 1))
+        with self._lock:
+            self.retried += 1
+            self._pending_retries += 1
+        timer = threading.Timer(delay, self._requeue, (job,))
+        timer.daemon = True
+        timer.start()
+        return result
+    
+    def _requeue(self, job):
+        with self._lock:
+            self._pending_retries -= 1
+        job['queued_at'] = time.monotonic()
+        try:
+            self.queue.put(job, timeout=5)
+        except queue.Full:
+            self._attempt(job)
+    
+    def flush(self, timeout=10.0):
+        """Wait until queued emails (and scheduled retries) are delivered or timeout expires"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._lock:
+                idle = self.queue.unfinished_tasks == 0 and self._pending_retries == 0
+            if idle or self._pid != os.getpid():
+                return True
+            time.sleep(0.05)
+        return False
+    
+    def stats(self):
+        """Queue depth and send latency counters"""
+        with self._lock:
+            attempts = self.sent + self.failed + self.retried
+            return {
+                'queue_depth': self.queue.qsize(),
+                'pending_retries': self._pending_retries,
+                'workers': self.workers,
+                'enqueued': self.enqueued,
+                'sent': self.sent,
+                'failed': self.failed,
+                'retried': self.retried,
+                'sent_inline': self.sent_inline,
+                'avg_send_ms': round(self.send_time_total / attempts * 1000, 2) if attempts else 0.0,
+                'max_send_ms': round(self.send_time_max * 1000, 2),
+                'avg_queue_wait_ms': round(self.wait_time_total / attempts * 1000, 2) if attempts else 0.0
+            }
+
+email_outbox = EmailOutbox(
+    deliver_email,
+    workers=int(os.environ.get('EMAIL_WORKERS', '4')),
+    max_size=int(os.environ.get('EMAIL_QUEUE_SIZE', '1000')),
+    max_retries=int(os.environ.get('EMAIL_MAX_RETRIES', '3')),
+    retry_backoff=float(os.environ.get('EMAIL_RETRY_BACKOFF', '2'))
+)
+
+# Email types that may be folded into a digest, and the digest type they become.
+# The outbox table drain does the folding (see drain_outbox in app.py)
+DIGEST_TYPES = {
+    'new_order_restaurant': 'new_order_digest',
+    'order_status': 'order_status_digest'
+}
+
+def build_digest(events):
+    """Fold events for one recipient and type into a single email (a lone event is left as is)"""
+    first = events[0]
+    if len(events) == 1:
+        return first
+    return {
+        'type': DIGEST_TYPES[first['type']],
+        'email': first.get('email'),
+        'customer_name': first.get('customer_name'),
+        'events': events
+    }
+
+def deliver_email_batch(batch):
+    """Deliver a batch of email_data dicts synchronously, folding digestible ones per recipient
+    
+    Used by the outbox table drain. Returns one result per input, in order; events that
+    were folded into a digest share the digest's result.
+    """
+    results = [None] * len(batch)
+    groups = {}
+    
+    for index, email_data in enumerate(batch):
+        if email_data.get('type') in DIGEST_TYPES:
+            key = (email_data.get('email'), email_data.get('type'))
+            groups.setdefault(key, []).append(index)
+        else:
+            results[index] = deliver_email(email_data)
+    
+    for indexes in groups.values():
+        events = [batch[index] for index in indexes]
+        try:
+            result = deliver_email(build_digest(events))
+        except Exception as e:
+            result = {'success': False, 'error': str(e)}
+        for index in indexes:
+            results[index] = result
+    
+    return results
+
+# On graceful shutdown: give queued emails a chance to go out, then hang up
+atexit.register(email_service.pool.close_all)
+atexit.register(email_outbox.flush)
+
 def send_notification(user_id, message, notification_type="info", email_data=None):
-    """Enhanced notification function with email support"""
+    """Enhanced notification function with email support (emails are queued, not sent inline)"""
     print(f"📱 NOTIFICATION [{notification_type.upper()}] to User {user_id}: {message}")
     
-    # If email_data is provided, send email notification
+    # If email_data is provided, hand the email to the background outbox
     if email_data:
-        email_type = email_data.get('type')
-        email_address = email_data.get('email')
-        
-        if email_type == 'welcome':
-            return email_service.send_welcome_email(
-                email_address, 
-                email_data.get('name')
-            )
-        elif email_type == 'order_confirmation':
-            return email_service.send_order_confirmation(
-                email_address,
-                email_data.get('customer_name'),
-                email_data.get('order'),
-                email_data.get('items'),
-                email_data.get('restaurant')
-            )
-        elif email_type == 'order_status':
-            return email_service.send_order_status_update(
-                email_address,
-                email_data.get('customer_name'),
-                email_data.get('order_id'),
-                email_data.get('status')
-            )
-        elif email_type == 'wallet_recharge':
-            return email_service.send_wallet_recharge_notification(
-                email_address,
-                email_data.get('customer_name'),
-                email_data.get('amount'),
-                email_data.get('new_balance'),
-                email_data.get('payment_method')
-            )
-        elif email_type == 'restaurant_welcome':
-            return email_service.send_restaurant_welcome(
-                email_address,
-                email_data.get('restaurant_name')
-            )
-        elif email_type == 'driver_welcome':
-            return email_service.send_driver_welcome(
-                email_address,
-                email_data.get('name')
-            )
-        elif email_type == 'new_order_restaurant':
-            return email_service.send_new_order_to_restaurant(
-                email_address,
-                email_data.get('customer_name'),
-                email_data.get('order'),
-                email_data.get('items')
-            )
+        return email_outbox.enqueue(email_data)
     
     return {'success': True, 'message': 'Console notification sent'}
\ No newline at end of file
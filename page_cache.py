@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+MsosiHub Page Cache
+In-memory full-page cache for anonymous GET pages, invalidated by surrogate-key tags
+"""
+
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import wraps
+from flask import request, session, g, make_response
+
+
+class CachedPage:
+    """A rendered response body plus what is needed to replay it"""
+    __slots__ = ("body", "etag", "content_type", "tags", "expires_at")
+
+    def __init__(self, body, etag, content_type, tags, expires_at):
+        self.body = body
+        self.etag = etag
+        self.content_type = content_type
+        self.tags = tags
+        self.expires_at = expires_at
+
+
+class PageCache:
+    """LRU of rendered pages with a tag -> keys index for surrogate-key purges
+
+    The cache lives in the worker process; ttl bounds how long another worker's
+    purge can go unnoticed when running several of them.
+    """
+
+    def __init__(self, max_entries=None, ttl=None):
+        self.max_entries = max_entries or int(os.getenv('PAGE_CACHE_SIZE', 512))
+        self.ttl = ttl if ttl is not None else float(os.getenv('PAGE_CACHE_TTL', 300))
+        self.enabled = self.ttl > 0
+        self.entries = OrderedDict()
+        self.tag_index = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.purged = 0
+
+    def get(self, key):
+        """Cached page for key, or None on a miss or an expired entry"""
+        with self.lock:
+            page = self.entries.get(key)
+            if page is None or page.expires_at < time.monotonic():
+                if page is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return page
+
+    def set(self, key, body, content_type, tags):
+        """Store a rendered page under key, tagged for later purges"""
+        page = CachedPage(body, hashlib.md5(body).hexdigest(), content_type, frozenset(tags),
+                          time.monotonic() + self.ttl)
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = page
+            for tag in page.tags:
+                self.tag_index.setdefault(tag, set()).add(key)
+            while len(self.entries) > self.max_entries:
+                self._remove(next(iter(self.entries)))
+        return page
+
+    def purge(self, *tags):
+        """Drop every page carrying any of tags; returns how many were dropped"""
+        with self.lock:
+            keys = set()
+            for tag in tags:
+                keys |= self.tag_index.get(tag, set())
+            for key in keys:
+                self._remove(key)
+            self.purged += len(keys)
+            return len(keys)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.tag_index.clear()
+
+    def _remove(self, key):
+        page = self.entries.pop(key)
+        for tag in page.tags:
+            keys = self.tag_index.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.tag_index[tag]
+
+    def stats(self):
+        """Snapshot of cache effectiveness for the admin metrics endpoint"""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self.entries),
+                "tags": len(self.tag_index),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+                "purged": self.purged,
+            }
+
+
+page_cache = PageCache()
+
+
+def add_cache_tags(*tags):
+    """Tag the page being rendered, from inside a cached view"""
+    g.setdefault('page_cache_tags', set()).update(tags)
+
+
+def request_is_cacheable():
+    """Only anonymous GETs with nothing per-visitor in the session get shared pages"""
+    if not page_cache.enabled or request.method not in ('GET', 'HEAD'):
+        return False
+    return not any(key in session for key in ('user_id', 'cart_id', '_flashes'))
+
+
+def cached_page(*tags):
+    """Serve a view from the page cache for anonymous visitors
+
+    The key is the path plus the sorted query string. tags are added to whatever the
+    view registers with add_cache_tags(); a view arg in braces, like 'restaurant:{restaurant_id}',
+    is filled in from the URL. Pages that set a cookie, used a CSRF token or were not a
+    200 are never stored. Every response from here carries an ETag and answers
+    If-None-Match with 304.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if not request_is_cacheable():
+                return f(*args, **kwargs)
+
+            key = request.path + "?" + "&".join(f"{k}={v}" for k, v in sorted(request.args.items(multi=True)))
+            page = page_cache.get(key)
+            status = "HIT"
+
+            if page is None:
+                status = "MISS"
+                g.page_cache_tags = set()
+                response = make_response(f(*args, **kwargs))
+                uncacheable = (
+                    response.status_code != 200
+                    or response.direct_passthrough
+                    or 'Set-Cookie' in response.headers
+                    or 'csrf_token' in g
+                    or session.modified
+                )
+                if uncacheable:
+                    return response
+                page_tags = {tag.format(**kwargs) for tag in tags} | g.get('page_cache_tags', set())
+                page = page_cache.set(key, response.get_data(), response.content_type, page_tags)
+
+            response = make_response(page.body)
+            response.content_type = page.content_type
+            response.set_etag(page.etag)
+            response.headers['Cache-Control'] = 'no-cache'  # browsers revalidate with the ETag
+            response.headers['X-Cache'] = status
+            return response.make_conditional(request)
+        return decorated_function
+    return decorator
\ No newline at end of file
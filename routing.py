@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+MsosiHub Routing
+Orders a driver's pickups and dropoffs with nearest-neighbour plus 2-opt, cached per driver
+"""
+
+import threading
+
+from driver_locations import haversine_km
+
+PICKUP = "pickup"
+DROPOFF = "dropoff"
+
+
+class Stop:
+    """One place a driver has to visit for an order: the restaurant or the customer"""
+    __slots__ = ("order_id", "kind", "latitude", "longitude")
+
+    def __init__(self, order_id, kind, latitude, longitude):
+        self.order_id = order_id
+        self.kind = kind
+        self.latitude = latitude
+        self.longitude = longitude
+
+    @property
+    def key(self):
+        return (self.order_id, self.kind)
+
+    def to_dict(self):
+        return {"order_id": self.order_id, "type": self.kind, "lat": self.latitude, "lng": self.longitude}
+
+
+def distance_matrix(points):
+    """Haversine distances between every pair of (latitude, longitude) points"""
+    size = len(points)
+    matrix = [[0.0] * size for _ in range(size)]
+    for i in range(size):
+        for j in range(i + 1, size):
+            matrix[i][j] = matrix[j][i] = haversine_km(*points[i], *points[j])
+    return matrix
+
+
+def route_length(route, matrix):
+    """Kilometres from the start (node 0) through the route's nodes, without returning"""
+    total, previous = 0.0, 0
+    for node in route:
+        total += matrix[previous][node]
+        previous = node
+    return total
+
+
+def precedence(stops):
+    """{dropoff node: pickup node} for orders with both stops; nodes are stop index + 1"""
+    pickups = {stop.order_id: node for node, stop in enumerate(stops, 1) if stop.kind == PICKUP}
+    return {node: pickups[stop.order_id] for node, stop in enumerate(stops, 1)
+            if stop.kind == DROPOFF and stop.order_id in pickups}
+
+
+def is_feasible(route, pickup_of):
+    position = {node: index for index, node in enumerate(route)}
+    return all(position[pickup] < position[dropoff] for dropoff, pickup in pickup_of.items())
+
+
+def nearest_neighbour(matrix, pickup_of):
+    """Route that always drives to the nearest stop allowed next (no dropoff before its pickup)"""
+    remaining = set(range(1, len(matrix)))
+    route, current = [], 0
+    while remaining:
+        allowed = [node for node in remaining if pickup_of.get(node) not in remaining]
+        current = min(allowed, key=lambda node: (matrix[current][node], node))
+        route.append(current)
+        remaining.remove(current)
+    return route
+
+
+def two_opt(route, matrix, pickup_of):
+    """Reverse route segments while that shortens it and keeps every pickup before its dropoff
+
+    The path is open: it starts at node 0 and ends at the last stop. Distances are
+    symmetric, so a reversal only changes the two edges at the segment's ends.
+    """
+    route = list(route)
+    improved = True
+    while improved:
+        improved = False
+        for i in range(len(route) - 1):
+            before = route[i - 1] if i else 0
+            for j in range(i + 1, len(route)):
+                first, last = route[i], route[j]
+                delta = matrix[before][last] - matrix[before][first]
+                if j + 1 < len(route):
+                    after = route[j + 1]
+                    delta += matrix[first][after] - matrix[last][after]
+                if delta < -1e-9:
+                    candidate = route[:i] + route[i:j + 1][::-1] + route[j + 1:]
+                    if is_feasible(candidate, pickup_of):
+                        route = candidate
+                        improved = True
+                        break
+            if improved:
+                break
+    return route
+
+
+def cheapest_insertion(route, node, matrix, earliest=0):
+    """route with node inserted where it adds the least distance, at index earliest or later"""
+    best_index, best_cost = len(route), None
+    for index in range(earliest, len(route) + 1):
+        previous = route[index - 1] if index else 0
+        cost = matrix[previous][node]
+        if index < len(route):
+            cost += matrix[node][route[index]] - matrix[previous][route[index]]
+        if best_cost is None or cost < best_cost:
+            best_index, best_cost = index, cost
+    return route[:best_index] + [node] + route[best_index:]
+
+
+class RoutePlan:
+    """A driver's stops in visiting order, with the leg lengths from where they were last seen"""
+    __slots__ = ("stops", "legs", "total_km")
+
+    def __init__(self, stops, legs):
+        self.stops = stops
+        self.legs = legs
+        self.total_km = sum(legs)
+
+
+class RoutePlanner:
+    """Latest route of every driver carrying orders, kept in step with their stops
+
+    route() is given the driver's current position and outstanding stops. The first
+    call plans from scratch; later calls start from the cached order, drop the stops
+    that were done, insert new orders' stops where they cost least and run 2-opt
+    over the result, so a driver's route does not reshuffle on every poll. Plans live
+    in the worker process, like the LocationStore.
+    """
+
+    def __init__(self):
+        self.plans = {}
+        self.lock = threading.Lock()
+        self.full_plans = 0
+        self.incremental_updates = 0
+        self.cache_hits = 0
+
+    def route(self, driver_id, start, stops):
+        """RoutePlan for stops, visited from start (latitude, longitude)"""
+        if not stops:
+            self.forget(driver_id)
+            return RoutePlan([], [])
+
+        with self.lock:
+            cached = self.plans.get(driver_id)
+            by_key = {stop.key: stop for stop in stops}
+            if cached is None:
+                order = self._plan(start, stops)
+                self.full_plans += 1
+            elif {stop.key for stop in cached} == set(by_key):
+                order = [by_key[stop.key] for stop in cached]
+                self.cache_hits += 1
+            else:
+                order = self._update(start, [by_key[stop.key] for stop in cached if stop.key in by_key],
+                                     [stop for stop in stops if stop.key not in {kept.key for kept in cached}])
+                self.incremental_updates += 1
+            self.plans[driver_id] = order
+
+        points = [start] + [(stop.latitude, stop.longitude) for stop in order]
+        legs = [haversine_km(*points[i], *points[i + 1]) for i in range(len(order))]
+        return RoutePlan(order, legs)
+
+    def _plan(self, start, stops):
+        matrix = distance_matrix([start] + [(stop.latitude, stop.longitude) for stop in stops])
+        pickup_of = precedence(stops)
+        route = two_opt(nearest_neighbour(matrix, pickup_of), matrix, pickup_of)
+        return [stops[node - 1] for node in route]
+
+    def _update(self, start, kept, added):
+        # Pickups go in first, so a new order's dropoff can be placed after its pickup
+        added = sorted(added, key=lambda stop: stop.kind != PICKUP)
+        stops = kept + added
+        matrix = distance_matrix([start] + [(stop.latitude, stop.longitude) for stop in stops])
+        pickup_of = precedence(stops)
+        route = list(range(1, len(kept) + 1))
+        for node in range(len(kept) + 1, len(stops) + 1):
+            earliest = route.index(pickup_of[node]) + 1 if node in pickup_of else 0
+            route = cheapest_insertion(route, node, matrix, earliest)
+        route = two_opt(route, matrix, pickup_of)
+        return [stops[node - 1] for node in route]
+
+    def forget(self, driver_id):
+        with self.lock:
+            self.plans.pop(driver_id, None)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "drivers": len(self.plans),
+                "full_plans": self.full_plans,
+                "incremental_updates": self.incremental_updates,
+                "cache_hits": self.cache_hits,
+            }
\ No newline at end of file
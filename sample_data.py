@@ -18,6 +18,8 @@ def create_sample_data():
                 "restaurant_name": "Healthy Bites Tanzania",
                 "description": "Fresh, organic, and locally sourced healthy meals for the modern Tanzanian",
                 "address": "Masaki, Dar es Salaam",
+                "latitude": -6.7476,
+                "longitude": 39.2793,
                 "phone": "+255 754 123 001",
                 "dishes": [
                     {"title": "Quinoa Power Bowl", "description": "Quinoa with roasted vegetables, avocado, and tahini dressing", "price": 15000, "category": "Bowls"},
@@ -32,6 +34,8 @@ def create_sample_data():
                 "restaurant_name": "Mama Vitamu Kitchen",
                 "description": "Traditional Tanzanian dishes made healthy with modern cooking techniques",
                 "address": "Mikocheni, Dar es Salaam",
+                "latitude": -6.7633,
+                "longitude": 39.2487,
                 "phone": "+255 754 123 002",
                 "dishes": [
                     {"title": "Whole Grain Ugali with Sukuma Wiki", "description": "Nutritious whole grain ugali with organic sukuma wiki", "price": 8000, "category": "Traditional"},
@@ -46,6 +50,8 @@ def create_sample_data():
                 "restaurant_name": "Ocean Fresh Seafood",
                 "description": "Fresh seafood from the Indian Ocean, prepared with health-conscious methods",
                 "address": "Msasani Peninsula, Dar es Salaam",
+                "latitude": -6.7358,
+                "longitude": 39.2712,
                 "phone": "+255 754 123 003",
                 "dishes": [
                     {"title": "Grilled Salmon", "description": "Fresh salmon grilled with lemon and herbs", "price": 25000, "category": "Seafood"},
@@ -60,6 +66,8 @@ def create_sample_data():
                 "restaurant_name": "Green Garden Vegetarian",
                 "description": "100% plant-based healthy meals for vegetarians and vegans",
                 "address": "Kariakoo, Dar es Salaam",
+                "latitude": -6.8196,
+                "longitude": 39.2737,
                 "phone": "+255 754 123 004",
                 "dishes": [
                     {"title": "Buddha Bowl", "description": "Mixed vegetables, chickpeas, quinoa, and tahini", "price": 14000, "category": "Bowls"},
@@ -74,6 +82,8 @@ def create_sample_data():
                 "restaurant_name": "Fitness Fuel Station",
                 "description": "High-protein, low-carb meals designed for fitness enthusiasts",
                 "address": "Oyster Bay, Dar es Salaam",
+                "latitude": -6.7788,
+                "longitude": 39.2929,
                 "phone": "+255 754 123 005",
                 "dishes": [
                     {"title": "Protein Power Plate", "description": "Grilled chicken, quinoa, and steamed broccoli", "price": 18000, "category": "Fitness"},
@@ -114,11 +124,18 @@ def create_sample_data():
                     name=restaurant_data["restaurant_name"],
                     description=restaurant_data["description"],
                     address=restaurant_data["address"],
-                    phone=restaurant_data["phone"]
+                    phone=restaurant_data["phone"],
+                    latitude=restaurant_data["latitude"],
+                    longitude=restaurant_data["longitude"]
                 )
                 db.session.add(restaurant)
                 db.session.commit()
                 print(f"✅ Created restaurant: {restaurant.name}")
+            elif restaurant.latitude is None:
+                # Restaurants created before coordinates existed
+                restaurant.latitude = restaurant_data["latitude"]
+                restaurant.longitude = restaurant_data["longitude"]
+                db.session.commit()
             
             # Create dishes
             for dish_data in restaurant_data["dishes"]:
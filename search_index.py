@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+MsosiHub Search Index
+SQLite FTS5 tables kept in sync with the user, restaurant, order and dish tables by triggers
+"""
+
+import re
+from sqlalchemy import text, table, column, Integer
+
+# FTS table -> (content table, indexed columns)
+SEARCH_TABLES = {
+    'user_fts': ('user', ['username', 'email', 'first_name', 'last_name', 'phone']),
+    'restaurant_fts': ('restaurant', ['name', 'address', 'phone']),
+    'order_fts': ('order', ['phone', 'delivery_address']),
+    'dish_fts': ('dish', ['title', 'description', 'category']),
+}
+
+# bm25 column weights, for tables where some columns matter more than others
+RANK_FUNCTIONS = {
+    'dish_fts': 'bm25(10.0, 1.0, 5.0)',  # title, description, category
+}
+
+# Engines whose database has every FTS table installed, keyed by URL
+_installed = {}
+
+# Terms matching more rows than this are treated as broad (see selective_ids)
+MATCH_CAP = 1000
+
+def fts5_available(connection):
+    """True when this SQLite build was compiled with FTS5"""
+    if connection.dialect.name != 'sqlite':
+        return False
+    options = connection.execute(text("PRAGMA compile_options")).scalars().all()
+    return 'ENABLE_FTS5' in options
+
+def table_ddl(fts_table):
+    """CREATE statements for one external-content FTS table and the triggers that maintain it"""
+    content_table, columns = SEARCH_TABLES[fts_table]
+    column_list = ", ".join(columns)
+    new_values = ", ".join(f"new.{column}" for column in columns)
+    old_values = ", ".join(f"old.{column}" for column in columns)
+
+    return [
+        # prefix='2 3' keeps short prefix queries (typeahead) off the full-scan path
+        f"""CREATE VIRTUAL TABLE IF NOT EXISTS {fts_table} USING fts5(
+            {column_list}, content='{content_table}', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )""",
+        f"""CREATE TRIGGER IF NOT EXISTS {fts_table}_ai AFTER INSERT ON "{content_table}" BEGIN
+            INSERT INTO {fts_table}(rowid, {column_list}) VALUES (new.id, {new_values});
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {fts_table}_ad AFTER DELETE ON "{content_table}" BEGIN
+            INSERT INTO {fts_table}({fts_table}, rowid, {column_list}) VALUES ('delete', old.id, {old_values});
+        END""",
+        # Only searchable columns re-index a row; wallet and status updates leave the index alone
+        f"""CREATE TRIGGER IF NOT EXISTS {fts_table}_au AFTER UPDATE OF {column_list} ON "{content_table}" BEGIN
+            INSERT INTO {fts_table}({fts_table}, rowid, {column_list}) VALUES ('delete', old.id, {old_values});
+            INSERT INTO {fts_table}(rowid, {column_list}) VALUES (new.id, {new_values});
+        END""",
+    ]
+
+def install(engine):
+    """Create the FTS tables and triggers; returns the tables that did not exist yet
+
+    Newly created tables start empty and need rebuild() to index existing rows.
+    Returns None when FTS5 is not available (other databases, or SQLite without FTS5).
+    """
+    with engine.begin() as connection:
+        if not fts5_available(connection):
+            return None
+
+        existing = set(connection.execute(text("SELECT name FROM sqlite_master WHERE type = 'table'")).scalars())
+        created = [fts_table for fts_table in SEARCH_TABLES if fts_table not in existing]
+        for fts_table in SEARCH_TABLES:
+            for statement in table_ddl(fts_table):
+                connection.execute(text(statement))
+            if fts_table in RANK_FUNCTIONS:
+                # Stored in the FTS table's config, so ORDER BY rank uses the weights
+                connection.execute(
+                    text(f"INSERT INTO {fts_table}({fts_table}, rank) VALUES ('rank', :rank)"),
+                    {"rank": RANK_FUNCTIONS[fts_table]}
+                )
+
+    _installed[str(engine.url)] = True
+    return created
+
+def rebuild(engine, tables=None):
+    """Re-index every row of the content tables from scratch"""
+    with engine.begin() as connection:
+        for fts_table in tables or SEARCH_TABLES:
+            connection.execute(text(f"INSERT INTO {fts_table}({fts_table}) VALUES ('rebuild')"))
+
+def is_installed(engine):
+    """True when the search views can use the FTS tables on this engine
+
+    A missing index is looked for again on the next call, so running
+    `flask rebuild-search-index` takes effect without a restart.
+    """
+    key = str(engine.url)
+    if not _installed.get(key):
+        if engine.dialect.name != 'sqlite':
+            return False
+        with engine.connect() as connection:
+            existing = set(connection.execute(text("SELECT name FROM sqlite_master WHERE type = 'table'")).scalars())
+        _installed[key] = all(fts_table in existing for fts_table in SEARCH_TABLES)
+    return _installed[key]
+
+def match_expression(term):
+    """FTS5 query for a search box: every word must match as a prefix
+
+    Punctuation is dropped rather than passed through, so user input can never form
+    FTS5 syntax. Returns None when the term has nothing searchable in it.
+    """
+    tokens = re.findall(r"\w+", term or "")
+    if not tokens:
+        return None
+    return " ".join(f'"{token}"*' for token in tokens)
+
+def fts_table_clause(fts_table):
+    """Lightweight table for joining an FTS table in ORM queries (rowid, rank, MATCH column)"""
+    return table(fts_table, column('rowid', Integer), column('rank'), column(fts_table))
+
+def matching_ids(fts_table, term):
+    """SELECT of row ids matching term, for use in Model.id.in_(...)"""
+    return text(f"SELECT rowid FROM {fts_table} WHERE {fts_table} MATCH :query").bindparams(
+        query=match_expression(term)
+    ).columns(rowid=Integer)
+
+def selective_ids(connection, fts_table, term, cap=MATCH_CAP):
+    """Ids matching term, or None when more than cap rows match
+
+    Reading at most cap + 1 rowids is cheap; it is materializing, sorting or ranking
+    every match of a broad term that costs time.
+    """
+    ids = connection.execute(
+        text(f"SELECT rowid FROM {fts_table} WHERE {fts_table} MATCH :query LIMIT :limit"),
+        {"query": match_expression(term), "limit": cap + 1}
+    ).scalars().all()
+    return ids if len(ids) <= cap else None
+
+def ranked_ids(connection, fts_table, term, limit=10):
+    """Ids of the best matches for term, best first
+
+    Selective terms are ranked by bm25. A term matching more than MATCH_CAP rows
+    gets the newest matches instead, straight from the index in rowid order.
+    """
+    expression = match_expression(term)
+    if expression is None:
+        return []
+    if selective_ids(connection, fts_table, term) is None:
+        order = "rowid DESC"
+    else:
+        order = "rank"
+    return connection.execute(
+        text(f"SELECT rowid FROM {fts_table} WHERE {fts_table} MATCH :query ORDER BY {order} LIMIT :limit"),
+        {"query": expression, "limit": limit}
+    ).scalars().all()
\ No newline at end of file